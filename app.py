@@ -1,6 +1,9 @@
 import os
 from flask import Flask, g
-from extensions import db, migrate, login_manager, socketio, scheduler
+from extensions import db, migrate, login_manager, socketio
+from database import init_db
+from governor import governor
+from ratelimit import limiter
 from models import User
 
 
@@ -13,8 +16,10 @@ from routes.export  import export_bp
 from routes.view    import view_bp
 from routes.health  import health_bp
 from routes.schedule import schedule_bp
+from routes.assets  import assets_bp
+from routes.profiles import profiles_bp
 
-def create_app():
+def create_app(start_services=True):
     app = Flask(__name__, instance_relative_config=True)
 
     # 1) load default config from config.py
@@ -22,12 +27,16 @@ def create_app():
     # 2) override with instance/config.py if present
     app.config.from_pyfile('config.py', silent=True)
 
-    # initialize extensions
-    db.init_app(app)
+    # initialize extensions (init_db sets up the engine, then db.init_app)
+    init_db(app)
     migrate.init_app(app, db)
     login_manager.init_app(app)
-    socketio.init_app(app)
-    scheduler.start()
+    socketio.init_app(app, message_queue=app.config.get('SOCKETIO_MESSAGE_QUEUE'))
+    governor.init_app(app)
+    limiter.init_app(app)
+    from results import summary_cache
+    summary_cache.max_bytes = app.config.get('VIEW_CACHE_MAX_BYTES', summary_cache.max_bytes)
+    import websocket  # noqa: F401  registers the Socket.IO handlers
 
     # Flask-Login config
     login_manager.login_view = 'auth.login'
@@ -63,9 +72,22 @@ def create_app():
     app.register_blueprint(view_bp)
     app.register_blueprint(export_bp)
     app.register_blueprint(health_bp)
+    app.register_blueprint(assets_bp)
+    app.register_blueprint(profiles_bp)
     app.register_blueprint(schedule_bp, url_prefix='/schedule')
     app.register_blueprint(auth_bp, url_prefix='/auth')
 
+    from commands import scanner_cli
+    app.cli.add_command(scanner_cli)
+
+    # worker processes build the app with start_services=False so they don't
+    # run their own scheduler or drain the queue twice
+    if start_services:
+        from schedules import init_scheduler
+        init_scheduler(app)
+        from worker import start_embedded_workers
+        start_embedded_workers(app, app.config.get('SCAN_EMBEDDED_WORKERS', 1))
+
     return app
 
 if __name__ == '__main__':
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# benchmarks/fake_nmap.py
+#
+# Deterministic stand-in for nmap, so scanner benchmarks measure this app and
+# not the network. It accepts the command lines run_scan builds (-p, -oX,
+# -sn, -v, targets as addresses/CIDRs) and writes nmap-shaped -v output and
+# XML. Which hosts are up and which ports are open is a pure function of the
+# address, so every run of a benchmark sees the same results.
+#
+# Tuned through the environment:
+#
+#   FAKE_NMAP_UP_RATIO    fraction of addresses that are up         (0.5)
+#   FAKE_NMAP_OPEN        open ports per up host, from the -p list  (3)
+#   FAKE_NMAP_HOST_DELAY  seconds spent per host                    (0)
+#   FAKE_NMAP_PORT_DELAY  extra seconds per host x port probe       (0)
+#   FAKE_NMAP_SCRIPTS     1 = add http-title / ssl-cert script output (1)
+
+import os
+import sys
+import time
+import zlib
+import ipaddress
+
+# options that take a value, so the value isn't mistaken for a target
+VALUE_OPTS = {
+    '-p', '-oX', '-oN', '-oG', '-oA', '-e', '-S', '-D', '-g', '--max-rate', '--min-rate',
+    '--top-ports', '--script', '--script-args', '--exclude', '--stats-every',
+    '--max-retries', '--host-timeout', '--version-intensity', '--source-port',
+    '--min-hostgroup', '--max-hostgroup', '--min-parallelism', '--max-parallelism',
+}
+
+SERVICES = {21: 'ftp', 22: 'ssh', 23: 'telnet', 25: 'smtp', 53: 'domain', 80: 'http',
+            110: 'pop3', 143: 'imap', 443: 'https', 445: 'microsoft-ds',
+            3306: 'mysql', 3389: 'ms-wbt-server', 5432: 'postgresql', 8080: 'http-proxy'}
+PRODUCTS = {'ssh': ('OpenSSH', '9.6p1'), 'http': ('nginx', '1.25.3'),
+            'https': ('nginx', '1.25.3'), 'mysql': ('MySQL', '8.0.36')}
+
+
+def parse_args(argv):
+    opts, targets, flags = {}, [], set()
+    i = 0
+    while i < len(argv):
+        a = argv[i]
+        if a in VALUE_OPTS and i + 1 < len(argv):
+            opts[a] = argv[i + 1]
+            i += 2
+            continue
+        if a.startswith('-'):
+            flags.add(a)
+        else:
+            targets.append(a)
+        i += 1
+    return opts, flags, targets
+
+
+def parse_ports(spec):
+    """[(protocol, port)] from nmap -p syntax; nmap's default is its top 1000."""
+    if not spec:
+        return [('tcp', p) for p in range(1, 1001)]
+    ports, proto = [], 'tcp'
+    for part in spec.replace(' ', '').split(','):
+        if part[:2] in ('T:', 'U:', 'S:'):
+            proto = {'T': 'tcp', 'U': 'udp', 'S': 'sctp'}[part[0]]
+            part = part[2:]
+        if not part:
+            continue
+        lo, dash, hi = part.partition('-')
+        lo = int(lo or 1)
+        hi = int(hi or 65535) if dash else lo
+        ports.extend((proto, p) for p in range(lo, hi + 1))
+    return ports
+
+
+def expand(targets):
+    for t in targets:
+        try:
+            net = ipaddress.ip_network(t, strict=False)
+        except ValueError:
+            continue
+        # nmap scans a CIDR's network and broadcast addresses too
+        yield from net
+
+
+def score(addr, salt=0):
+    """Stable pseudo-random number in [0, 1) for an address."""
+    return (zlib.crc32(addr.packed + bytes([salt])) & 0xffffffff) / 2**32
+
+
+def host_xml(addr, ports, open_count, scripts, sn):
+    ip = str(addr)
+    kind = 'ipv6' if addr.version == 6 else 'ipv4'
+    out = [f'<host starttime="1" endtime="2"><status state="up" reason="syn-ack" reason_ttl="64"/>'
+           f'<address addr="{ip}" addrtype="{kind}"/>'
+           f'<hostnames><hostname name="host-{ip.replace(":", "-").replace(".", "-")}.bench" type="PTR"/></hostnames>']
+    opened = []
+    if not sn and ports:
+        start = int(score(addr, 1) * len(ports))
+        opened = [ports[(start + k * 7) % len(ports)] for k in range(min(open_count, len(ports)))]
+        opened = sorted(set(opened), key=lambda x: (x[0], x[1]))
+        out.append('<ports>')
+        closed = len(ports) - len(opened)
+        if closed:
+            out.append(f'<extraports state="closed" count="{closed}">'
+                       f'<extrareasons reason="reset" count="{closed}"/></extraports>')
+        for proto, port in opened:
+            name = SERVICES.get(port, 'unknown')
+            product, version = PRODUCTS.get(name, ('', ''))
+            svc = f'<service name="{name}" method="probed" conf="10"'
+            if product:
+                svc += f' product="{product}" version="{version}"'
+            svc += '/>'
+            script = ''
+            if scripts and name in ('http', 'https', 'http-proxy'):
+                script = f'<script id="http-title" output="Welcome to {ip}"/>'
+            if scripts and name == 'https':
+                script += f'<script id="ssl-cert" output="Subject: commonName={ip}&#xa;Issuer: bench"/>'
+            out.append(f'<port protocol="{proto}" portid="{port}"><state state="open" '
+                       f'reason="syn-ack" reason_ttl="64"/>{svc}{script}</port>')
+        out.append('</ports>')
+    out.append('<times srtt="500" rttvar="100" to="100000"/></host>\n')
+    return "".join(out), opened
+
+
+def main(argv):
+    opts, flags, targets = parse_args(argv)
+    sn      = '-sn' in flags
+    ports   = [] if sn else parse_ports(opts.get('-p'))
+    ratio   = float(os.environ.get('FAKE_NMAP_UP_RATIO', '0.5'))
+    nopen   = int(os.environ.get('FAKE_NMAP_OPEN', '3'))
+    hdelay  = float(os.environ.get('FAKE_NMAP_HOST_DELAY', '0'))
+    pdelay  = float(os.environ.get('FAKE_NMAP_PORT_DELAY', '0'))
+    scripts = os.environ.get('FAKE_NMAP_SCRIPTS', '1') == '1'
+
+    xml_path = opts.get('-oX')
+    to_stdout = xml_path == '-'
+    xml = sys.stdout if to_stdout else open(xml_path, 'w') if xml_path else None
+    verbose = not to_stdout and any(f.startswith('-v') for f in flags)
+
+    def say(text):
+        if not to_stdout:
+            print(text, flush=True)
+
+    addrs = list(expand(targets))
+    started = time.time()
+    if xml:
+        xml.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        xml.write(f'<nmaprun scanner="nmap" args="nmap {" ".join(argv)}" start="{int(started)}" '
+                  f'version="7.94" xmloutputversion="1.05">\n')
+        xml.flush()
+    say(f"Starting Nmap 7.94 ( https://nmap.org ) (fake) for {len(addrs)} address(es)")
+    if verbose and ports:
+        say(f"Scanning {len(addrs)} hosts [{len(ports)} ports/host]")
+
+    up = 0
+    step = max(len(addrs) // 20, 1)
+    for n, addr in enumerate(addrs, 1):
+        if hdelay or pdelay:
+            time.sleep(hdelay + pdelay * len(ports))
+        if score(addr) < ratio:
+            up += 1
+            text, opened = host_xml(addr, ports, nopen, scripts, sn)
+            if xml:
+                xml.write(text)
+                xml.flush()
+            if verbose:
+                for proto, port in opened:
+                    say(f"Discovered open port {port}/{proto} on {addr}")
+        if verbose and (n % step == 0 or n == len(addrs)):
+            pct = 100.0 * n / max(len(addrs), 1)
+            say(f"SYN Stealth Scan Timing: About {pct:.2f}% done; ETC: 00:00 (0:00:00 remaining)")
+
+    elapsed = time.time() - started
+    if xml:
+        xml.write(f'<runstats><finished time="{int(time.time())}" elapsed="{elapsed:.2f}" '
+                  f'summary="Nmap done; {len(addrs)} IP addresses ({up} hosts up)" exit="success"/>'
+                  f'<hosts up="{up}" down="{len(addrs) - up}" total="{len(addrs)}"/></runstats>\n'
+                  '</nmaprun>\n')
+        xml.flush()
+        if not to_stdout:
+            xml.close()
+    say(f"Nmap done: {len(addrs)} IP addresses ({up} hosts up) scanned in {elapsed:.2f} seconds")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
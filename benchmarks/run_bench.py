@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+# benchmarks/run_bench.py
+#
+# End-to-end scanner benchmark. Each scenario runs run_scan against
+# fake_nmap.py on a throwaway SQLite database and records:
+#
+#   * scans/sec and hosts/sec for the whole scan (queue-to-Completed)
+#   * peak RSS of this process while the scan ran
+#   * Socket.IO emits and emits/sec
+#   * time spent in INSERT/UPDATE/DELETE statements (DB write time)
+#   * latency of the report page and the CSV / JSON exports afterwards
+#
+# Results go to a JSON file (benchmarks/results/<timestamp>.json by default);
+# --baseline prints each metric against an earlier file to catch regressions.
+#
+#   python benchmarks/run_bench.py                       # 1, 256, 65536 hosts
+#   python benchmarks/run_bench.py --sizes 1,256 --repeat 3 --baseline old.json
+
+import os
+import sys
+import json
+import time
+import stat
+import shutil
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import ipaddress
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+
+# lower is better for these; the rest are rates where higher is better
+LOWER_IS_BETTER = ('elapsed', 'peak_rss_mb', 'db_write_seconds', 'view_ms',
+                   'export_csv_ms', 'export_json_ms')
+
+
+class RssSampler(threading.Thread):
+    """Samples this process's resident set size; peak is in MB."""
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak     = current_rss_mb()
+        self._done     = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            self.peak = max(self.peak, current_rss_mb())
+
+    def stop(self):
+        self._done.set()
+        self.join()
+        self.peak = max(self.peak, current_rss_mb())
+        return round(self.peak, 1)
+
+
+def current_rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024.0 * 1024.0) if sys.platform == 'darwin' else peak / 1024.0
+
+
+def network_for(hosts):
+    """A target with about ``hosts`` scannable addresses."""
+    if hosts <= 1:
+        return '10.200.0.1'
+    prefix = 32
+    while (2 ** (32 - prefix)) - 2 < hosts:
+        prefix -= 1
+    return str(ipaddress.ip_network(f'10.200.0.0/{prefix}'))
+
+
+def install_fake_nmap(bin_dir):
+    """Put fake_nmap.py on PATH as ``nmap``."""
+    target = os.path.join(bin_dir, 'nmap')
+    with open(target, 'w') as f:
+        f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.join(HERE, "fake_nmap.py")}" "$@"\n')
+    os.chmod(target, os.stat(target).st_mode | stat.S_IEXEC | stat.S_IXGRP | stat.S_IXOTH)
+    os.environ['PATH'] = bin_dir + os.pathsep + os.environ.get('PATH', '')
+
+
+def git_version():
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'], cwd=ROOT, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def build_app(db_path, args):
+    os.environ['DATABASE_URL'] = 'sqlite:///' + db_path
+    # raw archives go next to the scratch database, not into instance/
+    os.environ['BLOB_STORE_PATH'] = os.path.join(os.path.dirname(db_path), 'blobs')
+    os.environ['SCAN_EMBEDDED_WORKERS'] = '0'
+    sys.path.insert(0, ROOT)
+    from app import create_app
+    from extensions import db
+
+    app = create_app(start_services=False)
+    app.config.update(
+        LOGIN_DISABLED=True,
+        TESTING=True,
+        SCAN_ENGINE=args.engine,
+        SCAN_HOST_DISCOVERY=not args.no_discovery,
+    )
+    with app.app_context():
+        db.create_all()
+    return app
+
+
+class Meter:
+    """Counts Socket.IO emits and times write statements for one scenario."""
+
+    def __init__(self, app):
+        from sqlalchemy import event
+        from extensions import db, socketio
+
+        self.emits = 0
+        self.write_seconds = 0.0
+        self._lock = threading.Lock()
+
+        emit = socketio.emit
+
+        def counting_emit(*a, **kw):
+            with self._lock:
+                self.emits += 1
+            return emit(*a, **kw)
+        socketio.emit = counting_emit
+
+        with app.app_context():
+            engine = db.engine
+
+        @event.listens_for(engine, 'before_cursor_execute')
+        def before(conn, cursor, statement, params, context, executemany):
+            conn.info.setdefault('bench_started', []).append(time.perf_counter())
+
+        @event.listens_for(engine, 'after_cursor_execute')
+        def after(conn, cursor, statement, params, context, executemany):
+            began = conn.info['bench_started'].pop()
+            if statement.lstrip()[:6].upper() in ('INSERT', 'UPDATE', 'DELETE'):
+                with self._lock:
+                    self.write_seconds += time.perf_counter() - began
+
+    def reset(self):
+        with self._lock:
+            self.emits, self.write_seconds = 0, 0.0
+
+
+def timed_get(client, url, repeat=3):
+    """Best-of-``repeat`` latency of a GET in ms (the body is fully read)."""
+    best = None
+    for _ in range(repeat):
+        began = time.perf_counter()
+        resp = client.get(url)
+        b''.join(resp.response)
+        took = (time.perf_counter() - began) * 1000
+        if resp.status_code != 200:
+            raise RuntimeError(f"GET {url} returned {resp.status_code}")
+        best = took if best is None else min(best, took)
+    return round(best, 2)
+
+
+def run_scenario(app, meter, mode, hosts, ports, flags, threads, repeat):
+    from extensions import db
+    from models import ScanResult, ScanPort
+    from scanner import run_scan
+
+    target = network_for(hosts)
+    runs = []
+    for _ in range(repeat):
+        with app.app_context():
+            scan = ScanResult(target=target, ports=ports, flags=flags, mode=mode, status='Queued')
+            db.session.add(scan)
+            db.session.commit()
+            scan_id = scan.id
+
+        meter.reset()
+        rss = RssSampler()
+        rss.start()
+        began = time.perf_counter()
+        run_scan(app, scan_id, target, ports, flags, mode, threads)
+        elapsed = time.perf_counter() - began
+        peak = rss.stop()
+
+        with app.app_context():
+            scan = db.session.get(ScanResult, scan_id)
+            if scan.status != 'Completed':
+                raise RuntimeError(f"{mode} scan of {target} ended {scan.status}")
+            up = scan.hosts.count()
+            open_ports = ScanPort.query.filter_by(scan_id=scan_id).count()
+
+        client = app.test_client()
+        runs.append({
+            'scan_id':          scan_id,
+            'elapsed':          round(elapsed, 3),
+            'scans_per_sec':    round(1 / elapsed, 3),
+            'hosts_per_sec':    round(hosts / elapsed, 1),
+            'hosts_up':         up,
+            'open_ports':       open_ports,
+            'peak_rss_mb':      peak,
+            'emits':            meter.emits,
+            'emits_per_sec':    round(meter.emits / elapsed, 1),
+            'db_write_seconds': round(meter.write_seconds, 3),
+            'view_ms':          timed_get(client, f'/view/{scan_id}'),
+            'export_csv_ms':    timed_get(client, f'/export/{scan_id}/csv'),
+            'export_json_ms':   timed_get(client, f'/export/{scan_id}/json'),
+        })
+
+    # report the median run
+    runs.sort(key=lambda r: r['elapsed'])
+    result = dict(runs[len(runs) // 2])
+    result.update(name=f"{mode.lower()}-{hosts}", mode=mode, hosts=hosts, target=target,
+                  ports=ports, flags=flags, threads=threads, repeat=repeat)
+    return result
+
+
+def compare(results, baseline_path):
+    with open(baseline_path) as f:
+        baseline = {s['name']: s for s in json.load(f)['scenarios']}
+    print(f"\nagainst {baseline_path}:")
+    for s in results['scenarios']:
+        old = baseline.get(s['name'])
+        if old is None:
+            continue
+        parts = []
+        for key in ('scans_per_sec', 'peak_rss_mb', 'emits_per_sec', 'db_write_seconds',
+                    'view_ms', 'export_csv_ms', 'export_json_ms'):
+            if not old.get(key) or s.get(key) is None:
+                continue
+            ratio = s[key] / old[key]
+            worse = ratio > 1 if key in LOWER_IS_BETTER else ratio < 1
+            parts.append(f"{key} {ratio:.2f}x{' !' if worse and abs(ratio - 1) > 0.1 else ''}")
+        print(f"  {s['name']:<16} " + ", ".join(parts))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end scanner benchmark.")
+    parser.add_argument('--sizes', default='1,256,65536',
+                        help="host counts per scenario (comma-separated)")
+    parser.add_argument('--modes', default='Basic,Threaded')
+    parser.add_argument('--ports', default='21,22,25,80,443,3306,8080',
+                        help="port spec every scan uses")
+    parser.add_argument('--flags', default='', help="extra nmap flags, e.g. '-sV'")
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--engine', default='nmap', choices=('nmap', 'connect'))
+    parser.add_argument('--no-discovery', action='store_true',
+                        help="port-scan every address instead of ping-sweeping first")
+    parser.add_argument('--repeat', type=int, default=1, help="runs per scenario (median kept)")
+    parser.add_argument('--up-ratio', default='0.5', help="fraction of fake hosts that are up")
+    parser.add_argument('--open', default='3', help="open ports per fake host")
+    parser.add_argument('--host-delay', default='0', help="fake nmap seconds per host")
+    parser.add_argument('--output', help="JSON file (default benchmarks/results/<time>.json)")
+    parser.add_argument('--baseline', help="earlier results file to compare against")
+    parser.add_argument('--keep', action='store_true', help="keep the scratch database")
+    args = parser.parse_args()
+
+    scratch = tempfile.mkdtemp(prefix='scanner-bench-')
+    install_fake_nmap(scratch)
+    os.environ.update(FAKE_NMAP_UP_RATIO=args.up_ratio, FAKE_NMAP_OPEN=args.open,
+                      FAKE_NMAP_HOST_DELAY=args.host_delay)
+    app   = build_app(os.path.join(scratch, 'bench.db'), args)
+    meter = Meter(app)
+
+    results = {
+        'version':   git_version(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python':    platform.python_version(),
+        'platform':  platform.platform(),
+        'settings':  {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')},
+        'scenarios': [],
+    }
+    try:
+        for hosts in (int(h) for h in args.sizes.split(',') if h.strip()):
+            for mode in (m.strip().capitalize() for m in args.modes.split(',') if m.strip()):
+                s = run_scenario(app, meter, mode, hosts, args.ports, args.flags,
+                                 args.threads, args.repeat)
+                results['scenarios'].append(s)
+                print(f"{s['name']:<16} {s['elapsed']:>8.2f}s  {s['hosts_per_sec']:>9.1f} hosts/s  "
+                      f"rss {s['peak_rss_mb']:>6.1f}MB  emits {s['emits']:>5}  "
+                      f"db {s['db_write_seconds']:>6.2f}s  view {s['view_ms']:>7.1f}ms  "
+                      f"csv {s['export_csv_ms']:>7.1f}ms  json {s['export_json_ms']:>7.1f}ms",
+                      flush=True)
+    finally:
+        if args.keep:
+            print(f"scratch database kept in {scratch}")
+        else:
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    output = args.output or os.path.join(
+        HERE, 'results', time.strftime('%Y%m%d-%H%M%S') + '.json'
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"results written to {output}")
+
+    if args.baseline:
+        compare(results, args.baseline)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+# blobstore.py
+#
+# Content-addressed storage for raw scan archives, so the big xmltodict JSON
+# lives outside the database and ScanResult only keeps a reference and size.
+#
+#   * a blob's name is the sha256 of its uncompressed content, so storing the
+#     same bytes twice keeps one copy
+#   * blobs are compressed with zstd when the ``zstandard`` package is
+#     installed, gzip otherwise; the codec is part of the reference
+#     ("<sha256>.zst" / "<sha256>.gz"), so either can always be read back
+#   * writers stream: data is hashed and compressed as it arrives, into a temp
+#     file that is renamed into place on commit
+#
+# LocalBlobStore keeps blobs under BLOB_STORE_PATH (sharded by hash prefix).
+# Other backends register in STORES and are picked with BLOB_STORE.
+
+import os
+import gzip
+import zlib
+import shutil
+import hashlib
+import tempfile
+
+from flask import current_app
+
+try:
+    import zstandard
+except ImportError:   # optional; gzip is always available
+    zstandard = None
+
+CODECS = ('zst', 'gz')
+CHUNK  = 64 * 1024
+
+
+class BlobError(Exception):
+    pass
+
+
+def default_codec():
+    return 'zst' if zstandard is not None else 'gz'
+
+
+def parse_ref(ref):
+    """(digest, codec) of a reference; raises BlobError if it isn't one."""
+    digest, _, codec = (ref or '').partition('.')
+    if len(digest) != 64 or codec not in CODECS or not all(c in '0123456789abcdef' for c in digest):
+        raise BlobError(f"not a blob reference: {ref!r}")
+    return digest, codec
+
+
+class BlobWriter:
+    """Streams one blob into the store; commit() returns (ref, stored bytes)."""
+
+    def __init__(self, store, codec):
+        if codec == 'zst' and zstandard is None:
+            raise BlobError("zstd requested but the zstandard package is not installed")
+        self.store  = store
+        self.codec  = codec
+        self.size   = 0          # uncompressed bytes written
+        self._hash  = hashlib.sha256()
+        fd, self._tmp = tempfile.mkstemp(prefix='.blob-', dir=store.tmp_dir())
+        self._file  = os.fdopen(fd, 'wb')
+        if codec == 'zst':
+            self._z = zstandard.ZstdCompressor(level=store.level or 3).compressobj()
+        else:
+            self._z = zlib.compressobj(store.level if store.level is not None else 6,
+                                       zlib.DEFLATED, 31)   # gzip container
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self._hash.update(data)
+        self.size += len(data)
+        out = self._z.compress(data)
+        if out:
+            self._file.write(out)
+
+    def commit(self):
+        self._file.write(self._z.flush())
+        self._file.close()
+        ref = f"{self._hash.hexdigest()}.{self.codec}"
+        return ref, self.store.adopt(self._tmp, ref)
+
+    def discard(self):
+        if not self._file.closed:
+            self._file.close()
+        try:
+            os.remove(self._tmp)
+        except OSError:
+            pass
+
+
+class LocalBlobStore:
+    """Blobs as files under ``root``: ``root/ab/abcdef...<sha256>.<codec>``."""
+
+    def __init__(self, root, codec=None, level=None):
+        self.root  = root
+        self.codec = codec or default_codec()
+        self.level = level
+
+    def path(self, ref):
+        digest, _ = parse_ref(ref)
+        return os.path.join(self.root, digest[:2], ref)
+
+    def tmp_dir(self):
+        path = os.path.join(self.root, 'tmp')
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def writer(self):
+        return BlobWriter(self, self.codec)
+
+    def put(self, data):
+        """Store bytes (or str) in one go; returns (ref, stored bytes)."""
+        w = self.writer()
+        try:
+            w.write(data)
+        except Exception:
+            w.discard()
+            raise
+        return w.commit()
+
+    def adopt(self, tmp_path, ref):
+        """Move a finished temp file into place, or drop it if the blob exists."""
+        path = self.path(ref)
+        if os.path.exists(path):
+            os.remove(tmp_path)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        return os.path.getsize(path)
+
+    def exists(self, ref):
+        return os.path.exists(self.path(ref))
+
+    def open(self, ref):
+        """Binary file object yielding the blob's uncompressed content."""
+        _, codec = parse_ref(ref)
+        path = self.path(ref)
+        if not os.path.exists(path):
+            raise BlobError(f"blob {ref} is missing from {self.root}")
+        if codec == 'gz':
+            return gzip.open(path, 'rb')
+        if zstandard is None:
+            raise BlobError(f"blob {ref} is zstd-compressed; install zstandard to read it")
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+
+    def read(self, ref):
+        with self.open(ref) as f:
+            return f.read()
+
+    def iter_chunks(self, ref, size=CHUNK):
+        with self.open(ref) as f:
+            while True:
+                chunk = f.read(size)
+                if not chunk:
+                    break
+                yield chunk
+
+    def delete(self, ref):
+        """Remove a blob; callers make sure no row references it any more."""
+        try:
+            os.remove(self.path(ref))
+            return True
+        except OSError:
+            return False
+
+    def archive(self, ref, root):
+        """Move a blob out of the store into the same layout under ``root``."""
+        target = os.path.join(root, parse_ref(ref)[0][:2], ref)
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.move(self.path(ref), target)
+            return True
+        except OSError:
+            return False
+
+
+STORES = {'local': LocalBlobStore}
+
+
+def get_store(app=None):
+    """The app's blob store, built from BLOB_STORE* settings on first use."""
+    app = app or current_app
+    store = app.extensions.get('blobstore')
+    if store is None:
+        cfg = app.config
+        path = cfg.get('BLOB_STORE_PATH') or os.path.join(app.instance_path, 'blobs')
+        store = STORES[cfg.get('BLOB_STORE', 'local')](
+            path, codec=cfg.get('BLOB_CODEC'), level=cfg.get('BLOB_COMPRESSION_LEVEL')
+        )
+        app.extensions['blobstore'] = store
+    return store
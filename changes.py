@@ -0,0 +1,257 @@
+# changes.py
+#
+# Change detection against the asset state table. AssetHost / AssetPort hold
+# the latest known ports of every address, and each completed scan is diffed
+# against that baseline instead of against the previous scan's results:
+#
+#   * a host whose fingerprint matches its baseline is skipped without
+#     loading any of its ports
+#   * other hosts are diffed per (protocol, port): a port that became open is
+#     "added", one that stopped being open is "removed", and an open port whose
+#     service or version moved is "changed"
+#   * a baseline port missing from the scan only counts as removed if the scan
+#     probed it, and a baseline host only counts as gone if it lies inside the
+#     scanned address range
+#
+# The same tables are the asset inventory (routes/assets.py): every port keeps
+# first_seen / last_seen / last_scan_id, and closed ports stay as 'closed'.
+#
+# ChangeLog.diff keeps just the delta:
+#
+#   {"summary": {"added": 1, "removed": 0, "changed": 1, "new_hosts": 0, "gone_hosts": 0},
+#    "hosts": {"10.0.0.5": {"added":   [["tcp", 22, "open", "ssh", "OpenSSH 9.6"]],
+#                           "changed": [["tcp", 80, {"version": ["nginx 1.24", "nginx 1.25"]}]]}}}
+
+import json
+import hashlib
+from datetime import datetime
+
+from sqlalchemy.orm import selectinload
+
+from extensions import db
+from models import ScanResult, ScanHost, ScanPort, AssetHost, AssetPort, ChangeLog, network_bounds
+from results import port_signature
+from portspec import parse_or_none
+
+PENDING = '(pending...)'
+BATCH   = 500
+
+
+def _chunks(items, size=BATCH):
+    items = list(items)
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def baseline_key(fingerprint, ports_spec):
+    """What a host's baseline is matched on: its ports and the ports that were probed."""
+    text = f"{fingerprint}|{(ports_spec or '').replace(' ', '')}"
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def scanned_ranges(target):
+    """(lo, hi) address-key ranges covered by the scan's target string."""
+    ranges = []
+    for part in (target or '').split():
+        lo, hi = network_bounds(part)
+        if lo is not None:
+            ranges.append((lo, hi))
+    return ranges
+
+
+def _probed(spec):
+    """Predicate telling whether a (protocol, port) was part of the scan."""
+    if spec is None:
+        return lambda protocol, port: True   # nmap's default port list: assume yes
+    return spec.contains
+
+
+def diff_host(baseline, current, probed):
+    """Diff {(proto, port): signature} dicts; returns (added, removed, changed)."""
+    added, removed, changed = [], [], []
+    for key in sorted(set(baseline) | set(current)):
+        old, new = baseline.get(key), current.get(key)
+        was_open = old is not None and old[2] == 'open'
+        is_open  = new is not None and new[2] == 'open'
+        if is_open and not was_open:
+            added.append(list(new))
+        elif was_open and not is_open:
+            if new is not None or probed(*key):
+                removed.append(list(old))
+        elif was_open and is_open and old != new:
+            fields = {}
+            for i, name in ((3, 'service'), (4, 'version')):
+                if old[i] != new[i]:
+                    fields[name] = [old[i], new[i]]
+            changed.append([key[0], key[1], fields])
+    return added, removed, changed
+
+
+def _apply(asset, current, probed, scan_id, now):
+    """Make the asset's ports match what this scan saw.
+
+    Reported ports get last_seen/last_scan_id bumped; probed ports that were
+    open and went unreported are kept as 'closed' so their history survives.
+    """
+    existing = {(p.protocol, p.port): p for p in asset.ports}
+    for key, sig in current.items():
+        row = existing.get(key)
+        if row is None:
+            row = AssetPort(protocol=key[0], port=key[1], ip_key=asset.ip_key, first_seen=now)
+            asset.ports.append(row)
+        row.state, row.service, row.version = sig[2], sig[3] or None, sig[4] or None
+        row.last_seen, row.last_scan_id = now, scan_id
+    for key, row in existing.items():
+        if key not in current and row.state == 'open' and probed(*key):
+            row.state = 'closed'
+
+
+def _previous_scan(scan):
+    return (
+        ScanResult.query
+        .filter(ScanResult.target == scan.target,
+                ScanResult.id < scan.id,
+                ScanResult.status == 'Completed')
+        .order_by(ScanResult.id.desc())
+        .first()
+    )
+
+
+def update_assets(scan):
+    """Diff a completed scan against the asset baseline and advance the baseline.
+
+    Returns (hosts, summary, had_baseline); the caller commits.
+    """
+    probed = _probed(parse_or_none(scan.ports))
+    now    = scan.finished_at or datetime.utcnow()
+    hosts  = {}
+    seen   = set()
+    summary = dict(added=0, removed=0, changed=0, new_hosts=0, gone_hosts=0)
+    had_baseline = False
+
+    def entry(ip):
+        return hosts.setdefault(ip, {})
+
+    # 1) hosts in this scan: skip matching fingerprints, diff the rest
+    up_hosts = [h for h in scan.hosts.filter(ScanHost.ip.isnot(None)) if h.status in (None, 'up')]
+    for batch in _chunks(up_hosts):
+        assets = {
+            a.ip: a for a in
+            AssetHost.query
+            .options(selectinload(AssetHost.ports))
+            .filter(AssetHost.ip.in_([h.ip for h in batch]))
+        }
+        todo = []
+        touched = {}   # previous last_scan_id -> unchanged asset ids
+        for h in batch:
+            seen.add(h.ip)
+            asset = assets.get(h.ip)
+            key = baseline_key(h.fingerprint, scan.ports)
+            if asset is not None:
+                had_baseline = True
+                if asset.last_scan_id and asset.last_scan_id > scan.id:
+                    continue   # a newer scan already moved the baseline on
+                if asset.fingerprint == key and asset.status == 'up':
+                    touched.setdefault(asset.last_scan_id, []).append(asset.id)
+                    asset.last_scan_id, asset.last_seen = scan.id, now
+                    continue
+            todo.append((h, asset, key))
+
+        # unchanged hosts: the ports their last scan reported were reported
+        # again, so bump those in one statement without loading them
+        for prev_id, ids in touched.items():
+            (
+                AssetPort.query
+                .filter(AssetPort.host_id.in_(ids), AssetPort.last_scan_id == prev_id)
+                .update({'last_seen': now, 'last_scan_id': scan.id}, synchronize_session=False)
+            )
+        if not todo:
+            continue
+
+        ports = {}
+        for p in ScanPort.query.filter(ScanPort.host_id.in_([h.id for h, _, _ in todo])):
+            ports.setdefault(p.host_id, {})[(p.protocol, p.port)] = port_signature(
+                p.protocol, p.port, p.state, p.service, p.version_string
+            )
+        for h, asset, key in todo:
+            current = ports.get(h.id, {})
+            if asset is None:
+                asset = AssetHost(ip=h.ip, ip_key=network_bounds(h.ip)[0], first_seen=now)
+                db.session.add(asset)
+                baseline = {}
+                if current:
+                    entry(h.ip)['status'] = 'new'
+                    summary['new_hosts'] += 1
+            else:
+                baseline = {
+                    (p.protocol, p.port): port_signature(p.protocol, p.port, p.state,
+                                                          p.service, p.version)
+                    for p in asset.ports
+                }
+                if asset.status != 'up':
+                    entry(h.ip)['status'] = 'up'
+
+            added, removed, changed = diff_host(baseline, current, probed)
+            for name, items in (('added', added), ('removed', removed), ('changed', changed)):
+                if items:
+                    entry(h.ip)[name] = items
+                    summary[name] += len(items)
+
+            _apply(asset, current, probed, scan.id, now)
+            asset.hostname     = h.hostname or asset.hostname
+            asset.status       = 'up'
+            asset.fingerprint  = key
+            asset.last_scan_id = scan.id
+            asset.last_seen    = now
+
+    # 2) known hosts inside the scanned range that did not answer this time
+    for lo, hi in scanned_ranges(scan.target):
+        gone = (
+            AssetHost.query
+            .filter(AssetHost.ip_key >= lo, AssetHost.ip_key <= hi,
+                    AssetHost.status == 'up',
+                    AssetHost.last_scan_id < scan.id)
+        )
+        for asset in gone:
+            had_baseline = True
+            if asset.ip in seen:
+                continue
+            removed = [
+                list(port_signature(p.protocol, p.port, p.state, p.service, p.version))
+                for p in asset.ports if p.state == 'open' and probed(p.protocol, p.port)
+            ]
+            _apply(asset, {}, probed, scan.id, now)
+            asset.status       = 'down'
+            asset.fingerprint  = None
+            asset.last_scan_id = scan.id
+            e = entry(asset.ip)
+            e['status'] = 'gone'
+            if removed:
+                e['removed'] = removed
+                summary['removed'] += len(removed)
+            summary['gone_hosts'] += 1
+
+    return hosts, summary, had_baseline
+
+
+def record_changes(scan):
+    """Advance the asset baseline and log what changed; the caller commits.
+
+    A first sighting of the whole range is just the initial baseline, not a
+    change. The '(pending...)' row a rescan creates is filled in if present.
+    """
+    hosts, summary, had_baseline = update_assets(scan)
+    pending = ChangeLog.query.filter_by(scan_id=scan.id, diff=PENDING).first()
+    prev = _previous_scan(scan)
+    if not (had_baseline or prev):
+        hosts, summary = {}, dict.fromkeys(summary, 0)
+    if pending is not None or hosts:
+        diff = json.dumps({'summary': summary, 'hosts': hosts}, separators=(',', ':'))
+        if pending is not None:
+            pending.diff = diff
+        else:
+            db.session.add(ChangeLog(
+                scan_id=scan.id,
+                previous_scan_id=prev.id if prev else None,
+                diff=diff
+            ))
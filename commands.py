@@ -0,0 +1,171 @@
+# commands.py
+#
+# Maintenance commands, available as `flask --app app scanner <command>`.
+
+import click
+from flask.cli import AppGroup
+
+from extensions import db
+
+scanner_cli = AppGroup('scanner', help="Scanner maintenance commands.")
+
+
+@scanner_cli.command('backfill-target-ranges')
+@click.option('--batch', default=1000, show_default=True, help="Rows per commit.")
+def backfill_target_ranges(batch):
+    """Fill target_lo/target_hi on scans recorded before CIDR search existed."""
+    from models import ScanResult, network_bounds
+
+    total = 0
+    while True:
+        rows = (
+            ScanResult.query
+            .filter(ScanResult.target_lo.is_(None))
+            .order_by(ScanResult.id)
+            .limit(batch)
+            .all()
+        )
+        changed = 0
+        for scan in rows:
+            lo, hi = network_bounds(scan.target)
+            if lo is None:
+                lo = hi = ''   # not an address; mark as seen
+            scan.target_lo, scan.target_hi = lo, hi
+            changed += 1
+        db.session.commit()
+        total += changed
+        if len(rows) < batch:
+            break
+    click.echo(f"updated {total} scans")
+
+
+@scanner_cli.command('rebuild-assets')
+@click.option('--since-id', default=0, show_default=True, help="Only replay scans after this id.")
+def rebuild_assets(since_id):
+    """Build the asset inventory by replaying completed scans oldest first.
+
+    Only the inventory is updated; no change logs are written.
+    """
+    from models import ScanResult
+    from results import ensure_normalized
+    from changes import update_assets
+
+    ids = [
+        scan_id for (scan_id,) in
+        db.session.query(ScanResult.id)
+        .filter(ScanResult.status == 'Completed', ScanResult.id > since_id)
+        .order_by(ScanResult.id)
+    ]
+    for scan_id in ids:
+        scan = ScanResult.query.get(scan_id)
+        ensure_normalized(scan)
+        update_assets(scan)
+        db.session.commit()
+        db.session.expunge_all()
+    click.echo(f"replayed {len(ids)} scans")
+
+
+@scanner_cli.command('migrate-blobs')
+@click.option('--batch', default=50, show_default=True, help="Rows per commit.")
+def migrate_blobs(batch):
+    """Move in-row raw archives (results_raw / results_json) to the blob store.
+
+    Rows are moved oldest first and committed in batches, so the command can
+    be stopped and re-run. Run VACUUM on SQLite afterwards to reclaim space.
+    """
+    import zlib
+    from sqlalchemy import or_
+    from sqlalchemy.orm import undefer
+    from models import ScanResult
+    from blobstore import get_store
+
+    store = get_store()
+    moved = stored = saved = 0
+    last_id = 0
+    while True:
+        rows = (
+            ScanResult.query
+            .options(undefer(ScanResult.results_raw), undefer(ScanResult.results_json))
+            .filter(ScanResult.id > last_id,
+                    ScanResult.raw_ref.is_(None),
+                    or_(ScanResult.results_raw.isnot(None), ScanResult.results_json.isnot(None)))
+            .order_by(ScanResult.id)
+            .limit(batch)
+            .all()
+        )
+        for scan in rows:
+            last_id = scan.id
+            writer = store.writer()
+            try:
+                if scan.results_raw:
+                    saved += len(scan.results_raw)
+                    z = zlib.decompressobj()
+                    for i in range(0, len(scan.results_raw), 64 * 1024):
+                        writer.write(z.decompress(scan.results_raw[i:i + 64 * 1024]))
+                    writer.write(z.flush())
+                else:
+                    saved += len(scan.results_json.encode('utf-8'))
+                    writer.write(scan.results_json)
+            except Exception:
+                writer.discard()
+                raise
+            scan.raw_ref, scan.raw_size = writer.commit()
+            scan.results_raw = scan.results_json = None
+            stored += scan.raw_size
+            moved += 1
+        db.session.commit()
+        db.session.expunge_all()
+        if len(rows) < batch:
+            break
+    click.echo(f"moved {moved} archives: {saved} bytes in rows -> {stored} bytes in blobs")
+
+
+@scanner_cli.command('retention')
+@click.option('--dry-run', is_flag=True, help="Only count the scans that would expire.")
+@click.option('--days', type=int, help="Override RETENTION_FULL_DAYS for this run.")
+@click.option('--max-seconds', type=int, help="Override RETENTION_MAX_SECONDS for this run.")
+@click.option('--enable-incremental-vacuum', is_flag=True,
+              help="Switch SQLite to auto_vacuum=INCREMENTAL first (one full VACUUM).")
+def retention(dry_run, days, max_seconds, enable_incremental_vacuum):
+    """Roll up and delete scans older than RETENTION_FULL_DAYS, then vacuum."""
+    from flask import current_app
+    from retention import run_retention, enable_incremental_vacuum as enable
+
+    if enable_incremental_vacuum:
+        click.echo("incremental vacuum " + ("enabled" if enable() else "not available"))
+    if days is not None:
+        current_app.config['RETENTION_FULL_DAYS'] = days
+    if not current_app.config.get('RETENTION_FULL_DAYS'):
+        click.echo("RETENTION_FULL_DAYS is not set; nothing to do")
+        return
+    stats = run_retention(max_seconds=max_seconds, dry_run=dry_run)
+    if dry_run:
+        click.echo(f"{stats['scans']} scans would be rolled up")
+        return
+    click.echo(
+        f"rolled up {stats['scans']} scans into {stats['rollups']} daily summaries, "
+        f"released {stats['blobs']} blobs, pruned {stats['rollups_pruned']} summaries"
+    )
+    if stats['vacuumed_pages'] is None:
+        click.echo("no incremental vacuum (not SQLite, or auto_vacuum is not INCREMENTAL)")
+    else:
+        click.echo(f"vacuumed {stats['vacuumed_pages']} pages")
+    if not stats['finished']:
+        click.echo("time budget used up; the rest expires on the next run")
+
+
+@scanner_cli.command('seed-profiles')
+def seed_profiles():
+    """Add the built-in scan profiles that don't exist yet."""
+    from models import ScanProfile
+    from profiles import DEFAULT_PROFILES, apply_profile_fields, get_profile
+
+    added = 0
+    for data in DEFAULT_PROFILES:
+        if get_profile(data['name']) is None:
+            profile = ScanProfile()
+            apply_profile_fields(profile, data)
+            db.session.add(profile)
+            added += 1
+    db.session.commit()
+    click.echo(f"added {added} profiles")
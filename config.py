@@ -13,7 +13,180 @@ class Config:
 
     SQLALCHEMY_TRACK_MODIFICATIONS = False
 
-    # APScheduler
+    # SQLite (database.py): WAL journal, wait up to SQLITE_BUSY_TIMEOUT_MS for
+    # the write lock, and commit without an fsync per transaction
+    SQLITE_WAL             = True
+    SQLITE_BUSY_TIMEOUT_MS = 30000
+    SQLITE_SYNCHRONOUS     = 'NORMAL'
+    SQLITE_CACHE_SIZE_KB   = None   # e.g. 65536; SQLite's default is 2 MB
+
+    # other databases (DATABASE_URL=postgresql://...): connection pool per
+    # process; None sizes it for SCAN_EMBEDDED_WORKERS
+    DB_POOL_SIZE    = None
+    DB_MAX_OVERFLOW = 10
+    DB_POOL_TIMEOUT = 30
+    DB_POOL_RECYCLE = 1800
+
+    # scan writes go through one writer thread per process (dbwriter.py),
+    # which commits whatever has queued up - at most DB_WRITER_BATCH writes -
+    # in one transaction. DB_WRITER = False commits each write inline.
+    DB_WRITER                = True
+    DB_WRITER_BATCH          = 500
+    DB_WRITER_LINGER_SECONDS = 0
+    DB_WRITER_QUEUE          = 10000
+
+    # APScheduler. Jobs live in the app database; jitter randomizes fire
+    # times, stagger delays each queued run by a fixed per-schedule offset,
+    # and a firing blocks repeats (from other web processes) for the lock window
     SCHEDULER_API_ENABLED = True
+    SCHEDULE_JITTER_SECONDS        = 0
+    SCHEDULE_STAGGER_SECONDS       = 300
+    SCHEDULE_LOCK_SECONDS          = 60
+    SCHEDULE_MISFIRE_GRACE_SECONDS = 300
     DEFAULT_THREADS = 100
-    DEFAULT_MODE    = 'Basic'
\ No newline at end of file
+    DEFAULT_MODE    = 'Basic'
+
+    # Global nmap governor, shared by every scan in a process. DEFAULT_THREADS
+    # only bounds one scan; these bound the whole box. NMAP_SLOT_DIR makes the
+    # process cap node-wide across worker processes (POSIX only).
+    NMAP_MAX_PROCS        = int(os.environ.get('NMAP_MAX_PROCS', 64))
+    NMAP_MEMORY_BUDGET_MB = None   # e.g. 4096; caps procs at budget / per-proc
+    NMAP_PROC_MEMORY_MB   = 50
+    NMAP_MAX_PPS          = None   # e.g. 20000; split as per-child --max-rate
+    NMAP_SLOT_DIR         = os.environ.get('NMAP_SLOT_DIR')
+
+    # Politeness (ratelimit.py), off by default. With SCAN_RATE_SUBNET_PPS set
+    # (e.g. 2000) every /24 (/64) gets that many probes/s across all scans in
+    # the process, and every child a --max-rate of at most 1/SHARES of it (so
+    # at most SHARES children on one subnet at full speed; the rest wait).
+    # Dropped probes (nmap) or a timeout ratio up by TIMEOUT_RISE (connect
+    # engine) multiply the subnet's rate by BACKOFF; each clean child adds
+    # INCREASE_PPS back. NMAP_MAX_PPS backs off the same way when several
+    # subnets report drops together. None = no per-subnet limit.
+    SCAN_RATE_SUBNET_PPS      = None
+    SCAN_RATE_SUBNET_SHARES   = 4
+    SCAN_RATE_MIN_PPS         = 50
+    SCAN_RATE_BACKOFF         = 0.5
+    SCAN_RATE_BACKOFF_SECONDS = 10
+    SCAN_RATE_INCREASE_PPS    = 100
+    SCAN_RATE_TIMEOUT_RISE    = 0.1
+    SCAN_RATE_IPV4_PREFIX     = 24
+    SCAN_RATE_IPV6_PREFIX     = 64
+    SCAN_RATE_MAX_SUBNETS     = 256   # wider children count only against NMAP_MAX_PPS
+
+    # Threaded host scans: hosts per nmap process adapt so each child runs
+    # for about SCAN_BATCH_SECONDS, within [MIN, MAX] hosts
+    SCAN_BATCH_INITIAL_HOSTS = 8
+    SCAN_BATCH_MIN_HOSTS     = 1
+    SCAN_BATCH_MAX_HOSTS     = 1024
+    SCAN_BATCH_SECONDS       = 60
+
+    # ... and before that, ping-sweep SCAN_DISCOVERY_BATCH_HOSTS addresses per
+    # nmap -sn child and port-scan only the hosts that answer, as they answer.
+    # A scan can opt out ("skip discovery", or -Pn in its flags) for networks
+    # that drop probes; then every address is port-scanned.
+    SCAN_HOST_DISCOVERY        = True
+    SCAN_DISCOVERY_PROBES      = "-PE -PP -PS21,22,23,25,80,135,139,443,445,3389,8080 -PA80,443"
+    SCAN_DISCOVERY_BATCH_HOSTS = 4096
+
+    # Scan engines: 'nmap' (a process per sub-job, any nmap flags) or
+    # 'connect' (asyncio TCP connect sweeps inside the worker, open/closed
+    # only). SCAN_ENGINE is the default; scans can pick either. The connect
+    # engine keeps up to SCAN_CONNECT_CONCURRENCY sockets open (the soft
+    # open-files limit is raised to fit, as far as the hard limit allows).
+    SCAN_ENGINE              = 'nmap'
+    SCAN_CONNECT_CONCURRENCY = 10000
+    SCAN_CONNECT_HOSTS       = 256    # hosts in progress at once
+    SCAN_CONNECT_HOST_RATE   = 0      # connects/s per host, 0 = unlimited
+    SCAN_CONNECT_TIMEOUT     = 1.5    # seconds per attempt
+    SCAN_CONNECT_RETRIES     = 1      # extra attempts before a port counts as filtered
+
+    # Threaded scans (and any connect-engine scan) with -sV / -sC / -A / -O /
+    # --script split in two: a sweep for open ports without those options,
+    # then up to SCAN_DETECT_WORKERS nmap children running them per host on
+    # only the ports found open, started while the sweep is still going
+    SCAN_TWO_STAGE      = True
+    SCAN_DETECT_WORKERS = 16
+
+    # Scan queue. Scans run in worker processes (python worker.py -n N);
+    # SCAN_EMBEDDED_WORKERS > 0 also drains the queue from inside the web
+    # process, which is handy for single-box installs. Each worker runs one
+    # scan at a time, so with the default of 1 and no worker.py, scans run
+    # one after another; raise it, or run worker.py, for concurrent scans.
+    # Set it to 0 once dedicated workers are running.
+    SCAN_EMBEDDED_WORKERS  = int(os.environ.get('SCAN_EMBEDDED_WORKERS', 1))
+    SCAN_JOB_LEASE_SECONDS = 60
+    SCAN_JOB_POLL_SECONDS  = 2
+    SCAN_JOB_MAX_ATTEMPTS  = 3
+    SCAN_CANCEL_POLL_SECONDS = 2
+    # e.g. redis://localhost:6379/0 - lets workers emit progress to web clients
+    SOCKETIO_MESSAGE_QUEUE = os.environ.get('SOCKETIO_MESSAGE_QUEUE')
+
+    # Duplicate requests (same target, ports and flags) attach to a queued or
+    # running scan; within SCAN_FRESHNESS_SECONDS a completed result is served
+    # instead of rescanning (0 = always rescan). Rescans only ever attach.
+    SCAN_COALESCE          = True
+    SCAN_FRESHNESS_SECONDS = 0
+
+    # Socket.IO progress: events are coalesced per scan and flushed at most
+    # SOCKETIO_EMIT_HZ times a second to that scan's room; the last
+    # SCAN_LOG_BUFFER_LINES lines are kept for clients that join late
+    SOCKETIO_EMIT_HZ         = 4
+    SCAN_LOG_BUFFER_LINES    = 200
+    SCAN_LOG_PERSIST_SECONDS = 5
+
+    # history list: keyset page size (UI default / API maximum)
+    HISTORY_PAGE_SIZE     = 50
+    HISTORY_MAX_PAGE_SIZE = 500
+
+    # scan report: hosts per page, and the LRU of rendered pages (bytes)
+    VIEW_PAGE_SIZE        = 100
+    VIEW_CACHE_MAX_BYTES  = 32 * 1024 * 1024
+
+    # asset inventory API: keyset page size (default / maximum)
+    ASSETS_PAGE_SIZE      = 100
+    ASSETS_MAX_PAGE_SIZE  = 1000
+
+    # exports are streamed; rows fetched from the DB per round trip
+    EXPORT_BATCH_ROWS     = 1000
+
+    # keep a compressed copy of the raw nmap tree next to the normalized rows,
+    # in a content-addressed blob store (BLOB_STORE_PATH defaults to
+    # instance/blobs). BLOB_CODEC is 'zst' (needs the zstandard package) or
+    # 'gz'; None picks zstd when it is installed.
+    ARCHIVE_RAW_RESULTS    = True
+    BLOB_STORE             = 'local'
+    BLOB_STORE_PATH        = os.environ.get('BLOB_STORE_PATH')
+    BLOB_CODEC             = None
+    BLOB_COMPRESSION_LEVEL = None
+
+    # retention (retention.py): scans older than RETENTION_FULL_DAYS are rolled
+    # up into per-target daily summaries and deleted, RETENTION_BATCH scans per
+    # transaction, off-peak at RETENTION_CRON for at most RETENTION_MAX_SECONDS.
+    # Their raw archives are deleted, archived under RETENTION_ARCHIVE_PATH or
+    # kept (RETENTION_BLOB_ACTION). None days = keep forever.
+    RETENTION_FULL_DAYS     = None
+    RETENTION_ROLLUP_DAYS   = None
+    RETENTION_CRON          = '30 3 * * *'
+    RETENTION_MAX_SECONDS   = 900
+    RETENTION_BATCH         = 200
+    RETENTION_PAUSE_SECONDS = 0.5
+    RETENTION_BLOB_ACTION   = 'delete'
+    RETENTION_ARCHIVE_PATH  = os.environ.get('RETENTION_ARCHIVE_PATH')
+    RETENTION_VACUUM_PAGES  = 1000
+
+    # scan profiles (profiles.py): cost estimates assume this share of the
+    # addresses answer discovery and this share of probed ports are open
+    SCAN_ESTIMATE_UP_RATIO       = 0.25
+    SCAN_ESTIMATE_OPEN_RATIO     = 0.01
+    SCAN_ESTIMATE_DETECT_SECONDS = 5     # -sV / scripts, per open port
+    SCAN_ESTIMATE_OS_SECONDS     = 4     # -O, per host up
+
+    # capacity budget for new scans: over MAX_PROBES / MAX_SECONDS a request
+    # is rejected (422); once the queued + running estimate passes
+    # BACKLOG_SECONDS it is queued behind everything else ('queue') or turned
+    # away with a Retry-After (429, 'reject'). None = no limit.
+    SCAN_BUDGET_MAX_PROBES      = None
+    SCAN_BUDGET_MAX_SECONDS     = None
+    SCAN_BUDGET_BACKLOG_SECONDS = None
+    SCAN_BUDGET_OVERFLOW        = 'queue'
\ No newline at end of file
@@ -0,0 +1,80 @@
+# database.py
+#
+# Engine setup for the two databases the app runs on.
+#
+#   * SQLite: every new connection gets journal_mode=WAL (readers no longer
+#     block the writer or each other), a busy_timeout so a writer waits for
+#     the lock instead of failing with "database is locked", and
+#     synchronous=NORMAL (in WAL mode a commit no longer fsyncs; a power cut
+#     can lose the last commits but never corrupts the file). New databases
+#     are created with auto_vacuum=INCREMENTAL for retention.py.
+#   * anything else (Postgres): a connection pool sized for the scan workers
+#     this process runs, with pre-ping so connections dropped by the server
+#     or a proxy are replaced transparently.
+#
+# Scan writes themselves go through the single writer in dbwriter.py.
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+from extensions import db
+
+
+def is_sqlite_uri(uri):
+    return make_url(uri).get_backend_name() == 'sqlite'
+
+
+def engine_options(app):
+    """SQLALCHEMY_ENGINE_OPTIONS for the configured database; explicit
+    settings in the config win over the ones computed here."""
+    cfg = app.config
+    options = {}
+    if is_sqlite_uri(cfg['SQLALCHEMY_DATABASE_URI']):
+        # the driver's own lock wait, for connections made before the pragma runs
+        options['connect_args'] = {'timeout': cfg.get('SQLITE_BUSY_TIMEOUT_MS', 30000) / 1000.0}
+    else:
+        # each scan worker holds a connection for its scan and one for its
+        # heartbeat; the rest is the writer, the scheduler and web requests
+        workers = max(cfg.get('SCAN_EMBEDDED_WORKERS', 1), 1)
+        options.update(
+            pool_size=cfg.get('DB_POOL_SIZE') or 2 * workers + 6,
+            max_overflow=cfg.get('DB_MAX_OVERFLOW', 10),
+            pool_timeout=cfg.get('DB_POOL_TIMEOUT', 30),
+            pool_recycle=cfg.get('DB_POOL_RECYCLE', 1800),
+            pool_pre_ping=True,
+        )
+    options.update(cfg.get('SQLALCHEMY_ENGINE_OPTIONS') or {})
+    return options
+
+
+def sqlite_pragmas(app):
+    """The connect hook that applies the SQLITE_* settings."""
+    cfg = app.config
+    pragmas = [
+        f"PRAGMA busy_timeout = {int(cfg.get('SQLITE_BUSY_TIMEOUT_MS', 30000))}",
+        f"PRAGMA synchronous = {cfg.get('SQLITE_SYNCHRONOUS', 'NORMAL')}",
+    ]
+    if cfg.get('SQLITE_WAL', True):
+        pragmas.insert(0, "PRAGMA journal_mode = WAL")
+    if cfg.get('SQLITE_CACHE_SIZE_KB'):
+        pragmas.append(f"PRAGMA cache_size = -{int(cfg['SQLITE_CACHE_SIZE_KB'])}")
+
+    def on_connect(dbapi_conn, record):
+        cursor = dbapi_conn.cursor()
+        try:
+            # only takes effect before the first table is created
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+    return on_connect
+
+
+def init_db(app):
+    """Configure the engine and bind Flask-SQLAlchemy to the app."""
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app)
+    db.init_app(app)
+    if is_sqlite_uri(app.config['SQLALCHEMY_DATABASE_URI']):
+        with app.app_context():
+            event.listen(db.engine, 'connect', sqlite_pragmas(app))
@@ -0,0 +1,153 @@
+# dbwriter.py
+#
+# One writer thread per process for scan writes. Scanner threads used to
+# each take a lock, write and commit - one transaction (and on SQLite one
+# fsync) per host, with every thread contending for the database lock.
+# Now they hand the write to the writer as a function and carry on:
+#
+#   * the writer runs whatever has queued up since its last commit in one
+#     transaction (group commit), up to DB_WRITER_BATCH operations, so under
+#     load hundreds of hosts share a commit and when idle nothing waits
+#   * operations run in submission order, so a host row is always written
+#     before the detection results that update it
+#   * an operation that fails is reported on its own future: the batch is
+#     rolled back and replayed one operation per transaction
+#   * the queue is bounded (DB_WRITER_QUEUE), so producers slow down to the
+#     writer's pace instead of piling hosts up in memory
+#
+# Operations take no session argument; they use db.session inside the
+# writer's app context and must not commit - the writer does. With
+# DB_WRITER = False every submit runs and commits in the caller's thread.
+
+import os
+import time
+import queue
+import atexit
+import threading
+import traceback
+from concurrent.futures import Future
+
+from extensions import db
+
+_STOP = object()
+_create_lock = threading.Lock()
+
+
+class DBWriter:
+    """Queue of write operations committed in batches by one thread."""
+
+    def __init__(self, app, batch=500, linger=0, maxsize=10000, enabled=True):
+        self.app     = app
+        self.batch   = max(1, batch)
+        self.linger  = linger
+        self.enabled = enabled
+        self.pid     = os.getpid()
+        self.commits = 0
+        self.ops     = 0
+        self._queue  = queue.Queue(maxsize=maxsize)
+        self._lock   = threading.Lock()   # inline mode: one writer at a time
+        self._thread = None
+        if enabled:
+            self._thread = threading.Thread(target=self._run, name='db-writer', daemon=True)
+            self._thread.start()
+
+    # -- producer side -----------------------------------------------------
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue ``fn(*args, **kwargs)``; the Future resolves once it is committed."""
+        future = Future()
+        if not self.enabled:
+            with self._lock, self.app.app_context():
+                self._run_batch([(fn, args, kwargs, future)])
+            return future
+        self._queue.put((fn, args, kwargs, future))
+        return future
+
+    def call(self, fn, *args, **kwargs):
+        """Like submit, but wait for the commit and return fn's result."""
+        return self.submit(fn, *args, **kwargs).result()
+
+    def flush(self):
+        """Wait until everything submitted so far is committed."""
+        self.call(lambda: None)
+
+    def stop(self):
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    # -- writer thread -----------------------------------------------------
+
+    def _next_batch(self):
+        """Block for one operation, then take whatever else is queued."""
+        first = self._queue.get()
+        if first is _STOP:
+            return None
+        ops = [first]
+        deadline = time.monotonic() + self.linger
+        while len(ops) < self.batch:
+            try:
+                wait = deadline - time.monotonic()
+                op = self._queue.get(timeout=wait) if wait > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if op is _STOP:
+                self._queue.put(_STOP)   # finish this batch, then stop
+                break
+            ops.append(op)
+        return ops
+
+    def _run(self):
+        while True:
+            ops = self._next_batch()
+            if ops is None:
+                return
+            try:
+                with self.app.app_context():
+                    self._run_batch(ops)
+            except Exception as e:   # never let the writer thread die
+                traceback.print_exc()
+                for *_, future in ops:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _run_batch(self, ops):
+        """All ops in one transaction; on any error, one transaction each."""
+        results = []
+        try:
+            for fn, args, kwargs, _ in ops:
+                results.append(fn(*args, **kwargs))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            if len(ops) == 1:
+                ops[0][3].set_exception(e)
+                return
+            for op in ops:
+                self._run_batch([op])
+            return
+        self.commits += 1
+        self.ops     += len(ops)
+        for (*_, future), result in zip(ops, results):
+            future.set_result(result)
+
+
+def get_writer(app):
+    """This process's writer for ``app``, started on first use (and again
+    after a fork, since threads don't survive one)."""
+    writer = app.extensions.get('dbwriter')
+    if writer is None or writer.pid != os.getpid():
+        with _create_lock:
+            writer = app.extensions.get('dbwriter')
+            if writer is None or writer.pid != os.getpid():
+                cfg = app.config
+                writer = DBWriter(
+                    app,
+                    batch=cfg.get('DB_WRITER_BATCH', 500),
+                    linger=cfg.get('DB_WRITER_LINGER_SECONDS', 0),
+                    maxsize=cfg.get('DB_WRITER_QUEUE', 10000),
+                    enabled=cfg.get('DB_WRITER', True),
+                )
+                app.extensions['dbwriter'] = writer
+                atexit.register(writer.stop)
+    return writer
@@ -0,0 +1,142 @@
+# emitter.py
+#
+# Coalescing Socket.IO emitter for one scan. nmap -v prints a line per event
+# and Threaded scans run many children at once, so instead of one broadcast
+# per line this buffers lines and progress and flushes at most SOCKETIO_EMIT_HZ
+# times a second, only to the scan's room. Progress comes from the scan's
+# ProgressAggregator, so all sub-jobs share one percentage/ETA stream. The
+# most recent lines are kept in a ring buffer (and periodically in
+# ScanResult.log_tail) for late joiners.
+
+import time
+import threading
+from collections import deque
+
+from extensions import socketio
+
+# scan_id -> deque of recent lines, for scans running in this process
+_recent = {}
+_recent_lock = threading.Lock()
+
+
+def scan_room(scan_id):
+    return f"scan-{scan_id}"
+
+
+def recent_lines(scan_id):
+    """Recent log lines if the scan runs in this process, else None."""
+    with _recent_lock:
+        buf = _recent.get(scan_id)
+        return list(buf) if buf is not None else None
+
+
+class ScanEmitter:
+
+    def __init__(self, app, scan_id, aggregator):
+        self.app      = app
+        self.scan_id  = scan_id
+        self.aggregator = aggregator
+        self.room     = scan_room(scan_id)
+        self.interval = 1.0 / max(app.config.get('SOCKETIO_EMIT_HZ', 4), 0.1)
+        self.persist_interval = app.config.get('SCAN_LOG_PERSIST_SECONDS', 5)
+
+        self._lock       = threading.Lock()
+        self._lines      = []
+        self._sent_pct   = None
+        self._sent_at    = 0.0
+        self._last_flush = 0.0
+        self._last_save  = 0.0
+        self._timer      = None
+        self._buffer     = deque(maxlen=app.config.get('SCAN_LOG_BUFFER_LINES', 200))
+        with _recent_lock:
+            _recent[scan_id] = self._buffer
+
+    # -- producers (called from sub-scan threads) --------------------------
+
+    def line(self, text):
+        with self._lock:
+            self._lines.append(text)
+            self._buffer.append(text)
+        self._maybe_flush()
+
+    def progress(self, key, percent):
+        self.aggregator.update(key, percent)
+        self._maybe_flush()
+
+    def poke(self):
+        """Schedule a flush after the aggregator changed (e.g. a sub-job ended)."""
+        self._maybe_flush()
+
+    def error(self, message):
+        self.flush()
+        socketio.emit('scan_error', {'error': message, 'scan_id': self.scan_id}, to=self.room)
+
+    def complete(self):
+        self.flush()
+        self._save_tail()
+        socketio.emit('scan_complete', {'scan_id': self.scan_id}, to=self.room)
+        self.close()
+
+    def close(self):
+        """Stop the pending flush and forget the scan's lines; safe to repeat."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        with _recent_lock:
+            if _recent.get(self.scan_id) is self._buffer:
+                _recent.pop(self.scan_id)
+
+    # -- flushing ----------------------------------------------------------
+
+    def _maybe_flush(self):
+        with self._lock:
+            wait = self._last_flush + self.interval - time.time()
+            if wait > 0:
+                if self._timer is None:
+                    self._timer = threading.Timer(wait, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            lines, self._lines = self._lines, []
+            now  = time.time()
+            snap = self.aggregator.snapshot()
+            # send progress when the percentage moves, and refresh ETA/rates
+            # at least once a second while it doesn't
+            if snap['percent'] != self._sent_pct or now - self._sent_at >= 1:
+                self._sent_pct, self._sent_at = snap['percent'], now
+            else:
+                snap = None
+            self._last_flush = now
+            save = self.persist_interval and self._last_flush - self._last_save >= self.persist_interval
+
+        if lines:
+            socketio.emit('scan_update', {
+                'scan_id':  self.scan_id,
+                'messages': lines,
+                'message':  "\n".join(lines),
+            }, to=self.room)
+        if snap is not None:
+            socketio.emit('scan_progress', dict(snap, scan_id=self.scan_id), to=self.room)
+        if save:
+            self._save_tail()
+
+    def _save_tail(self):
+        """Copy the ring buffer to the DB so other processes can serve it."""
+        from models import ScanResult
+        from dbwriter import get_writer
+        self._last_save = time.time()
+        with self._lock:
+            tail = "\n".join(self._buffer)
+        get_writer(self.app).submit(
+            lambda: ScanResult.query.filter_by(id=self.scan_id).update(
+                {'log_tail': tail}, synchronize_session=False
+            )
+        )
@@ -0,0 +1,164 @@
+# governor.py
+#
+# Admission control for nmap child processes. DEFAULT_THREADS is per scan, so
+# without this a few concurrent Threaded scans can fork hundreds of nmaps.
+# Every execute_nmap call takes a slot from the governor first:
+#
+#   * capacity = min(NMAP_MAX_PROCS, NMAP_MEMORY_BUDGET_MB // NMAP_PROC_MEMORY_MB)
+#   * free slots go to the waiting scan with the best priority, then the fewest
+#     live children (fair share), then the longest wait
+#   * NMAP_MAX_PPS is split evenly across slots as a per-child --max-rate
+#     (ratelimit.py lowers it further per target subnet)
+#   * when NMAP_SLOT_DIR is set, slots are also flock()ed files in that
+#     directory, which caps the total across every worker process on the node
+
+import os
+import time
+import itertools
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:   # not POSIX: fall back to per-process limits only
+    fcntl = None
+
+
+class Slot:
+    def __init__(self, scan_id, max_rate=None):
+        self.scan_id  = scan_id
+        self.max_rate = max_rate
+        self.lease    = None   # ratelimit.Lease, when the scanner took one
+        self._file    = None
+
+
+class Governor:
+
+    def __init__(self):
+        self._cond    = threading.Condition()
+        self._seq     = itertools.count()
+        self._live    = {}    # scan_id -> live children
+        self._waiting = []    # [priority, seq, scan_id]
+        self.configure()
+
+    def init_app(self, app):
+        cfg = app.config
+        self.configure(
+            max_procs=cfg.get('NMAP_MAX_PROCS', 64),
+            memory_budget_mb=cfg.get('NMAP_MEMORY_BUDGET_MB'),
+            proc_memory_mb=cfg.get('NMAP_PROC_MEMORY_MB', 50),
+            max_pps=cfg.get('NMAP_MAX_PPS'),
+            slot_dir=cfg.get('NMAP_SLOT_DIR'),
+        )
+
+    def configure(self, max_procs=64, memory_budget_mb=None, proc_memory_mb=50,
+                  max_pps=None, slot_dir=None):
+        capacity = max(int(max_procs), 1)
+        if memory_budget_mb and proc_memory_mb:
+            capacity = min(capacity, max(int(memory_budget_mb // proc_memory_mb), 1))
+        with self._cond:
+            self.capacity = capacity
+            self.max_pps  = max_pps
+            self.slot_dir = slot_dir if fcntl else None
+            if self.slot_dir:
+                os.makedirs(self.slot_dir, exist_ok=True)
+            self._cond.notify_all()
+
+    @property
+    def in_use(self):
+        return sum(self._live.values())
+
+    def _is_next(self, entry):
+        if self.in_use >= self.capacity:
+            return False
+        best = min(
+            self._waiting,
+            key=lambda w: (w[0], self._live.get(w[2], 0), w[1])
+        )
+        return best is entry
+
+    @contextmanager
+    def slot(self, scan_id, priority=0):
+        """Block until this scan may start another nmap child."""
+        entry = [priority, next(self._seq), scan_id]
+        with self._cond:
+            self._waiting.append(entry)
+            try:
+                while not self._is_next(entry):
+                    self._cond.wait()
+            finally:
+                self._waiting.remove(entry)
+            self._live[scan_id] = self._live.get(scan_id, 0) + 1
+            self._cond.notify_all()
+
+        slot = Slot(scan_id)
+        if self.max_pps:
+            slot.max_rate = max(int(self.max_pps // self.capacity), 1)
+        try:
+            if self.slot_dir:
+                slot._file = self._lock_node_slot(scan_id)
+            yield slot
+        finally:
+            if slot._file is not None:
+                slot._file.truncate(0)
+                fcntl.flock(slot._file, fcntl.LOCK_UN)
+                slot._file.close()
+            with self._cond:
+                self._live[scan_id] -= 1
+                if not self._live[scan_id]:
+                    del self._live[scan_id]
+                self._cond.notify_all()
+
+    def _lock_node_slot(self, scan_id):
+        """Take one of ``capacity`` slot files shared by all processes on this node."""
+        while True:
+            for i in range(self.capacity):
+                f = open(os.path.join(self.slot_dir, f"slot-{i}"), 'a+')
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    f.close()
+                    continue
+                f.truncate(0)
+                f.write(f"{os.getpid()} {scan_id}\n")
+                f.flush()
+                return f
+            time.sleep(0.2)
+
+    def node_slots(self):
+        """Slots held across the node, read from the slot files (None if unshared)."""
+        if not self.slot_dir:
+            return None
+        held = []
+        for i in range(self.capacity):
+            path = os.path.join(self.slot_dir, f"slot-{i}")
+            try:
+                f = open(path, 'a+')
+            except OSError:
+                continue
+            with f:
+                try:
+                    fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    fcntl.flock(f, fcntl.LOCK_UN)   # free
+                except OSError:
+                    f.seek(0)
+                    pid, _, scan = f.read().strip().partition(' ')
+                    held.append({'slot': i, 'pid': pid, 'scan_id': scan})
+        return held
+
+    def status(self):
+        with self._cond:
+            waiting = {}
+            for _, _, scan_id in self._waiting:
+                waiting[scan_id] = waiting.get(scan_id, 0) + 1
+            return {
+                'capacity':    self.capacity,
+                'in_use':      self.in_use,
+                'waiting':     len(self._waiting),
+                'max_pps':     self.max_pps,
+                'live_by_scan':    dict(self._live),
+                'waiting_by_scan': waiting,
+            }
+
+
+governor = Governor()
@@ -0,0 +1,251 @@
+# jobqueue.py
+#
+# DB-backed scan queue. The web tier only creates ScanResult rows and
+# enqueues ScanJobs; worker processes (worker.py) lease jobs, keep the lease
+# alive with heartbeats while run_scan executes, and mark them finished.
+# A job whose lease runs out (crashed or killed worker) becomes leasable again.
+#
+# request_scan() coalesces duplicates: a request whose (target, ports, flags)
+# match a queued or running scan attaches to it, and with a freshness window
+# a recent completed result is served instead of scanning again.
+
+import hashlib
+from datetime import datetime, timedelta
+
+from sqlalchemy import or_, and_
+
+from extensions import db
+from models import ScanResult, ScanJob
+from portspec import parse_or_none
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_SCHEDULED   = 10
+
+
+def enqueue(scan, threads=None, priority=PRIORITY_INTERACTIVE, run_after=None):
+    """Queue a run of an existing ScanResult; the caller commits.
+
+    ``run_after`` holds the job back until that (UTC) time.
+    """
+    try:
+        threads = int(threads) if threads else None
+    except (TypeError, ValueError):
+        threads = None
+    job = ScanJob(scan_id=scan.id, threads=threads, priority=priority, run_after=run_after)
+    db.session.add(job)
+    return job
+
+
+def param_hash(target, ports, flags, discovery=None, engine=None):
+    """Identity of a scan request; mode is left out since it doesn't change results."""
+    spec = parse_or_none(ports)
+    text = "|".join([
+        (target or '').strip().lower(),
+        str(spec) if spec else (ports or '').replace(' ', ''),
+        " ".join((flags or '').split()),
+    ])
+    if discovery is False:
+        text += "|-Pn"
+    if engine and engine != 'nmap':
+        text += f"|{engine}"
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def submit_scan(target, ports, flags, mode, threads=None, priority=PRIORITY_INTERACTIVE,
+                run_after=None, discovery=None, engine=None, profile=None, batch_hosts=None,
+                estimate=None):
+    """Create a queued ScanResult plus its job and commit both.
+
+    ``discovery`` False port-scans every address of a network (-Pn); None
+    leaves it to SCAN_HOST_DISCOVERY. ``engine`` None means SCAN_ENGINE.
+    ``profile`` names the ScanProfile it came from and ``estimate`` is its
+    profiles.estimate() cost.
+    """
+    scan = ScanResult(
+        target=target,
+        ports=ports,
+        flags=flags,
+        mode="Threaded" if mode == "Threaded" else "Basic",
+        status="Queued",
+        param_hash=param_hash(target, ports, flags, discovery, engine),
+        host_discovery=discovery,
+        engine=engine,
+        profile=profile,
+        batch_hosts=batch_hosts,
+        estimated_probes=estimate['probes'] if estimate else None,
+        estimated_seconds=estimate['seconds'] if estimate else None
+    )
+    db.session.add(scan)
+    db.session.flush()
+    enqueue(scan, threads, priority, run_after)
+    db.session.commit()
+    return scan
+
+
+def find_duplicate(phash, fresh_seconds=0):
+    """(scan, 'attached'|'fresh') for an identical live or recent scan, else (None, None)."""
+    live = (
+        ScanResult.query
+        .filter(ScanResult.param_hash == phash,
+                ScanResult.status.in_(('Queued', 'Running')))
+        .order_by(ScanResult.id.desc())
+        .first()
+    )
+    if live is not None and has_live_job(live.id):
+        return live, 'attached'
+    if fresh_seconds:
+        cutoff = datetime.utcnow() - timedelta(seconds=fresh_seconds)
+        fresh = (
+            ScanResult.query
+            .filter(ScanResult.param_hash == phash,
+                    ScanResult.status == 'Completed',
+                    ScanResult.finished_at >= cutoff)
+            .order_by(ScanResult.id.desc())
+            .first()
+        )
+        if fresh is not None:
+            return fresh, 'fresh'
+    return None, None
+
+
+def request_scan(target, ports, flags, mode, threads=None, priority=PRIORITY_INTERACTIVE,
+                 run_after=None, fresh_seconds=0, discovery=None, engine=None,
+                 profile=None, batch_hosts=None, admit_budget=False):
+    """submit_scan unless an identical scan can be shared.
+
+    Returns (scan, outcome) with outcome 'queued', 'attached' (joined a queued
+    or running scan) or 'fresh' (a completed scan within ``fresh_seconds``).
+    Attaching a more urgent request promotes the queued job.
+
+    A new scan is costed with profiles.estimate(); with ``admit_budget`` it
+    must also fit the capacity budget (profiles.admit), which raises
+    OverBudget or pushes it back in the queue.
+    """
+    from flask import current_app
+    from profiles import estimate, admit
+    if current_app.config.get('SCAN_COALESCE', True):
+        scan, outcome = find_duplicate(
+            param_hash(target, ports, flags, discovery, engine), fresh_seconds
+        )
+        if scan is not None:
+            if outcome == 'attached':
+                (
+                    ScanJob.query
+                    .filter(ScanJob.scan_id == scan.id, ScanJob.status == 'queued',
+                            ScanJob.priority > priority)
+                    .update({'priority': priority, 'run_after': run_after},
+                            synchronize_session=False)
+                )
+                db.session.commit()
+            return scan, outcome
+    cost = estimate(target, ports, flags, engine, mode, threads, discovery)
+    if admit_budget:
+        priority = admit(cost, priority)
+    scan = submit_scan(target, ports, flags, mode, threads, priority, run_after,
+                       discovery, engine, profile, batch_hosts, cost)
+    return scan, 'queued'
+
+
+def _leasable(now):
+    return and_(
+        or_(ScanJob.status == 'queued',
+            and_(ScanJob.status == 'leased', ScanJob.lease_expires < now)),
+        or_(ScanJob.run_after.is_(None), ScanJob.run_after <= now)
+    )
+
+
+def lease(owner, lease_seconds=60):
+    """Atomically claim the next runnable job for ``owner``, or return None.
+
+    The claim is a conditional UPDATE, so two workers racing for the same row
+    can't both win; the loser just tries the next candidate.
+    """
+    while True:
+        now = datetime.utcnow()
+        candidate = (
+            db.session.query(ScanJob.id)
+            .filter(_leasable(now))
+            .order_by(ScanJob.priority, ScanJob.id)
+            .first()
+        )
+        if candidate is None:
+            return None
+        claimed = (
+            ScanJob.query
+            .filter(ScanJob.id == candidate.id, _leasable(now))
+            .update({
+                'status':        'leased',
+                'lease_owner':   owner,
+                'lease_expires': now + timedelta(seconds=lease_seconds),
+                'heartbeat_at':  now,
+                'attempts':      ScanJob.attempts + 1,
+            }, synchronize_session=False)
+        )
+        db.session.commit()
+        if claimed:
+            return ScanJob.query.get(candidate.id)
+
+
+def heartbeat(job_id, owner, lease_seconds=60):
+    """Extend a lease; returns False if ``owner`` no longer holds it."""
+    now = datetime.utcnow()
+    kept = (
+        ScanJob.query
+        .filter_by(id=job_id, lease_owner=owner, status='leased')
+        .update({
+            'heartbeat_at':  now,
+            'lease_expires': now + timedelta(seconds=lease_seconds),
+        }, synchronize_session=False)
+    )
+    db.session.commit()
+    return bool(kept)
+
+
+def finish(job_id, owner, status='done', error=None):
+    (
+        ScanJob.query
+        .filter_by(id=job_id, lease_owner=owner)
+        .update({
+            'status':        status,
+            'error':         error,
+            'finished_at':   datetime.utcnow(),
+            'lease_expires': None,
+        }, synchronize_session=False)
+    )
+    db.session.commit()
+
+
+def fail_exhausted(max_attempts):
+    """Give up on expired jobs that already used all their attempts."""
+    now = datetime.utcnow()
+    jobs = (
+        ScanJob.query
+        .filter(ScanJob.status == 'leased',
+                ScanJob.lease_expires < now,
+                ScanJob.attempts >= max_attempts)
+        .all()
+    )
+    for job in jobs:
+        job.status      = 'failed'
+        job.error       = 'lease expired too many times'
+        job.finished_at = now
+        job.scan.status = 'Failed'
+    if jobs:
+        db.session.commit()
+    return len(jobs)
+
+
+def has_live_job(scan_id):
+    """True if a job for this scan is queued or held by a worker with a live lease."""
+    now = datetime.utcnow()
+    return db.session.query(
+        ScanJob.query.filter(
+            ScanJob.scan_id == scan_id,
+            or_(ScanJob.status == 'queued',
+                and_(ScanJob.status == 'leased', ScanJob.lease_expires >= now))
+        ).exists()
+    ).scalar()
+
+
+def queue_depth():
+    return ScanJob.query.filter_by(status='queued').count()
@@ -1,8 +1,31 @@
 import json
+import zlib
+import ipaddress
 from datetime import datetime
 
 from extensions import db
 from flask_login import UserMixin
+from sqlalchemy.orm import validates, deferred
+
+
+def address_key(addr):
+    """Fixed-width, sortable string for an IP: '4' + 8 hex or '6' + 32 hex digits.
+
+    Plain string comparison on these keys orders addresses numerically, so
+    range/CIDR lookups can use an ordinary index on SQLite and Postgres alike.
+    """
+    addr = ipaddress.ip_address(addr)
+    width = 8 if addr.version == 4 else 32
+    return f"{addr.version}{int(addr):0{width}x}"
+
+
+def network_bounds(text):
+    """(lo, hi) address keys for an IP or CIDR string, or (None, None)."""
+    try:
+        net = ipaddress.ip_network(text.strip(), strict=False)
+    except (ValueError, AttributeError):
+        return None, None
+    return address_key(net.network_address), address_key(net.broadcast_address)
 
 
 user_roles = db.Table(
@@ -46,7 +69,45 @@ class ScanResult(db.Model):
     mode         = db.Column(db.String(20),  nullable=False)
     status       = db.Column(db.String(20),  nullable=False, default='Pending')
     timestamp    = db.Column(db.DateTime,     default=datetime.utcnow, nullable=False)
-    results_json = db.Column(db.Text,         nullable=True)
+    # address_key range of the target, for CIDR-aware history search
+    target_lo    = db.Column(db.String(33),   nullable=True)
+    target_hi    = db.Column(db.String(33),   nullable=True)
+    # hash of the normalized (target, ports, flags), for coalescing duplicates
+    param_hash   = db.Column(db.String(40),   nullable=True)
+    # Threaded network scans: ping-sweep first (None = SCAN_HOST_DISCOVERY)
+    host_discovery = db.Column(db.Boolean,    nullable=True)
+    # scanner.ENGINES key (None = SCAN_ENGINE)
+    engine       = db.Column(db.String(20),   nullable=True)
+    # the ScanProfile it was started from, its hosts per batch, and the
+    # cost estimate it was admitted with (profiles.py)
+    profile      = db.Column(db.String(64),   nullable=True)
+    batch_hosts  = db.Column(db.Integer,      nullable=True)
+    estimated_probes  = db.Column(db.BigInteger, nullable=True)
+    estimated_seconds = db.Column(db.Float,      nullable=True)
+    # raw archive in the blob store (blobstore.py): content hash + stored bytes
+    raw_ref      = db.Column(db.String(80),   nullable=True, index=True)
+    raw_size     = db.Column(db.BigInteger,   nullable=True)
+    # legacy in-row archives, until `scanner migrate-blobs` moves them out;
+    # deferred so listing scans never loads them
+    results_json = deferred(db.Column(db.Text,        nullable=True))   # uncompressed
+    results_raw  = deferred(db.Column(db.LargeBinary, nullable=True))   # zlib-compressed
+    nmap_args    = db.Column(db.Text,         nullable=True)
+    log_tail     = db.Column(db.Text,         nullable=True)   # recent -v lines
+
+    # run statistics, recorded when the scan finishes
+    finished_at     = db.Column(db.DateTime, nullable=True)
+    elapsed_seconds = db.Column(db.Float,    nullable=True)
+    hosts_per_sec   = db.Column(db.Float,    nullable=True)
+    ports_per_sec   = db.Column(db.Float,    nullable=True)
+    host_count      = db.Column(db.Integer,  nullable=True)
+    open_port_count = db.Column(db.Integer,  nullable=True)
+
+    hosts        = db.relationship(
+        'ScanHost',
+        backref='scan',
+        lazy='dynamic',
+        cascade='all, delete-orphan'
+    )
 
     # all the ChangeLog entries where this scan was the “new” scan
     changelogs   = db.relationship(
@@ -55,6 +116,227 @@ class ScanResult(db.Model):
         foreign_keys='ChangeLog.scan_id'
     )
 
+    __table_args__ = (
+        db.Index('ix_scan_result_target_ts', 'target', 'timestamp'),
+        db.Index('ix_scan_result_ts_id', 'timestamp', 'id'),
+        db.Index('ix_scan_result_status_ts', 'status', 'timestamp'),
+        db.Index('ix_scan_result_mode_ts', 'mode', 'timestamp'),
+        db.Index('ix_scan_result_target_range', 'target_lo', 'target_hi'),
+        db.Index('ix_scan_result_params_status', 'param_hash', 'status', 'id'),
+    )
+
+    @validates('target')
+    def _set_target_range(self, key, value):
+        self.target_lo, self.target_hi = network_bounds(value or '')
+        return value
+
+    @property
+    def raw_results(self):
+        """The archived xmltodict tree for this scan, or None if not kept.
+
+        Read (and decompressed) only when asked for.
+        """
+        if self.raw_ref:
+            from blobstore import get_store
+            with get_store().open(self.raw_ref) as f:
+                return json.load(f)
+        if self.results_raw:
+            return json.loads(zlib.decompress(self.results_raw))
+        if self.results_json:
+            return json.loads(self.results_json)
+        return None
+
+
+class ScanHost(db.Model):
+    __tablename__ = 'scan_host'
+    id          = db.Column(db.Integer, primary_key=True)
+    scan_id     = db.Column(db.Integer, db.ForeignKey('scan_result.id'), nullable=False)
+    ip          = db.Column(db.String(45),  nullable=True)
+    mac         = db.Column(db.String(17),  nullable=True)
+    hostname    = db.Column(db.String(255), nullable=True)
+    status      = db.Column(db.String(16),  nullable=True)
+    os_name     = db.Column(db.String(255), nullable=True)
+    os_accuracy = db.Column(db.String(8),   nullable=True)
+    ssl_cert    = db.Column(db.Text,        nullable=True)
+    http_title  = db.Column(db.Text,        nullable=True)
+    # report-ready summary, built once when the scan completes
+    open_port_count = db.Column(db.Integer, nullable=True)
+    summary_json    = db.Column(db.Text,    nullable=True)
+    # hash of every reported port's (protocol, port, state, service, version)
+    fingerprint     = db.Column(db.String(40), nullable=True)
+
+    ports   = db.relationship('ScanPort', backref='host', cascade='all, delete-orphan')
+    scripts = db.relationship('ScanScript', backref='host', cascade='all, delete-orphan')
+
+    __table_args__ = (
+        db.Index('ix_scan_host_scan_ip', 'scan_id', 'ip'),
+    )
+
+
+class ScanPort(db.Model):
+    __tablename__ = 'scan_port'
+    id        = db.Column(db.Integer, primary_key=True)
+    # scan_id is denormalized so exports/diffs never need to join through hosts
+    scan_id   = db.Column(db.Integer, db.ForeignKey('scan_result.id'), nullable=False)
+    host_id   = db.Column(db.Integer, db.ForeignKey('scan_host.id'),   nullable=False, index=True)
+    protocol  = db.Column(db.String(8),   nullable=False, default='tcp')
+    port      = db.Column(db.Integer,     nullable=False)
+    state     = db.Column(db.String(16),  nullable=False)
+    service   = db.Column(db.String(64),  nullable=True)
+    product   = db.Column(db.String(255), nullable=True)
+    version   = db.Column(db.String(128), nullable=True)
+    extrainfo = db.Column(db.String(255), nullable=True)
+
+    scripts = db.relationship('ScanScript', backref='port')
+
+    __table_args__ = (
+        db.Index('ix_scan_port_scan_state', 'scan_id', 'state'),
+        db.Index('ix_scan_port_port_state', 'port', 'state'),
+    )
+
+    @property
+    def version_string(self):
+        return " ".join(filter(None, [self.product, self.version]))
+
+
+class ScanScript(db.Model):
+    __tablename__ = 'scan_script'
+    id        = db.Column(db.Integer, primary_key=True)
+    scan_id   = db.Column(db.Integer, db.ForeignKey('scan_result.id'), nullable=False, index=True)
+    host_id   = db.Column(db.Integer, db.ForeignKey('scan_host.id'),   nullable=False, index=True)
+    port_id   = db.Column(db.Integer, db.ForeignKey('scan_port.id'),   nullable=True)
+    script_id = db.Column(db.String(64), nullable=False)
+    output    = db.Column(db.Text,       nullable=True)
+
+
+class ScanChunk(db.Model):
+    """Checkpoint for one sub-job (host batch / port chunk) of a scan."""
+    __tablename__ = 'scan_chunk'
+    id          = db.Column(db.Integer, primary_key=True)
+    scan_id     = db.Column(db.Integer, db.ForeignKey('scan_result.id'), nullable=False)
+    kind        = db.Column(db.String(8),  nullable=False)   # hosts / ports / full
+    spec        = db.Column(db.Text,       nullable=False)   # nmap targets or -p spec
+    status      = db.Column(db.String(16), nullable=False, default='running')
+    started_at  = db.Column(db.DateTime,   default=datetime.utcnow, nullable=False)
+    finished_at = db.Column(db.DateTime,   nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_scan_chunk_scan_status', 'scan_id', 'status'),
+    )
+
+
+class ScanJob(db.Model):
+    """One queued run of a ScanResult, leased by a worker while it executes."""
+    __tablename__ = 'scan_job'
+    id            = db.Column(db.Integer, primary_key=True)
+    scan_id       = db.Column(db.Integer, db.ForeignKey('scan_result.id'), nullable=False, index=True)
+    threads       = db.Column(db.Integer,    nullable=True)
+    priority      = db.Column(db.Integer,    nullable=False, default=0)   # lower runs first
+    run_after     = db.Column(db.DateTime,   nullable=True)   # not leasable before this
+    status        = db.Column(db.String(16), nullable=False, default='queued')
+    attempts      = db.Column(db.Integer,    nullable=False, default=0)
+    lease_owner   = db.Column(db.String(64), nullable=True)
+    lease_expires = db.Column(db.DateTime,   nullable=True)
+    heartbeat_at  = db.Column(db.DateTime,   nullable=True)
+    created_at    = db.Column(db.DateTime,   default=datetime.utcnow, nullable=False)
+    finished_at   = db.Column(db.DateTime,   nullable=True)
+    error         = db.Column(db.Text,       nullable=True)
+
+    scan = db.relationship('ScanResult', backref='jobs')
+
+    __table_args__ = (
+        db.Index('ix_scan_job_status_priority', 'status', 'priority', 'id'),
+    )
+
+
+class Schedule(db.Model):
+    """A one-off or recurring scan; its APScheduler job is keyed by job_id."""
+    __tablename__ = 'schedule'
+    id               = db.Column(db.Integer, primary_key=True)
+    job_id           = db.Column(db.String(64),  nullable=False, unique=True)
+    target           = db.Column(db.String(100), nullable=False)
+    ports            = db.Column(db.String(100), nullable=True)
+    flags            = db.Column(db.String(200), nullable=True)
+    mode             = db.Column(db.String(20),  nullable=False, default='Basic')
+    threads          = db.Column(db.Integer,     nullable=True)
+    run_at           = db.Column(db.DateTime,    nullable=False)   # first run / time of day
+    days_of_week     = db.Column(db.String(20),  nullable=True)    # "0,2,4" = Mon, Wed, Fri
+    interval_minutes = db.Column(db.Integer,     nullable=True)
+    cron             = db.Column(db.String(100), nullable=True)    # crontab, wins over the rest
+    jitter_seconds   = db.Column(db.Integer,     nullable=True)
+    active           = db.Column(db.Boolean,     nullable=False, default=True)
+    last_fired       = db.Column(db.DateTime,    nullable=True)
+    last_scan_id     = db.Column(db.Integer, db.ForeignKey('scan_result.id'), nullable=True)
+    created_at       = db.Column(db.DateTime,    default=datetime.utcnow, nullable=False)
+
+    @property
+    def weekdays(self):
+        return [d for d in (self.days_of_week or '').split(',') if d]
+
+    @property
+    def recurring(self):
+        return bool(self.cron or self.weekdays or self.interval_minutes)
+
+
+class ScanProfile(db.Model):
+    """A named, validated set of scan settings (profiles.py)."""
+    __tablename__ = 'scan_profile'
+    id          = db.Column(db.Integer, primary_key=True)
+    name        = db.Column(db.String(64),  nullable=False, unique=True)
+    description = db.Column(db.String(255), nullable=True)
+    ports       = db.Column(db.String(100), nullable=True)
+    timing      = db.Column(db.Integer,     nullable=True)    # -T0 .. -T5
+    scripts     = db.Column(db.String(255), nullable=True)    # --script value
+    flags       = db.Column(db.String(200), nullable=True)    # other nmap options
+    engine      = db.Column(db.String(20),  nullable=True)
+    mode        = db.Column(db.String(20),  nullable=True)
+    discovery   = db.Column(db.Boolean,     nullable=True)
+    batch_hosts = db.Column(db.Integer,     nullable=True)
+    concurrency = db.Column(db.Integer,     nullable=True)
+    max_rate    = db.Column(db.Integer,     nullable=True)
+    created_at  = db.Column(db.DateTime,    default=datetime.utcnow, nullable=False)
+    updated_at  = db.Column(db.DateTime,    default=datetime.utcnow, onupdate=datetime.utcnow)
+
+
+class AssetHost(db.Model):
+    """Latest known state of one address: the change baseline and the inventory."""
+    __tablename__ = 'asset_host'
+    id           = db.Column(db.Integer, primary_key=True)
+    ip           = db.Column(db.String(45),  nullable=False, unique=True)
+    ip_key       = db.Column(db.String(33),  nullable=False, index=True)
+    hostname     = db.Column(db.String(255), nullable=True)
+    status       = db.Column(db.String(16),  nullable=False, default='up')
+    fingerprint  = db.Column(db.String(40),  nullable=True)
+    first_seen   = db.Column(db.DateTime,    nullable=True)
+    last_seen    = db.Column(db.DateTime,    nullable=True, index=True)
+    last_scan_id = db.Column(db.Integer, db.ForeignKey('scan_result.id'), nullable=True)
+
+    ports = db.relationship('AssetPort', backref='host', cascade='all, delete-orphan')
+
+
+class AssetPort(db.Model):
+    """One port of an asset as last observed. Rows are kept when a port closes."""
+    __tablename__ = 'asset_port'
+    id           = db.Column(db.Integer, primary_key=True)
+    host_id      = db.Column(db.Integer, db.ForeignKey('asset_host.id'), nullable=False)
+    # copied from the host so port/service lookups filter by CIDR off one index
+    ip_key       = db.Column(db.String(33),  nullable=False)
+    protocol     = db.Column(db.String(8),   nullable=False, default='tcp')
+    port         = db.Column(db.Integer,     nullable=False)
+    state        = db.Column(db.String(16),  nullable=False)
+    service      = db.Column(db.String(64),  nullable=True)
+    version      = db.Column(db.String(255), nullable=True)
+    first_seen   = db.Column(db.DateTime,    nullable=True)
+    last_seen    = db.Column(db.DateTime,    nullable=True)
+    last_scan_id = db.Column(db.Integer, db.ForeignKey('scan_result.id'), nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('host_id', 'protocol', 'port', name='uq_asset_port_host_proto_port'),
+        db.Index('ix_asset_port_port_state_ip', 'port', 'state', 'ip_key'),
+        db.Index('ix_asset_port_service_state_ip', 'service', 'state', 'ip_key'),
+        db.Index('ix_asset_port_state_seen', 'state', 'last_seen'),
+    )
+
 
 class ChangeLog(db.Model):
     __tablename__ = 'change_log'
@@ -68,4 +350,38 @@ class ChangeLog(db.Model):
         'ScanResult',
         foreign_keys=[previous_scan_id],
         backref='rescan_of'
-    )
\ No newline at end of file
+    )
+
+    @property
+    def changes(self):
+        """The parsed diff, or an empty dict while it is still pending."""
+        try:
+            return json.loads(self.diff)
+        except (TypeError, ValueError):
+            return {}
+
+
+class ScanRollup(db.Model):
+    """Per-target daily summary of scans the retention job has expired (retention.py)."""
+    __tablename__ = 'scan_rollup'
+    id              = db.Column(db.Integer, primary_key=True)
+    target          = db.Column(db.String(100), nullable=False)
+    day             = db.Column(db.Date,        nullable=False)
+    scans           = db.Column(db.Integer,     nullable=False, default=0)
+    completed       = db.Column(db.Integer,     nullable=False, default=0)
+    hosts_up_max    = db.Column(db.Integer,     nullable=False, default=0)
+    open_ports_max  = db.Column(db.Integer,     nullable=False, default=0)
+    open_ports_last = db.Column(db.Integer,     nullable=True)
+    # summed over the day's change logs (changes.py summary keys)
+    changed_assets  = db.Column(db.Integer,     nullable=False, default=0)
+    ports_added     = db.Column(db.Integer,     nullable=False, default=0)
+    ports_removed   = db.Column(db.Integer,     nullable=False, default=0)
+    ports_changed   = db.Column(db.Integer,     nullable=False, default=0)
+    # ids of the scans rolled up (the rows themselves are gone)
+    first_scan_id   = db.Column(db.Integer,     nullable=True)
+    last_scan_id    = db.Column(db.Integer,     nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('target', 'day', name='uq_scan_rollup_target_day'),
+        db.Index('ix_scan_rollup_day', 'day'),
+    )
@@ -0,0 +1,67 @@
+# nmapxml.py
+#
+# Incremental parser for nmap's -oX output. Feed it bytes as nmap writes them
+# and it hands back one xmltodict-shaped host dict per closed <host> tag,
+# dropping each element as soon as it has been converted.
+
+import xml.etree.ElementTree as ET
+
+
+def element_to_dict(elem):
+    """Convert an Element to the same shape xmltodict.parse would produce."""
+    d = {f"@{k}": v for k, v in elem.attrib.items()}
+    for child in elem:
+        value = element_to_dict(child)
+        if child.tag in d:
+            if not isinstance(d[child.tag], list):
+                d[child.tag] = [d[child.tag]]
+            d[child.tag].append(value)
+        else:
+            d[child.tag] = value
+    text = (elem.text or '').strip()
+    if text:
+        if not d:
+            return text
+        d['#text'] = text
+    return d or None
+
+
+class HostStream:
+    """Pull parser over a growing nmap XML document."""
+
+    def __init__(self):
+        self._parser = ET.XMLPullParser(events=('start', 'end'))
+        self._root   = None
+        self._depth  = 0
+        self.args     = None
+        self.runstats = None
+
+    def feed(self, data):
+        """Feed a chunk of XML and return the host dicts it completed."""
+        self._parser.feed(data)
+        return self._drain()
+
+    def close(self):
+        self._parser.close()
+        return self._drain()
+
+    def _drain(self):
+        hosts = []
+        for event, elem in self._parser.read_events():
+            if event == 'start':
+                self._depth += 1
+                if self._depth == 1:
+                    self._root = elem
+                    self.args  = elem.get('args')
+                continue
+
+            self._depth -= 1
+            if self._depth != 1:
+                continue
+            # a direct child of <nmaprun> just closed
+            if elem.tag == 'host':
+                hosts.append(element_to_dict(elem))
+            elif elem.tag == 'runstats':
+                self.runstats = element_to_dict(elem)
+            self._root.remove(elem)
+        return hosts
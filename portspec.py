@@ -0,0 +1,296 @@
+# portspec.py
+#
+# Port specifications as compact interval sets. A spec like "T:1-1024,8080,
+# U:53,top:100" is parsed once into sorted, merged (lo, hi) ranges per
+# protocol, so union / subtract / count never expand 1-65535 into a list,
+# and str() turns any set back into the shortest nmap -p syntax.
+#
+# chunks() splits a set into pieces of roughly equal expected cost rather than
+# equal port counts: well-known ports (and UDP) tend to answer and draw
+# service/script probes, while a run of closed high ports is cheap.
+
+import os
+import bisect
+import functools
+
+PROTOCOLS = {'T': 'tcp', 'U': 'udp', 'S': 'sctp'}
+PREFIX    = {v: k for k, v in PROTOCOLS.items()}
+MAX_PORT  = 65535
+
+NMAP_SERVICES_PATHS = (
+    os.environ.get('NMAP_SERVICES', ''),
+    '/usr/share/nmap/nmap-services',
+    '/usr/local/share/nmap/nmap-services',
+    '/opt/homebrew/share/nmap/nmap-services',
+)
+
+# Most frequently open ports, best first, for when nmap-services is missing.
+# TCP is nmap's -F (top 100) set; UDP its top 20.
+TOP_TCP = [
+    80, 23, 443, 21, 22, 25, 3389, 110, 445, 139, 143, 53, 135, 3306, 8080,
+    1723, 111, 995, 993, 5900, 1025, 587, 8888, 199, 1720, 465, 548, 113, 81,
+    6001, 10000, 514, 5060, 179, 1026, 2000, 8443, 8000, 32768, 554, 26, 1433,
+    49152, 2001, 515, 8008, 49154, 1027, 5666, 646, 5000, 5631, 631, 49153,
+    8081, 2049, 88, 79, 5800, 106, 2121, 1110, 49155, 6000, 513, 990, 5357,
+    427, 49156, 543, 544, 5101, 144, 7, 389, 8009, 3128, 444, 9999, 5009,
+    7070, 5190, 3000, 5432, 1900, 3986, 13, 1029, 9, 5051, 6646, 49157, 1028,
+    873, 1755, 2717, 4899, 9100, 119, 37,
+]
+TOP_UDP = [
+    631, 161, 137, 123, 138, 1434, 445, 135, 67, 53, 139, 500, 68, 520, 1900,
+    4500, 514, 49152, 162, 69,
+]
+
+# relative cost of one probe; see port_cost()
+COST_TOP, COST_LOW, COST_HIGH, UDP_FACTOR = 4, 2, 1, 10
+
+
+class PortSpecError(ValueError):
+    pass
+
+
+@functools.lru_cache(maxsize=1)
+def _services_ranking():
+    """{protocol: [ports by open frequency]} from nmap-services, or None."""
+    for path in NMAP_SERVICES_PATHS:
+        if not path or not os.path.exists(path):
+            continue
+        ranked = {}
+        with open(path, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) < 3 or line.startswith('#'):
+                    continue
+                port, _, proto = fields[1].partition('/')
+                try:
+                    ranked.setdefault(proto, []).append((float(fields[2]), int(port)))
+                except ValueError:
+                    continue
+        return {proto: [p for _, p in sorted(items, key=lambda x: (-x[0], x[1]))]
+                for proto, items in ranked.items()}
+    return None
+
+
+def top_ports(protocol, n):
+    """The n most commonly open ports for a protocol."""
+    ranking = _services_ranking()
+    if ranking and protocol in ranking:
+        ports = ranking[protocol]
+    else:
+        ports = {'tcp': TOP_TCP, 'udp': TOP_UDP}.get(protocol, [])
+    if n < 1 or n > len(ports):
+        raise PortSpecError(
+            f"top:{n} is not available for {protocol} (at most {len(ports)} known)"
+        )
+    return ports[:n]
+
+
+@functools.lru_cache(maxsize=4)
+def _hot_ports(protocol):
+    """Sorted ports that usually answer (top 100), used by the cost model."""
+    try:
+        return tuple(sorted(top_ports(protocol, 100)))
+    except PortSpecError:
+        return tuple(sorted({'tcp': TOP_TCP, 'udp': TOP_UDP}.get(protocol, [])))
+
+
+def merge(intervals):
+    """Sort and coalesce overlapping or adjacent (lo, hi) ranges."""
+    merged = []
+    for lo, hi in sorted(intervals):
+        if merged and lo <= merged[-1][1] + 1:
+            if hi > merged[-1][1]:
+                merged[-1] = (merged[-1][0], hi)
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+def subtract(intervals, remove):
+    """Ranges in ``intervals`` not covered by ``remove`` (both merged)."""
+    out = []
+    j = 0
+    for lo, hi in intervals:
+        while j < len(remove) and remove[j][1] < lo:
+            j += 1
+        k = j
+        while k < len(remove) and remove[k][0] <= hi:
+            if remove[k][0] > lo:
+                out.append((lo, remove[k][0] - 1))
+            lo = max(lo, remove[k][1] + 1)
+            k += 1
+        if lo <= hi:
+            out.append((lo, hi))
+    return out
+
+
+def port_cost(protocol, port):
+    base = COST_HIGH
+    if port in _hot_ports(protocol):
+        base = COST_TOP
+    elif port < 1024:
+        base = COST_LOW
+    return base * (UDP_FACTOR if protocol == 'udp' else 1)
+
+
+def _segments(protocol, lo, hi):
+    """Split [lo, hi] into runs of constant per-port cost: (a, b, unit_cost)."""
+    hot = _hot_ports(protocol)
+    factor = UDP_FACTOR if protocol == 'udp' else 1
+    a = lo
+    i = bisect.bisect_left(hot, lo)
+    while a <= hi:
+        nxt = hot[i] if i < len(hot) and hot[i] <= hi else None
+        if nxt == a:
+            yield a, a, COST_TOP * factor
+            a += 1
+            i += 1
+            continue
+        end = (nxt - 1) if nxt is not None else hi
+        if a < 1024:
+            b = min(end, 1023)
+            yield a, b, COST_LOW * factor
+        else:
+            b = end
+            yield a, b, COST_HIGH * factor
+        a = b + 1
+
+
+class PortSpec:
+    """Ports per protocol as sorted, merged (lo, hi) intervals."""
+
+    def __init__(self, intervals=None):
+        self.intervals = {}
+        for proto, spans in (intervals or {}).items():
+            spans = merge(spans)
+            if spans:
+                self.intervals[proto] = spans
+
+    @classmethod
+    def parse(cls, text, default_protocol='tcp'):
+        """Parse nmap -p syntax plus ``top:N``; raises PortSpecError."""
+        spans = {}
+        proto = default_protocol
+        for raw in (text or '').replace(' ', '').split(','):
+            part = raw
+            if len(part) > 1 and part[1] == ':' and part[0].upper() in PROTOCOLS:
+                proto = PROTOCOLS[part[0].upper()]
+                part = part[2:]
+            if not part:
+                if raw:
+                    continue   # a bare "U:" just switches protocol
+                if text and text.strip():
+                    raise PortSpecError("empty item in port list")
+                continue
+            if part.lower().startswith('top:'):
+                try:
+                    n = int(part[4:])
+                except ValueError:
+                    raise PortSpecError(f"bad top-N list: {raw}")
+                spans.setdefault(proto, []).extend((p, p) for p in top_ports(proto, n))
+                continue
+            a, dash, b = part.partition('-')
+            try:
+                lo = int(a) if a else 1
+                hi = (int(b) if b else MAX_PORT) if dash else lo
+            except ValueError:
+                raise PortSpecError(f"bad port or range: {raw}")
+            if not 1 <= lo <= hi <= MAX_PORT:
+                raise PortSpecError(f"port range out of bounds: {raw}")
+            spans.setdefault(proto, []).append((lo, hi))
+        return cls(spans)
+
+    # -- set operations ----------------------------------------------------
+
+    def union(self, other):
+        protos = set(self.intervals) | set(other.intervals)
+        return PortSpec({
+            p: self.intervals.get(p, []) + other.intervals.get(p, []) for p in protos
+        })
+
+    def subtract(self, other):
+        return PortSpec({
+            p: subtract(spans, other.intervals.get(p, []))
+            for p, spans in self.intervals.items()
+        })
+
+    def contains(self, protocol, port):
+        spans = self.intervals.get(protocol, [])
+        i = bisect.bisect_right(spans, (port, MAX_PORT + 1)) - 1
+        return i >= 0 and spans[i][0] <= port <= spans[i][1]
+
+    def count(self):
+        return sum(hi - lo + 1 for spans in self.intervals.values() for lo, hi in spans)
+
+    def __len__(self):
+        return self.count()
+
+    def __bool__(self):
+        return bool(self.intervals)
+
+    def __eq__(self, other):
+        return isinstance(other, PortSpec) and self.intervals == other.intervals
+
+    # -- rendering ---------------------------------------------------------
+
+    def __str__(self):
+        """Shortest nmap -p form; protocol prefixes only when not plain TCP."""
+        def ranges(spans):
+            return ",".join(str(lo) if lo == hi else f"{lo}-{hi}" for lo, hi in spans)
+        if set(self.intervals) <= {'tcp'}:
+            return ranges(self.intervals.get('tcp', []))
+        return ",".join(
+            f"{PREFIX[p]}:{ranges(self.intervals[p])}"
+            for p in ('tcp', 'udp', 'sctp') if p in self.intervals
+        )
+
+    def __repr__(self):
+        return f"PortSpec({str(self)!r})"
+
+    # -- cost and chunking -------------------------------------------------
+
+    def cost(self):
+        return sum(
+            (b - a + 1) * unit
+            for proto, spans in self.intervals.items()
+            for lo, hi in spans
+            for a, b, unit in _segments(proto, lo, hi)
+        )
+
+    def chunks(self, n):
+        """Split into at most n PortSpecs of roughly equal expected cost."""
+        n = max(1, min(n, self.count()))
+        target = self.cost() / n
+        chunks, current, spent = [], {}, 0.0
+
+        def close():
+            nonlocal current, spent
+            if current:
+                chunks.append(PortSpec(current))
+            current, spent = {}, 0.0
+
+        for proto in ('tcp', 'udp', 'sctp'):
+            for lo, hi in self.intervals.get(proto, []):
+                for a, b, unit in _segments(proto, lo, hi):
+                    while a <= b:
+                        if len(chunks) == n - 1:
+                            take = b   # the last chunk takes the remainder
+                        else:
+                            room = max(int((target - spent) // unit), 1)
+                            take = min(b, a + room - 1)
+                        current.setdefault(proto, []).append((a, take))
+                        spent += (take - a + 1) * unit
+                        a = take + 1
+                        if spent >= target and len(chunks) < n - 1:
+                            close()
+        close()
+        return chunks
+
+
+def parse_or_none(text):
+    """PortSpec for ``text`` or None when it is empty or invalid (e.g. legacy rows)."""
+    try:
+        spec = PortSpec.parse(text)
+    except PortSpecError:
+        return None
+    return spec or None
@@ -0,0 +1,458 @@
+# profiles.py
+#
+# Named scan profiles and the admission check every scan request passes.
+#
+#   * a profile (models.ScanProfile) bundles ports, timing template, scripts,
+#     extra nmap options, engine, mode, batch size and concurrency; it is
+#     validated once when saved and compiled to an nmap argv
+#   * nmap options are checked against an allowlist: options that read or
+#     write files (-oX, -iL, --datadir, --script with a path, ...), add
+#     targets (-iR, bare addresses) or are set by the scanner itself (-p) are
+#     rejected, and option values must look like what nmap expects. Ad-hoc
+#     custom flags on /scan go through the same check.
+#   * estimate() turns a profile (or ad-hoc parameters) plus a target into
+#     probes, nmap processes and a rough duration. The model is deliberately
+#     simple - addresses x ports x a per-process probe rate for the timing
+#     template, capped by NMAP_MAX_PPS and the per-subnet rate budgets of
+#     ratelimit.py, plus service/OS detection on the ports expected to be
+#     open - and tuned with the SCAN_ESTIMATE_* settings.
+#   * admit() holds each new scan against the capacity budget before it is
+#     queued: over SCAN_BUDGET_MAX_PROBES / _MAX_SECONDS it is rejected, and
+#     when the queued + running backlog would pass SCAN_BUDGET_BACKLOG_SECONDS
+#     it is either rejected or queued behind everything else
+#     (SCAN_BUDGET_OVERFLOW).
+
+import re
+import math
+import shlex
+import ipaddress
+
+from flask import current_app
+from sqlalchemy import func
+
+from extensions import db
+from models import ScanResult, ScanProfile
+from portspec import PortSpec, PortSpecError, UDP_FACTOR
+from ratelimit import limiter
+
+# queued behind interactive and scheduled scans when over the backlog budget
+PRIORITY_OVER_BUDGET = 100
+
+NAME_RE   = re.compile(r'^[A-Za-z0-9][A-Za-z0-9_.\-]{0,63}$')
+INT_RE    = re.compile(r'^\d+$')
+NUMBER_RE = re.compile(r'^\d+(\.\d+)?$')
+TIME_RE   = re.compile(r'^\d+(\.\d+)?(ms|s|m|h)?$')
+# script names, categories and boolean expressions of them; no paths
+SCRIPTS_RE = re.compile(r'^[A-Za-z0-9_.,*\-+() ]+$')
+TIMING_NAMES = {'paranoid': 0, 'sneaky': 1, 'polite': 2, 'normal': 3,
+                'aggressive': 4, 'insane': 5}
+VERBOSE_RE = re.compile(r'^-(v+|v\d|d+|d\d)$')
+
+# probes per second one nmap process manages with each timing template; -T0
+# to -T2 are bound by their scan delay, -T3 and up by the network
+TIMING_RATE = {0: 1 / 300.0, 1: 1 / 15.0, 2: 2.5, 3: 300.0, 4: 1000.0, 5: 3000.0}
+
+DETECT_OPTIONS = {'-sV', '-sC', '-A', '--script'}
+OS_OPTIONS     = {'-O', '-A'}
+
+
+class ProfileError(ValueError):
+    pass
+
+
+class OverBudget(Exception):
+    """A scan request the capacity budget won't take; ``retry_after`` is set
+    (seconds) when it only has to wait for the backlog to drain."""
+
+    def __init__(self, message, estimate, retry_after=None):
+        super().__init__(message)
+        self.estimate    = estimate
+        self.retry_after = retry_after
+
+
+def _checker(pattern, what):
+    def check(value):
+        if not pattern.match(value):
+            raise ProfileError(f"{what} expected, got {value!r}")
+    return check
+
+
+def _range(lo, hi):
+    def check(value):
+        if not INT_RE.match(value) or not lo <= int(value) <= hi:
+            raise ProfileError(f"a number from {lo} to {hi} expected, got {value!r}")
+    return check
+
+
+def _addresses(value):
+    for part in value.split(','):
+        try:
+            ipaddress.ip_network(part.strip(), strict=False)
+        except ValueError:
+            raise ProfileError(f"addresses or networks expected, got {value!r}")
+
+
+def _no_paths(value):
+    if '/' in value or '\\' in value:
+        raise ProfileError("file paths are not allowed in option values")
+
+
+_int    = _checker(INT_RE, "a whole number")
+_number = _checker(NUMBER_RE, "a number")
+_time   = _checker(TIME_RE, "a time like 500ms, 30s or 5m")
+
+
+def _scripts(value):
+    _no_paths(value)
+    _checker(SCRIPTS_RE, "script names or categories")(value)
+
+
+# options that stand alone
+SWITCHES = {
+    '-sS', '-sT', '-sA', '-sW', '-sM', '-sN', '-sF', '-sX', '-sU', '-sY', '-sZ', '-sO',
+    '-sV', '-sC', '-sn', '-O', '-A', '-F', '-r', '-n', '-R', '-6', '-Pn',
+    '-PE', '-PP', '-PM', '-PR', '-v', '-vv', '-vvv', '-d', '-dd',
+    '--open', '--reason', '--traceroute', '--system-dns', '--version-light',
+    '--version-all', '--version-trace', '--osscan-limit', '--osscan-guess',
+    '--script-trace', '--defeat-rst-ratelimit', '--defeat-icmp-ratelimit',
+    '--disable-arp-ping',
+}
+# options followed by a value (separately or as --opt=value)
+VALUED = {
+    '--top-ports':           _range(1, 65535),
+    '--script':              _scripts,
+    '--script-args':         _no_paths,
+    '--script-timeout':      _time,
+    '--version-intensity':   _range(0, 9),
+    '--max-os-tries':        _range(1, 50),
+    '--max-retries':         _range(0, 50),
+    '--host-timeout':        _time,
+    '--min-rate':            _number,
+    '--max-rate':            _number,
+    '--min-hostgroup':       _int,
+    '--max-hostgroup':       _int,
+    '--min-parallelism':     _int,
+    '--max-parallelism':     _int,
+    '--min-rtt-timeout':     _time,
+    '--max-rtt-timeout':     _time,
+    '--initial-rtt-timeout': _time,
+    '--scan-delay':          _time,
+    '--max-scan-delay':      _time,
+    '--stats-every':         _time,
+    '--source-port':         _range(1, 65535),
+    '-g':                    _range(1, 65535),
+    '--data-length':         _range(0, 1400),
+    '--ttl':                 _range(1, 255),
+    '--exclude':             _addresses,
+    '--dns-servers':         _addresses,
+}
+# ping probes take their port list attached: -PS22,80,443
+PING_PORTS = re.compile(r'^-P[SAUY](\d{1,5}(-\d{1,5})?(,\d{1,5}(-\d{1,5})?)*)?$')
+TIMING = re.compile(r'^-T([0-5]|' + '|'.join(TIMING_NAMES) + r')$')
+
+
+def split_flags(flags):
+    """nmap options as an argv list; unbalanced quotes fall back to whitespace."""
+    if isinstance(flags, (list, tuple)):
+        return list(flags)
+    try:
+        return shlex.split(flags or '')
+    except ValueError:
+        return (flags or '').split()
+
+
+def validate_flags(flags):
+    """Check nmap options against the allowlist; returns them as argv.
+
+    Raises ProfileError naming the first option that isn't allowed.
+    """
+    try:
+        tokens = shlex.split(flags or '') if not isinstance(flags, (list, tuple)) else list(flags)
+    except ValueError as e:
+        raise ProfileError(f"cannot parse flags: {e}")
+    argv = []
+    it = iter(tokens)
+    for tok in it:
+        name, eq, value = tok.partition('=')
+        if tok in SWITCHES or PING_PORTS.match(tok) or TIMING.match(tok):
+            argv.append(tok)
+        elif name in VALUED:
+            if not eq:
+                value = next(it, None)
+                if value is None:
+                    raise ProfileError(f"{name} needs a value")
+            VALUED[name](value)
+            argv += [name, value]
+        elif tok.startswith('-p'):
+            raise ProfileError("set ports in the ports field, not with -p")
+        elif tok.startswith('-'):
+            raise ProfileError(f"option not allowed: {tok}")
+        else:
+            raise ProfileError(f"unexpected argument {tok!r} (targets go in the target field)")
+    return argv
+
+
+def is_verbose(argv):
+    return any(VERBOSE_RE.match(a) for a in argv)
+
+
+def option_value(argv, name):
+    """Value of ``name`` in an argv list (last one wins), or None."""
+    value = None
+    for i, tok in enumerate(argv):
+        if tok == name and i + 1 < len(argv):
+            value = argv[i + 1]
+        elif tok.startswith(name + '='):
+            value = tok.partition('=')[2]
+    return value
+
+
+def timing_level(argv):
+    level = 3
+    for tok in argv:
+        m = TIMING.match(tok)
+        if m:
+            level = int(m.group(1)) if m.group(1).isdigit() else TIMING_NAMES[m.group(1)]
+    return level
+
+
+def compile_profile(profile):
+    """The profile's nmap options as argv (ports and targets are separate)."""
+    argv = []
+    if profile.timing is not None:
+        argv.append(f"-T{profile.timing}")
+    argv += validate_flags(profile.flags or '')
+    if profile.scripts:
+        argv += ['--script', profile.scripts]
+    if profile.max_rate:
+        argv += ['--max-rate', str(profile.max_rate)]
+    return argv
+
+
+EDITABLE = ('description', 'ports', 'timing', 'scripts', 'flags', 'engine', 'mode',
+            'discovery', 'batch_hosts', 'concurrency', 'max_rate')
+
+
+def apply_profile_fields(profile, data):
+    """Copy validated fields onto a ScanProfile; raises ProfileError."""
+    from scanner import ENGINES
+
+    if 'name' in data:
+        name = (data['name'] or '').strip()
+        if not NAME_RE.match(name):
+            raise ProfileError("name: letters, digits, '.', '_' and '-', up to 64 characters")
+        profile.name = name
+    for field in EDITABLE:
+        if field not in data:
+            continue
+        value = data[field]
+        if isinstance(value, str):
+            value = value.strip()
+        if value in ('', None):
+            value = None
+        elif field == 'ports':
+            try:
+                value = str(PortSpec.parse(value))
+            except PortSpecError as e:
+                raise ProfileError(f"ports: {e}")
+        elif field == 'timing':
+            if str(value).lower() in TIMING_NAMES:
+                value = TIMING_NAMES[str(value).lower()]
+            if str(value) not in ('0', '1', '2', '3', '4', '5'):
+                raise ProfileError("timing: 0-5 or paranoid .. insane")
+            value = int(value)
+        elif field == 'scripts':
+            _scripts(value)
+        elif field == 'flags':
+            argv = validate_flags(value)
+            if any(TIMING.match(a) for a in argv) or '--script' in argv:
+                raise ProfileError("flags: use the timing and scripts fields")
+            value = shlex.join(argv)
+        elif field == 'engine':
+            if value not in ENGINES:
+                raise ProfileError(f"engine: one of {', '.join(sorted(ENGINES))}")
+        elif field == 'mode':
+            if value not in ('Basic', 'Threaded'):
+                raise ProfileError("mode: Basic or Threaded")
+        elif field == 'discovery':
+            value = bool(value)
+        elif field in ('batch_hosts', 'concurrency', 'max_rate'):
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise ProfileError(f"{field}: a whole number expected")
+            if value < 1:
+                raise ProfileError(f"{field} must be at least 1")
+        setattr(profile, field, value)
+    if not profile.name:
+        raise ProfileError("name is required")
+    compile_profile(profile)
+
+
+def profile_dict(profile):
+    return {
+        'name':        profile.name,
+        'description': profile.description,
+        'ports':       profile.ports,
+        'timing':      profile.timing,
+        'scripts':     profile.scripts,
+        'flags':       profile.flags,
+        'engine':      profile.engine,
+        'mode':        profile.mode,
+        'discovery':   profile.discovery,
+        'batch_hosts': profile.batch_hosts,
+        'concurrency': profile.concurrency,
+        'max_rate':    profile.max_rate,
+        'argv':        compile_profile(profile),
+        'updated_at':  profile.updated_at.isoformat() if profile.updated_at else None,
+    }
+
+
+# -- cost model --------------------------------------------------------------
+
+def target_hosts(target):
+    """Scannable addresses in a target string (addresses / CIDRs, space-separated)."""
+    hosts = 0
+    for part in (target or '').split():
+        try:
+            net = ipaddress.ip_network(part, strict=False)
+        except ValueError:
+            hosts += 1   # a hostname
+            continue
+        n = net.num_addresses
+        if n > 2 and net.version == 4:
+            n -= 2
+        elif n > 1 and net.version == 6:
+            n -= 1
+        hosts += n
+    return hosts
+
+
+def _port_counts(ports, argv, engine):
+    """(tcp, udp) ports probed per host."""
+    spec = None
+    if ports:
+        try:
+            spec = PortSpec.parse(ports)
+        except PortSpecError:
+            spec = None
+    if spec:
+        udp = sum(hi - lo + 1 for lo, hi in spec.intervals.get('udp', []))
+        return spec.count() - udp, udp
+    top = option_value(argv, '--top-ports')
+    n = int(top) if top and top.isdigit() else (100 if '-F' in argv else 1000)
+    if engine == 'connect':
+        return n, 0
+    udp = n if '-sU' in argv else 0
+    tcp = 0 if udp and not any(a in argv for a in ('-sS', '-sT', '-A')) else n
+    return tcp, udp
+
+
+def estimate(target, ports=None, flags=None, engine=None, mode=None, concurrency=None,
+             discovery=None):
+    """Rough cost of a scan: probes, nmap processes, probe rate and seconds."""
+    cfg     = current_app.config
+    argv    = split_flags(flags)
+    engine  = engine or cfg.get('SCAN_ENGINE', 'nmap')
+    mode    = mode or 'Basic'
+    threads = concurrency or cfg.get('DEFAULT_THREADS', 100)
+    up_ratio   = cfg.get('SCAN_ESTIMATE_UP_RATIO', 0.25)
+    open_ratio = cfg.get('SCAN_ESTIMATE_OPEN_RATIO', 0.01)
+
+    hosts = target_hosts(target)
+    tcp, udp = _port_counts(ports, argv, engine)
+    if discovery is None:
+        discovery = cfg.get('SCAN_HOST_DISCOVERY', True)
+    sweep_discovery = (discovery and '-Pn' not in argv and mode == 'Threaded' and hosts > 1)
+    scanned = math.ceil(hosts * up_ratio) if sweep_discovery else hosts
+    probes  = scanned * (tcp + udp * UDP_FACTOR) + (hosts * 6 if sweep_discovery else 0)
+
+    if engine == 'connect':
+        procs = 1
+        rate  = cfg.get('SCAN_CONNECT_CONCURRENCY', 10000) / max(cfg.get('SCAN_CONNECT_TIMEOUT', 1.5), 0.1)
+    else:
+        if mode == 'Threaded':
+            units = hosts if hosts > 1 else max(tcp + udp, 1)
+            procs = max(1, min(threads, units, cfg.get('NMAP_MAX_PROCS', 64)))
+        else:
+            procs = 1
+        rate = TIMING_RATE[timing_level(argv)] * procs
+        max_rate = option_value(argv, '--max-rate')
+        if max_rate and NUMBER_RE.match(max_rate):
+            rate = min(rate, float(max_rate) * procs)
+    if cfg.get('NMAP_MAX_PPS'):
+        rate = min(rate, cfg['NMAP_MAX_PPS'])
+    if cfg.get('SCAN_RATE_SUBNET_PPS'):
+        rate = min(rate, cfg['SCAN_RATE_SUBNET_PPS'] * limiter.subnet_count(target))
+    seconds = probes / rate if rate else float('inf')
+
+    # service / script / OS detection on what the sweep is expected to find
+    detect = 0.0
+    if DETECT_OPTIONS.intersection(argv) or option_value(argv, '--script'):
+        open_ports = scanned * (tcp + udp) * open_ratio
+        detect += open_ports * cfg.get('SCAN_ESTIMATE_DETECT_SECONDS', 5)
+    if OS_OPTIONS.intersection(argv):
+        detect += math.ceil(scanned * up_ratio) * cfg.get('SCAN_ESTIMATE_OS_SECONDS', 4)
+    if detect:
+        workers = cfg.get('SCAN_DETECT_WORKERS', 16) if mode == 'Threaded' or engine != 'nmap' else 1
+        detect /= max(1, min(workers, threads))
+
+    return {
+        'hosts':          hosts,
+        'ports':          tcp + udp,
+        'probes':         int(probes),
+        'procs':          procs,
+        'rate':           round(rate, 1),
+        'seconds':        round(seconds + detect, 1),
+        'detect_seconds': round(detect, 1),
+    }
+
+
+def backlog_seconds():
+    """Estimated seconds of work queued or running in the whole queue."""
+    return db.session.query(func.coalesce(func.sum(ScanResult.estimated_seconds), 0.0)).filter(
+        ScanResult.status.in_(('Queued', 'Running'))
+    ).scalar() or 0.0
+
+
+def admit(est, priority):
+    """Hold a new scan's estimate against the budget; returns the priority to
+    queue it at, or raises OverBudget."""
+    cfg = current_app.config
+    max_probes  = cfg.get('SCAN_BUDGET_MAX_PROBES')
+    max_seconds = cfg.get('SCAN_BUDGET_MAX_SECONDS')
+    backlog     = cfg.get('SCAN_BUDGET_BACKLOG_SECONDS')
+    if max_probes and est['probes'] > max_probes:
+        raise OverBudget(f"scan needs about {est['probes']:,} probes; "
+                         f"the limit is {max_probes:,}", est)
+    if max_seconds and est['seconds'] > max_seconds:
+        raise OverBudget(f"scan would take about {est['seconds']:,.0f}s; "
+                         f"the limit is {max_seconds:,}s", est)
+    if backlog:
+        queued = backlog_seconds()
+        if queued + est['seconds'] > backlog:
+            if cfg.get('SCAN_BUDGET_OVERFLOW', 'queue') == 'reject':
+                raise OverBudget(f"the queue already holds about {queued:,.0f}s of scans",
+                                 est, retry_after=int(queued + est['seconds'] - backlog) + 1)
+            return max(priority, PRIORITY_OVER_BUDGET)
+    return priority
+
+
+def get_profile(name):
+    return ScanProfile.query.filter_by(name=name).first()
+
+
+# the UI presets, as profiles (flask --app app scanner seed-profiles)
+DEFAULT_PROFILES = [
+    {'name': 'quick',      'description': "Open ports only",            'timing': 4},
+    {'name': 'version',    'description': "Version detection",          'timing': 4, 'flags': '-sV'},
+    {'name': 'os',         'description': "OS detection",               'flags': '-O'},
+    {'name': 'aggressive', 'description': "OS, versions, scripts, traceroute", 'flags': '-A'},
+    {'name': 'scripts',    'description': "Default scripts and versions",
+     'timing': 4, 'flags': '-sV -sC'},
+    {'name': 'web',        'description': "Web ports with titles and certificates",
+     'ports': '80,443,8000,8080,8443', 'timing': 4, 'flags': '-sV',
+     'scripts': 'http-title,ssl-cert', 'mode': 'Threaded'},
+    {'name': 'sweep',      'description': "Fast TCP connect sweep of the top 100 ports",
+     'ports': 'top:100', 'engine': 'connect', 'mode': 'Threaded'},
+]
@@ -0,0 +1,335 @@
+# ratelimit.py
+#
+# Per-target politeness for scan children. The governor caps how many
+# children run; this caps how hard they hit any one network:
+#
+#   * every /24 (IPv4) or /64 (IPv6) gets a budget of SCAN_RATE_SUBNET_PPS
+#     probes per second, shared by every child of every scan in the process
+#     that targets it; NMAP_MAX_PPS is the budget of the process's egress
+#   * before it starts, a child leases a slice of each budget its targets
+#     touch - at most 1/SCAN_RATE_SUBNET_SHARES of a subnet and 1/capacity of
+#     the egress - and the slice becomes its --max-rate (the connect engine
+#     paces to it). A child spread over several subnets is charged in
+#     proportion to its addresses in each. When less than SCAN_RATE_MIN_PPS
+#     is free, the child waits for one to finish.
+#   * budgets adapt (AIMD): nmap reporting dropped probes, or the connect
+#     engine's timeout ratio rising, cuts the budget of the subnets involved
+#     by SCAN_RATE_BACKOFF (at most once per SCAN_RATE_BACKOFF_SECONDS), and
+#     the egress budget too once several subnets report it together. Every
+#     child started since the last cut that finishes without a report gives
+#     SCAN_RATE_INCREASE_PPS back, up to the configured rate.
+#
+# Budgets are per process: with several worker processes on one box, divide
+# SCAN_RATE_SUBNET_PPS between them.
+
+import re
+import time
+import ipaddress
+import threading
+from contextlib import contextmanager
+
+GLOBAL = '*'
+# distinct subnets reporting congestion within SCAN_RATE_BACKOFF_SECONDS
+# before the egress budget backs off as well
+GLOBAL_SIGNALS = 3
+# idle, backed-off budgets remembered before the oldest are forgotten
+MAX_IDLE = 4096
+
+# nmap -v lines that mean probes are being dropped on the way
+CONGESTION_RE = re.compile(
+    r'^Increasing send delay for |giving up on port because retransmission cap hit'
+)
+
+
+class Budget:
+    """One key's probe rate: the current limit and how much is leased out."""
+
+    def __init__(self, ceiling):
+        self.ceiling   = ceiling
+        self.limit     = float(ceiling)
+        self.leased    = 0.0
+        self.holders   = 0
+        self.backed_at = 0.0   # monotonic time of the last back-off
+
+
+class Lease:
+    """A child's slice of the budgets its targets touch."""
+
+    def __init__(self, limiter, shares, rate=None):
+        self.limiter   = limiter
+        self.shares    = shares   # {key: fraction of the child's probes}
+        self.rate      = rate     # probes/s, None = unlimited
+        self.charges   = {}       # {key: probes/s leased from that budget}
+        self.congested = False
+        self.started   = time.monotonic()
+
+    def apply(self, slot):
+        """Cap a governor slot's max_rate at this lease."""
+        slot.lease = self
+        if self.rate:
+            rate = max(int(self.rate), 1)
+            slot.max_rate = min(slot.max_rate, rate) if slot.max_rate else rate
+        return slot.max_rate
+
+    def congestion(self):
+        """Report dropped probes; returns [(key, new limit)] for budgets cut."""
+        return self.limiter.back_off(self)
+
+
+class TimeoutMonitor:
+    """Flags a rise in the timeout ratio over windows of ``window`` attempts.
+
+    Filtered ports time out too, so the test is against the lowest ratio seen
+    so far in this child, not against zero.
+    """
+
+    def __init__(self, rise=0.1, window=500):
+        self.rise     = rise
+        self.window   = window
+        self.attempts = 0
+        self.timeouts = 0
+        self.baseline = None
+
+    def record(self, timed_out):
+        """Count one attempt; True when the window just closed on a rise."""
+        self.attempts += 1
+        self.timeouts += bool(timed_out)
+        if self.attempts < self.window:
+            return False
+        ratio = self.timeouts / self.attempts
+        self.attempts = self.timeouts = 0
+        if self.baseline is None or ratio < self.baseline:
+            self.baseline = ratio
+            return False
+        return ratio > self.baseline + self.rise
+
+
+def _networks(targets):
+    if isinstance(targets, (list, tuple)):
+        parts = targets
+    else:
+        parts = str(targets or '').split()
+    for part in parts:
+        try:
+            yield ipaddress.ip_network(str(part), strict=False)
+        except ValueError:
+            yield str(part).lower()   # a hostname is its own key
+
+
+class RateLimiter:
+
+    def __init__(self):
+        self._cond     = threading.Condition()
+        self._budgets  = {}
+        self._signals  = []   # [(monotonic time, subnet)] recent congestion
+        self.configure()
+
+    def init_app(self, app):
+        """Read the SCAN_RATE_* settings; call after governor.init_app."""
+        from governor import governor
+
+        cfg = app.config
+        self.configure(
+            subnet_pps=cfg.get('SCAN_RATE_SUBNET_PPS'),
+            global_pps=cfg.get('NMAP_MAX_PPS'),
+            shares=cfg.get('SCAN_RATE_SUBNET_SHARES', 4),
+            global_shares=governor.capacity,
+            min_pps=cfg.get('SCAN_RATE_MIN_PPS', 50),
+            backoff=cfg.get('SCAN_RATE_BACKOFF', 0.5),
+            increase_pps=cfg.get('SCAN_RATE_INCREASE_PPS', 100),
+            backoff_seconds=cfg.get('SCAN_RATE_BACKOFF_SECONDS', 10),
+            ipv4_prefix=cfg.get('SCAN_RATE_IPV4_PREFIX', 24),
+            ipv6_prefix=cfg.get('SCAN_RATE_IPV6_PREFIX', 64),
+            max_keys=cfg.get('SCAN_RATE_MAX_SUBNETS', 256),
+        )
+
+    def configure(self, subnet_pps=None, global_pps=None, shares=4, global_shares=1,
+                  min_pps=50, backoff=0.5, increase_pps=100, backoff_seconds=10,
+                  ipv4_prefix=24, ipv6_prefix=64, max_keys=256):
+        with self._cond:
+            self.subnet_pps      = subnet_pps
+            self.global_pps      = global_pps
+            self.shares          = max(int(shares), 1)
+            self.global_shares   = max(int(global_shares), 1)
+            self.min_pps         = max(min_pps, 1)
+            self.backoff         = backoff
+            self.increase_pps    = increase_pps
+            self.backoff_seconds = backoff_seconds
+            self.prefix          = {4: ipv4_prefix, 6: ipv6_prefix}
+            self.max_keys        = max_keys
+            self._budgets.clear()
+            self._cond.notify_all()
+
+    @property
+    def enabled(self):
+        return bool(self.subnet_pps or self.global_pps)
+
+    def keys(self, targets):
+        """{subnet: fraction of the addresses} for a child's targets. A network
+        spread over more than ``max_keys`` subnets puts too little on any one
+        of them to matter and only counts towards the total."""
+        counts, total = {}, 0
+        for net in _networks(targets):
+            if isinstance(net, str):
+                counts[net] = counts.get(net, 0) + 1
+                total += 1
+                continue
+            prefix = self.prefix[net.version]
+            total += net.num_addresses
+            if net.prefixlen >= prefix:
+                key = str(net.supernet(new_prefix=prefix))
+                counts[key] = counts.get(key, 0) + net.num_addresses
+            elif 2 ** (prefix - net.prefixlen) <= self.max_keys:
+                size = 2 ** (net.max_prefixlen - prefix)
+                for sub in net.subnets(new_prefix=prefix):
+                    counts[str(sub)] = counts.get(str(sub), 0) + size
+        return {key: n / total for key, n in counts.items()} if total else {}
+
+    def subnet_count(self, targets):
+        """Subnets a target string spans (for estimates; not capped)."""
+        n = 0
+        for net in _networks(targets):
+            if isinstance(net, str):
+                n += 1
+            else:
+                n += 2 ** max(self.prefix[net.version] - net.prefixlen, 0)
+        return n
+
+    # -- leasing -------------------------------------------------------------
+
+    def _budget(self, key):
+        b = self._budgets.get(key)
+        if b is None:
+            b = self._budgets[key] = Budget(self.global_pps if key == GLOBAL else self.subnet_pps)
+        return b
+
+    def _offer(self, shares):
+        """The rate a new child on ``shares`` may have now, or None to wait."""
+        rate = None
+        for key, frac in shares.items():
+            b = self._budget(key)
+            cap = min(b.limit - b.leased, max(b.limit / self.shares, self.min_pps))
+            rate = cap / frac if rate is None else min(rate, cap / frac)
+        if self.global_pps:
+            g = self._budget(GLOBAL)
+            cap = min(g.limit - g.leased, max(g.limit / self.global_shares, self.min_pps))
+            rate = cap if rate is None else min(rate, cap)
+        if rate is None:
+            return float('inf')
+        return rate if rate >= self.min_pps else None
+
+    def _charge(self, lease, rate):
+        for key, amount in lease.charges.items():
+            self._budgets[key].leased -= amount
+        lease.rate    = rate
+        lease.charges = {key: rate * frac for key, frac in lease.shares.items()}
+        if self.global_pps:
+            lease.charges[GLOBAL] = rate
+        for key, amount in lease.charges.items():
+            self._budgets[key].leased += amount
+
+    def _forget(self, keys):
+        """Drop budgets _offer created that nobody holds and that are at full rate."""
+        for key in list(keys) + [GLOBAL]:
+            b = self._budgets.get(key)
+            if b is not None and not b.holders and b.limit >= b.ceiling:
+                del self._budgets[key]
+
+    def acquire(self, targets, cancelled=None):
+        """Block until the targets' budgets have room; returns a Lease."""
+        if not self.enabled:
+            return Lease(self, {})
+        shares = self.keys(targets) if self.subnet_pps else {}
+        with self._cond:
+            while True:
+                rate = self._offer(shares)
+                if rate is not None:
+                    break
+                if cancelled is not None and cancelled.is_set():
+                    self._forget(shares)
+                    return Lease(self, {})
+                self._cond.wait(1.0)
+            lease = Lease(self, shares)
+            if rate == float('inf'):
+                self._forget(shares)
+                return lease
+            self._charge(lease, rate)
+            for key in lease.charges:
+                self._budgets[key].holders += 1
+            return lease
+
+    def release(self, lease):
+        """Return a lease; a child that saw no congestion raises its budgets."""
+        if not lease.charges:
+            return
+        with self._cond:
+            for key, amount in lease.charges.items():
+                b = self._budgets[key]
+                b.leased  = max(b.leased - amount, 0.0)
+                b.holders -= 1
+                # children that ran through a back-off don't count as clean
+                if not lease.congested and b.backed_at < lease.started:
+                    b.limit = min(b.ceiling, b.limit + self.increase_pps)
+                if not b.holders and b.limit >= b.ceiling:
+                    del self._budgets[key]
+            lease.charges = {}
+            if len(self._budgets) > MAX_IDLE:
+                idle = sorted((b.backed_at, key) for key, b in self._budgets.items()
+                              if not b.holders)
+                for _, key in idle[:len(self._budgets) - MAX_IDLE]:
+                    del self._budgets[key]
+            self._cond.notify_all()
+
+    @contextmanager
+    def lease(self, targets, cancelled=None):
+        lease = self.acquire(targets, cancelled)
+        try:
+            yield lease
+        finally:
+            self.release(lease)
+
+    def back_off(self, lease):
+        """Cut the budgets a congested child draws on, and the child's own
+        rate (where its engine can still change it)."""
+        now = time.monotonic()
+        cut = []
+        with self._cond:
+            lease.congested = True
+            subnets = [key for key in lease.charges if key != GLOBAL]
+            for key in subnets:
+                b = self._budgets[key]
+                if now - b.backed_at >= self.backoff_seconds:
+                    b.limit     = max(self.min_pps, b.limit * self.backoff)
+                    b.backed_at = now
+                    cut.append((key, b.limit))
+
+            # many subnets at once: the bottleneck is probably our own uplink
+            window = now - self.backoff_seconds
+            self._signals = [(t, k) for t, k in self._signals if t >= window]
+            self._signals += [(now, key) for key in subnets]
+            g = self._budgets.get(GLOBAL)
+            if (g is not None and now - g.backed_at >= self.backoff_seconds
+                    and len({k for _, k in self._signals}) >= GLOBAL_SIGNALS):
+                g.limit     = max(self.min_pps, g.limit * self.backoff)
+                g.backed_at = now
+                cut.append((GLOBAL, g.limit))
+
+            if cut and lease.rate:
+                self._charge(lease, max(self.min_pps, lease.rate * self.backoff))
+        return cut
+
+    def status(self):
+        """Settings plus every budget that is leased out or backed off."""
+        with self._cond:
+            return {
+                'subnet_pps': self.subnet_pps,
+                'global_pps': self.global_pps,
+                'budgets': {
+                    key: {'limit': round(b.limit, 1), 'leased': round(b.leased, 1),
+                          'children': b.holders}
+                    for key, b in self._budgets.items()
+                },
+            }
+
+
+limiter = RateLimiter()
@@ -0,0 +1,387 @@
+# results.py
+#
+# Helpers that turn nmap's xmltodict tree into ScanHost / ScanPort / ScanScript
+# rows, so consumers query the normalized tables instead of re-parsing a blob.
+
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+from extensions import db
+from models import ScanHost, ScanPort, ScanScript
+
+
+def as_list(value):
+    """xmltodict gives a dict for one child and a list for many; always return a list."""
+    if not value:
+        return []
+    return value if isinstance(value, list) else [value]
+
+
+def _merge_section(base, extra, child, key):
+    """Merge the ``child`` lists of two sections, matching items by ``key``;
+    the later item's attributes win."""
+    items = {}
+    for item in as_list((base or {}).get(child)) + as_list((extra or {}).get(child)):
+        k = key(item)
+        items[k] = {**items[k], **item} if k in items else item
+    return list(items.values())
+
+
+def merge_host(base, extra):
+    """One xmltodict <host> from two reports of the same address (port chunks,
+    or the sweep and detection stages of a scan). Ports and scripts are
+    matched by id with the later report's details winning, closed/filtered
+    counts of the chunks add up, and any other section is kept from the
+    first report that has it."""
+    merged = dict(base)
+    for name, value in extra.items():
+        if name == 'ports':
+            ports = {'port': sorted(
+                _merge_section(base.get('ports'), value, 'port',
+                               lambda p: (p.get('@protocol'), p.get('@portid'))),
+                key=lambda p: (p.get('@protocol') or '', _to_int(p.get('@portid')))
+            )}
+            counts = {}
+            for section in (base.get('ports'), value):
+                for e in as_list((section or {}).get('extraports')):
+                    state = e.get('@state')
+                    counts[state] = counts.get(state, 0) + _to_int(e.get('@count'))
+            if counts:
+                ports['extraports'] = [{'@state': st, '@count': str(n)} for st, n in counts.items()]
+            merged['ports'] = ports
+        elif name == 'hostscript':
+            merged['hostscript'] = {'script': _merge_section(
+                base.get('hostscript'), value, 'script', lambda sc: sc.get('@id'))}
+        elif not merged.get(name):
+            merged[name] = value
+    return merged
+
+
+class RawArchive:
+    """JSON archive of a scan built one host at a time, straight into a blob.
+
+    Produces the ``{"host": [...], "@args": ..., "runstats": ...}`` document
+    ScanResult.raw_results returns; ``writer`` (a blobstore.BlobWriter)
+    hashes and compresses it as it goes, so nothing is held in memory. Safe
+    to feed from several sub-scan threads.
+
+    An address that will be reported more than once (port chunks of one
+    host, or a host waiting for its detection stage) is held: its
+    reports are merged in memory and written as one host on the last
+    release() - or by finish().
+    """
+
+    def __init__(self, writer):
+        self._writer = writer
+        self._count  = 0
+        self._held   = {}   # ip -> [merged host or None, holds]
+        self._all    = False
+        self._lock   = threading.Lock()
+        self._writer.write(b'{"host": [')
+
+    def _write(self, h):
+        text = json.dumps(h, default=str).encode('utf-8')
+        if self._count:
+            text = b',' + text
+        self._count += 1
+        self._writer.write(text)
+
+    def hold(self, ip):
+        with self._lock:
+            self._held.setdefault(ip, [None, 0])[1] += 1
+
+    def hold_all(self):
+        """Hold every address until finish() (a single-host, port-chunked scan)."""
+        self._all = True
+
+    def release(self, ip):
+        with self._lock:
+            entry = self._held.get(ip)
+            if entry is None:
+                return
+            entry[1] -= 1
+            if entry[1] <= 0:
+                del self._held[ip]
+                if entry[0] is not None:
+                    self._write(entry[0])
+
+    def add_host(self, h):
+        ip = host_ip(h)
+        with self._lock:
+            entry = self._held.get(ip) if ip else None
+            if entry is None and ip and self._all:
+                entry = self._held[ip] = [None, 1]
+            if entry is None:
+                self._write(h)
+            else:
+                entry[0] = h if entry[0] is None else merge_host(entry[0], h)
+
+    def finish(self, **meta):
+        """Close the document with ``meta`` keys; returns (blob ref, stored bytes)."""
+        tail = b']'
+        for key, value in meta.items():
+            tail += b', ' + json.dumps(key).encode() + b': ' + json.dumps(value, default=str).encode()
+        tail += b'}'
+        with self._lock:
+            for h, _ in self._held.values():
+                if h is not None:
+                    self._write(h)
+            self._held.clear()
+            self._writer.write(tail)
+            return self._writer.commit()
+
+    def discard(self):
+        """Drop a partial archive (the scan failed or was cancelled)."""
+        self._writer.discard()
+
+
+def _to_int(value, default=0):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def build_host(scan_id, h, host=None):
+    """Build a ScanHost (with its ports and scripts) from one xmltodict <host> dict.
+
+    When ``host`` is given the new ports and scripts are merged into it and
+    only attributes it is still missing are filled in.
+    """
+    host = host or ScanHost(scan_id=scan_id)
+
+    def fill(attr, value):
+        if value and not getattr(host, attr):
+            setattr(host, attr, value)
+
+    # addresses
+    for a in as_list(h.get('address')):
+        if a.get('@addrtype') in ('ipv4', 'ipv6'):
+            fill('ip', a.get('@addr'))
+        if a.get('@addrtype') == 'mac':
+            fill('mac', a.get('@addr'))
+
+    fill('status', (h.get('status') or {}).get('@state'))
+
+    # hostname
+    names = as_list((h.get('hostnames') or {}).get('hostname'))
+    if names:
+        fill('hostname', names[0].get('@name'))
+
+    # os
+    osmatch = as_list((h.get('os') or {}).get('osmatch'))
+    if osmatch:
+        fill('os_name',     osmatch[0].get('@name'))
+        fill('os_accuracy', osmatch[0].get('@accuracy'))
+
+    def add_script(s, port=None):
+        sid = s.get('@id')
+        out = s.get('@output', '')
+        host.scripts.append(ScanScript(
+            scan_id=scan_id, port=port, script_id=sid, output=out
+        ))
+        if sid == 'ssl-cert':
+            fill('ssl_cert', out.split('\n', 1)[0])
+        if sid == 'http-title':
+            fill('http_title', out.strip())
+
+    # ports + port scripts; a port already on the host (e.g. from the sweep
+    # stage of a two-stage scan) is updated with whatever the new report adds
+    known = {(p.protocol, p.port): p for p in host.ports} if host.id else {}
+    for p in as_list((h.get('ports') or {}).get('port')):
+        svc = p.get('service') or {}
+        fields = dict(
+            service=svc.get('@name'),
+            product=svc.get('@product'),
+            version=svc.get('@version'),
+            extrainfo=svc.get('@extrainfo'),
+        )
+        protocol = p.get('@protocol') or 'tcp'
+        number   = _to_int(p.get('@portid'))
+        state    = (p.get('state') or {}).get('@state') or 'unknown'
+        port = known.get((protocol, number))
+        if port is None:
+            port = ScanPort(scan_id=scan_id, protocol=protocol, port=number, state=state, **fields)
+            host.ports.append(port)
+        else:
+            port.state = state
+            for attr, value in fields.items():
+                if value:
+                    setattr(port, attr, value)
+        for s in as_list(p.get('script')):
+            add_script(s, port)
+
+    # host-level scripts
+    for s in as_list((h.get('hostscript') or {}).get('script')) + as_list(h.get('script')):
+        add_script(s)
+
+    return host
+
+
+def host_ip(h):
+    for a in as_list(h.get('address')):
+        if a.get('@addrtype') in ('ipv4', 'ipv6'):
+            return a.get('@addr')
+    return None
+
+
+def store_host(scan_id, h):
+    """Persist one host dict, merging into an existing row for the same IP.
+
+    Port-split scans report the same host once per chunk, so those land on a
+    single ScanHost. The caller commits.
+    """
+    ip = host_ip(h)
+    existing = None
+    if ip:
+        existing = ScanHost.query.filter_by(scan_id=scan_id, ip=ip).first()
+    host = build_host(scan_id, h, existing)
+    if existing is None:
+        db.session.add(host)
+    return host
+
+
+def store_hosts(scan, hosts):
+    """Add normalized rows for every host dict; the caller commits."""
+    for h in as_list(hosts):
+        store_host(scan.id, h)
+
+
+def ensure_normalized(scan):
+    """Backfill rows for scans recorded before the normalized tables existed."""
+    if scan.results_json is None or scan.hosts.first() is not None:
+        return
+    data = json.loads(scan.results_json)
+    data = data.get('nmaprun', data)
+    store_hosts(scan, data.get('host'))
+    scan.nmap_args = scan.nmap_args or data.get('@args')
+    db.session.flush()
+    build_summaries(scan)
+    db.session.commit()
+
+
+def port_signature(protocol, port, state, service, version):
+    """The fields change detection compares, as a hashable tuple."""
+    return (protocol or 'tcp', int(port), state or '', service or '', version or '')
+
+
+def host_fingerprint(signatures):
+    """Stable hash of a host's port signatures; equal hashes mean no port changed."""
+    text = "\n".join("|".join(map(str, sig)) for sig in sorted(signatures))
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def build_summaries(scan):
+    """Precompute each host's report summary, fingerprint and the scan's totals.
+
+    Completed scans never change, so the report page only ever reads these;
+    the caller commits.
+    """
+    open_ports = {}
+    signatures = {}
+    for p in (ScanPort.query
+              .filter_by(scan_id=scan.id)
+              .order_by(ScanPort.host_id, ScanPort.protocol, ScanPort.port)):
+        signatures.setdefault(p.host_id, []).append(
+            port_signature(p.protocol, p.port, p.state, p.service, p.version_string)
+        )
+        if p.state == 'open':
+            open_ports.setdefault(p.host_id, []).append(p)
+
+    port_scripts = {}
+    host_scripts = {}
+    for s in ScanScript.query.filter_by(scan_id=scan.id).order_by(ScanScript.id):
+        entry = {'id': s.script_id, 'output': s.output or ''}
+        if s.port_id:
+            port_scripts.setdefault(s.port_id, []).append(entry)
+        else:
+            host_scripts.setdefault(s.host_id, []).append(entry)
+
+    hosts = total_open = 0
+    for h in scan.hosts:
+        ports = open_ports.get(h.id, [])
+        h.open_port_count = len(ports)
+        h.fingerprint     = host_fingerprint(signatures.get(h.id, []))
+        h.summary_json = json.dumps({
+            'ip':           h.ip,
+            'mac':          h.mac,
+            'hostname':     h.hostname,
+            'os':           {'name': h.os_name, 'accuracy': h.os_accuracy},
+            'open_ports':   [{
+                'port':     str(p.port),
+                'protocol': p.protocol,
+                'service':  p.service,
+                'version':  p.version_string,
+                'scripts':  port_scripts.get(p.id, [])
+            } for p in ports],
+            'host_scripts': host_scripts.get(h.id, []),
+            'ssl':          h.ssl_cert,
+            'http_title':   h.http_title
+        })
+        hosts += 1
+        total_open += len(ports)
+    scan.host_count      = hosts
+    scan.open_port_count = total_open
+
+
+class SummaryCache:
+    """Size-bounded LRU of rendered report pages for completed scans."""
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()   # key -> (value, size)
+        self._bytes = 0
+        self._lock  = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return None
+            self._items.move_to_end(key)
+            return item[0]
+
+    def put(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old:
+                self._bytes -= old[1]
+            self._items[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self._bytes -= evicted
+
+    def drop(self, scan_id):
+        with self._lock:
+            for key in [k for k in self._items if k[0] == scan_id]:
+                self._bytes -= self._items.pop(key)[1]
+
+
+summary_cache = SummaryCache()
+
+
+def host_dicts(scan):
+    """Plain-dict view of the normalized rows, used when no raw archive was kept."""
+    hosts = []
+    for h in scan.hosts.order_by(ScanHost.id):
+        hosts.append({
+            'ip':       h.ip,
+            'mac':      h.mac,
+            'hostname': h.hostname,
+            'status':   h.status,
+            'os':       {'name': h.os_name, 'accuracy': h.os_accuracy},
+            'ports':    [{
+                'port':     p.port,
+                'protocol': p.protocol,
+                'state':    p.state,
+                'service':  p.service,
+                'version':  p.version_string
+            } for p in sorted(h.ports, key=lambda p: (p.protocol, p.port))],
+            'scripts':  [{'id': s.script_id, 'output': s.output} for s in h.scripts]
+        })
+    return {'args': scan.nmap_args, 'host': hosts}
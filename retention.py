@@ -0,0 +1,284 @@
+# retention.py
+#
+# Keeps the scan history bounded. Scans newer than RETENTION_FULL_DAYS keep
+# every row; older ones are rolled up and deleted:
+#
+#   * each expired scan is folded into a ScanRollup row per (target, day):
+#     scans run, hosts up / open ports at most and at the day's last scan,
+#     and the change-log totals (ports added / removed / changed, assets)
+#   * its hosts, ports, scripts, chunks, jobs and change logs are deleted in
+#     bulk statements, a batch at a time, each batch its own short
+#     transaction so scans and the UI can write in between
+#   * raw archives nobody references any more are deleted from the blob
+#     store or moved under RETENTION_ARCHIVE_PATH (RETENTION_BLOB_ACTION)
+#   * on SQLite the freed pages are handed back with incremental_vacuum in
+#     small steps; the database needs auto_vacuum=INCREMENTAL for that
+#     (`flask --app app scanner retention --enable-incremental-vacuum`)
+#
+# A scan that is still some asset's last_scan_id is kept: it is the latest
+# word on those addresses. Several processes may run this at once; a batch
+# is claimed with a conditional UPDATE of its status, so every scan is rolled
+# up exactly once.
+
+import time
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import func, text
+
+from extensions import db
+from models import (
+    ScanResult, ScanHost, ScanPort, ScanScript, ScanChunk, ScanJob,
+    Schedule, AssetHost, AssetPort, ChangeLog, ScanRollup
+)
+
+FINISHED = ('Completed', 'Failed', 'Cancelled')
+EXPIRING = 'Expiring'
+
+
+def _counts(model, column, ids, *criteria):
+    """{scan_id: rows} for the scans in ``ids``."""
+    return dict(
+        db.session.query(model.scan_id, func.count(column))
+        .filter(model.scan_id.in_(ids), *criteria)
+        .group_by(model.scan_id)
+    )
+
+
+def candidates(cutoff, limit, after_id=0):
+    """Up to ``limit`` finished scans started before ``cutoff``, oldest id first."""
+    pinned = db.session.query(AssetHost.last_scan_id).filter(AssetHost.last_scan_id.isnot(None))
+    return (
+        ScanResult.query
+        .filter(ScanResult.timestamp < cutoff,
+                ScanResult.status.in_(FINISHED),
+                ScanResult.id > after_id,
+                ScanResult.id.notin_(pinned))
+        .order_by(ScanResult.id)
+        .limit(limit)
+        .all()
+    )
+
+
+def roll_up(scans):
+    """Fold scans into their (target, day) ScanRollup rows and return those
+    keys; the caller commits."""
+    ids = [s.id for s in scans]
+    missing = [s.id for s in scans if s.host_count is None or s.open_port_count is None]
+    hosts_up = _counts(ScanHost, ScanHost.id, missing,
+                       ScanHost.ip.isnot(None),
+                       (ScanHost.status.is_(None)) | (ScanHost.status == 'up')) if missing else {}
+    open_ports = _counts(ScanPort, ScanPort.id, missing, ScanPort.state == 'open') if missing else {}
+
+    changed = {}
+    for log in ChangeLog.query.filter(ChangeLog.scan_id.in_(ids)):
+        summary = log.changes.get('summary') or {}
+        c = changed.setdefault(log.scan_id, dict(assets=0, added=0, removed=0, changed=0))
+        c['assets'] += len(log.changes.get('hosts') or {})
+        for key in ('added', 'removed', 'changed'):
+            c[key] += summary.get(key, 0)
+
+    rollups = {}
+    for s in sorted(scans, key=lambda s: (s.timestamp, s.id)):
+        key = (s.target, s.timestamp.date())
+        r = rollups.get(key)
+        if r is None:
+            r = ScanRollup.query.filter_by(target=key[0], day=key[1]).first()
+            if r is None:
+                r = ScanRollup(target=key[0], day=key[1], scans=0, completed=0,
+                               hosts_up_max=0, open_ports_max=0, changed_assets=0,
+                               ports_added=0, ports_removed=0, ports_changed=0)
+                db.session.add(r)
+            rollups[key] = r
+        up = s.host_count if s.host_count is not None else hosts_up.get(s.id, 0)
+        nopen = s.open_port_count if s.open_port_count is not None else open_ports.get(s.id, 0)
+        c = changed.get(s.id, {})
+
+        r.scans          += 1
+        r.hosts_up_max    = max(r.hosts_up_max, up)
+        r.open_ports_max  = max(r.open_ports_max, nopen)
+        r.changed_assets += c.get('assets', 0)
+        r.ports_added    += c.get('added', 0)
+        r.ports_removed  += c.get('removed', 0)
+        r.ports_changed  += c.get('changed', 0)
+        if s.status == 'Completed':
+            r.completed += 1
+            if r.last_scan_id is None or s.id > r.last_scan_id:
+                r.open_ports_last = nopen
+        r.first_scan_id = min(r.first_scan_id or s.id, s.id)
+        r.last_scan_id  = max(r.last_scan_id or s.id, s.id)
+    return set(rollups)
+
+
+def delete_scans(ids):
+    """Bulk-delete everything hanging off the scans, then the scans; the caller commits."""
+    def q(model, column):
+        return model.query.filter(column.in_(ids))
+
+    # 1) rows owned by the scans, children first
+    for model in (ScanScript, ScanPort, ScanHost, ScanChunk, ScanJob, ChangeLog):
+        q(model, model.scan_id).delete(synchronize_session=False)
+    # 2) references from rows that stay
+    q(ChangeLog, ChangeLog.previous_scan_id).update(
+        {'previous_scan_id': None}, synchronize_session=False)
+    q(Schedule, Schedule.last_scan_id).update({'last_scan_id': None}, synchronize_session=False)
+    q(AssetPort, AssetPort.last_scan_id).update({'last_scan_id': None}, synchronize_session=False)
+    # 3) the scans themselves
+    return q(ScanResult, ScanResult.id).delete(synchronize_session=False)
+
+
+def release_blobs(refs, action, archive_root=None):
+    """Delete or archive blobs that no remaining scan references."""
+    from blobstore import get_store
+
+    if action == 'keep' or not refs:
+        return 0
+    still_used = {
+        ref for (ref,) in
+        db.session.query(ScanResult.raw_ref).filter(ScanResult.raw_ref.in_(list(refs))).distinct()
+    }
+    store = get_store()
+    released = 0
+    for ref in set(refs) - still_used:
+        if action == 'archive':
+            released += store.archive(ref, archive_root)
+        else:
+            released += store.delete(ref)
+    return released
+
+
+def expire_batch(scans, blob_action, archive_root=None):
+    """Roll up and delete one batch in one transaction; returns (scans deleted,
+    rollup keys, blobs released)."""
+    ids = [s.id for s in scans]
+    # claim the batch: a concurrent run blocks on these rows and then finds
+    # the status changed, so it skips them instead of counting them twice
+    (
+        ScanResult.query
+        .filter(ScanResult.id.in_(ids), ScanResult.status.in_(FINISHED))
+        .update({'status': EXPIRING}, synchronize_session=False)
+    )
+    claimed = {
+        scan_id for (scan_id,) in
+        db.session.query(ScanResult.id).filter(ScanResult.id.in_(ids),
+                                               ScanResult.status == EXPIRING)
+    }
+    scans = [s for s in scans if s.id in claimed]
+    if not scans:
+        db.session.rollback()
+        return 0, set(), 0
+    ids = [s.id for s in scans]
+    refs = {s.raw_ref for s in scans if s.raw_ref}
+
+    rollups = roll_up(scans)
+    deleted = delete_scans(ids)
+    db.session.commit()
+
+    from results import summary_cache
+    for scan_id in ids:
+        summary_cache.drop(scan_id)
+    return deleted, rollups, release_blobs(refs, blob_action, archive_root)
+
+
+def prune_rollups(now, days):
+    if not days:
+        return 0
+    removed = (
+        ScanRollup.query
+        .filter(ScanRollup.day < (now - timedelta(days=days)).date())
+        .delete(synchronize_session=False)
+    )
+    db.session.commit()
+    return removed
+
+
+def is_sqlite():
+    return db.engine.dialect.name == 'sqlite'
+
+
+def incremental_vacuum(pages, deadline, pause=0):
+    """Free up to ``pages`` SQLite pages per step until the freelist is empty
+    or the deadline passes. Returns pages freed, or None when the database is
+    not in auto_vacuum=INCREMENTAL mode (a plain VACUUM would lock it)."""
+    if not is_sqlite():
+        return None
+    if db.session.execute(text('PRAGMA auto_vacuum')).scalar() != 2:
+        return None
+    freed = 0
+    while time.monotonic() < deadline:
+        free = db.session.execute(text('PRAGMA freelist_count')).scalar()
+        if not free:
+            break
+        db.session.execute(text(f'PRAGMA incremental_vacuum({int(pages)})'))
+        db.session.commit()
+        freed += min(free, pages)
+        if pause:
+            time.sleep(pause)
+    return freed
+
+
+def enable_incremental_vacuum():
+    """Switch a SQLite database to auto_vacuum=INCREMENTAL. This rewrites the
+    file with a full VACUUM once, so run it while nothing is scanning."""
+    if not is_sqlite():
+        return False
+    db.session.commit()
+    with db.engine.connect() as conn:
+        conn = conn.execution_options(isolation_level='AUTOCOMMIT')
+        conn.execute(text('PRAGMA auto_vacuum = INCREMENTAL'))
+        conn.execute(text('VACUUM'))
+        return conn.execute(text('PRAGMA auto_vacuum')).scalar() == 2
+
+
+def run_retention(now=None, max_seconds=None, dry_run=False):
+    """Expire, roll up and vacuum per the RETENTION_* settings; returns stats."""
+    cfg      = current_app.config
+    days     = cfg.get('RETENTION_FULL_DAYS')
+    batch    = cfg.get('RETENTION_BATCH', 200)
+    pause    = cfg.get('RETENTION_PAUSE_SECONDS', 0)
+    action   = cfg.get('RETENTION_BLOB_ACTION', 'delete')
+    archive  = cfg.get('RETENTION_ARCHIVE_PATH')
+    now      = now or datetime.utcnow()
+    deadline = time.monotonic() + (max_seconds or cfg.get('RETENTION_MAX_SECONDS') or 1e9)
+    stats    = dict(scans=0, rollups=0, blobs=0, rollups_pruned=0, vacuumed_pages=None,
+                    finished=True)
+
+    if not days:
+        return stats
+    if action == 'archive' and not archive:
+        raise ValueError("RETENTION_BLOB_ACTION='archive' needs RETENTION_ARCHIVE_PATH")
+    cutoff = now - timedelta(days=days)
+
+    # 1) expire old scans a batch at a time, within the time budget
+    last_id = 0
+    touched = set()   # (target, day) rollups written
+    while True:
+        if time.monotonic() >= deadline:
+            stats['finished'] = False
+            break
+        scans = candidates(cutoff, batch, last_id)
+        if not scans:
+            break
+        last_id = scans[-1].id
+        if dry_run:
+            stats['scans'] += len(scans)
+            db.session.expunge_all()
+            continue
+        deleted, keys, blobs = expire_batch(scans, action, archive)
+        touched |= keys
+        stats['scans']   += deleted
+        stats['rollups']  = len(touched)
+        stats['blobs']   += blobs
+        db.session.expunge_all()
+        if pause:
+            time.sleep(pause)
+
+    if dry_run:
+        return stats
+
+    # 2) old summaries, then 3) hand the freed pages back to the filesystem
+    stats['rollups_pruned'] = prune_rollups(now, cfg.get('RETENTION_ROLLUP_DAYS'))
+    stats['vacuumed_pages'] = incremental_vacuum(
+        cfg.get('RETENTION_VACUUM_PAGES', 1000), deadline, pause
+    )
+    return stats
@@ -0,0 +1,177 @@
+# routes/assets.py
+#
+# Query API over the asset inventory (AssetHost / AssetPort), which every
+# completed scan updates in changes.update_assets. Lookups by port, service
+# and CIDR run off the (port|service, state, ip_key) indexes, and pages are
+# keyset-ordered by address so they stay fast however deep you go.
+
+import re
+import base64
+from datetime import datetime, timedelta
+
+from flask import Blueprint, request, current_app, jsonify, abort
+from flask_login import login_required
+from sqlalchemy import or_, and_
+
+from extensions import db
+from models import AssetHost, AssetPort, network_bounds
+
+assets_bp = Blueprint('assets', __name__, url_prefix='/assets')
+
+RELATIVE = {'m': 'minutes', 'h': 'hours', 'd': 'days', 'w': 'weeks'}
+
+
+def parse_time(value):
+    """ISO timestamp or a relative age such as '90m', '24h', '7d'; None if invalid."""
+    value = (value or '').strip()
+    if not value:
+        return None
+    match = re.fullmatch(r'(\d+)([mhdw])', value)
+    if match:
+        return datetime.utcnow() - timedelta(**{RELATIVE[match.group(2)]: int(match.group(1))})
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        return None
+
+
+def encode_cursor(ip_key, row_id):
+    return base64.urlsafe_b64encode(f"{ip_key}|{row_id}".encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        ip_key, _, row_id = raw.partition('|')
+        return ip_key, int(row_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def page_size(args):
+    cfg = current_app.config
+    try:
+        limit = int(args.get('limit', cfg.get('ASSETS_PAGE_SIZE', 100)))
+    except ValueError:
+        limit = cfg.get('ASSETS_PAGE_SIZE', 100)
+    return max(1, min(limit, cfg.get('ASSETS_MAX_PAGE_SIZE', 1000)))
+
+
+def keyset_page(query, model, args):
+    """One page ordered by (ip_key, id), plus the cursor for the next one."""
+    limit = page_size(args)
+    position = decode_cursor(args.get('cursor', '')) if args.get('cursor') else None
+    if position:
+        ip_key, row_id = position
+        query = query.filter(or_(
+            model.ip_key > ip_key,
+            and_(model.ip_key == ip_key, model.id > row_id)
+        ))
+    rows = query.order_by(model.ip_key, model.id).limit(limit + 1).all()
+    last = rows[limit - 1] if len(rows) > limit else None
+    return rows[:limit], (encode_cursor(last.ip_key, last.id) if last else None)
+
+
+def window_filters(query, model, args):
+    """Shared CIDR and time-window filters for host and port queries."""
+    cidr = args.get('cidr', '').strip()
+    if cidr:
+        lo, hi = network_bounds(cidr)
+        if lo is None:
+            abort(400, description="cidr must be an IP address or network")
+        query = query.filter(model.ip_key >= lo, model.ip_key <= hi)
+
+    def when(arg):
+        value = parse_time(args[arg])
+        if value is None:
+            abort(400, description=f"{arg} must be an ISO time or an age like 24h / 7d")
+        return value
+
+    if args.get('seen_since'):
+        query = query.filter(model.last_seen >= when('seen_since'))
+    if args.get('seen_before'):
+        query = query.filter(model.last_seen < when('seen_before'))
+    if args.get('first_since'):
+        query = query.filter(model.first_seen >= when('first_since'))
+    return query
+
+
+def port_json(p, ip=None):
+    return {
+        'ip':           ip,
+        'protocol':     p.protocol,
+        'port':         p.port,
+        'state':        p.state,
+        'service':      p.service,
+        'version':      p.version,
+        'first_seen':   p.first_seen.isoformat() if p.first_seen else None,
+        'last_seen':    p.last_seen.isoformat() if p.last_seen else None,
+        'last_scan_id': p.last_scan_id,
+    }
+
+
+def host_json(h):
+    return {
+        'ip':           h.ip,
+        'hostname':     h.hostname,
+        'status':       h.status,
+        'first_seen':   h.first_seen.isoformat() if h.first_seen else None,
+        'last_seen':    h.last_seen.isoformat() if h.last_seen else None,
+        'last_scan_id': h.last_scan_id,
+    }
+
+
+@assets_bp.route('/api/ports', methods=['GET'])
+@login_required
+def asset_ports():
+    """Exposed ports, e.g. ``?port=3389``, ``?service=http&cidr=10.0.0.0/8&seen_since=7d``.
+
+    ``state`` defaults to open; pass ``state=any`` for closed/filtered too.
+    """
+    args  = request.args
+    query = AssetPort.query
+    if args.get('port'):
+        try:
+            query = query.filter(AssetPort.port == int(args['port']))
+        except ValueError:
+            abort(400, description="port must be a number")
+    if args.get('protocol'):
+        query = query.filter(AssetPort.protocol == args['protocol'])
+    if args.get('service'):
+        query = query.filter(AssetPort.service == args['service'])
+    state = args.get('state', 'open')
+    if state != 'any':
+        query = query.filter(AssetPort.state == state)
+    query = window_filters(query, AssetPort, args)
+
+    rows, next_cursor = keyset_page(query, AssetPort, args)
+    ips = dict(
+        db.session.query(AssetHost.id, AssetHost.ip)
+        .filter(AssetHost.id.in_({p.host_id for p in rows}))
+    ) if rows else {}
+    return jsonify(
+        items=[port_json(p, ips.get(p.host_id)) for p in rows],
+        next_cursor=next_cursor
+    )
+
+
+@assets_bp.route('/api/hosts', methods=['GET'])
+@login_required
+def asset_hosts():
+    """Known hosts, filtered by ``cidr``, ``status`` and the seen-time window."""
+    args  = request.args
+    query = AssetHost.query
+    if args.get('status'):
+        query = query.filter(AssetHost.status == args['status'])
+    query = window_filters(query, AssetHost, args)
+    rows, next_cursor = keyset_page(query, AssetHost, args)
+    return jsonify(items=[host_json(h) for h in rows], next_cursor=next_cursor)
+
+
+@assets_bp.route('/api/hosts/<ip>', methods=['GET'])
+@login_required
+def asset_host(ip):
+    """One host with every port it has ever exposed."""
+    host = AssetHost.query.filter_by(ip=ip).first_or_404()
+    ports = sorted(host.ports, key=lambda p: (p.protocol, p.port))
+    return jsonify(dict(host_json(host), ports=[port_json(p, host.ip) for p in ports]))
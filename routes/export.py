@@ -1,82 +1,209 @@
-import io, csv, json
-from flask import Blueprint, abort
+import io, csv, json, zlib
+from flask import Blueprint, abort, request, Response, stream_with_context, current_app
 from flask_login import login_required
-from models import ScanResult
+from sqlalchemy import and_
+from extensions import db
+from models import ScanResult, ScanHost, ScanPort
+from results import ensure_normalized
+from blobstore import get_store
 
 export_bp = Blueprint('export', __name__, url_prefix='/export')
 
+# name -> (CSV header, value from a (ScanHost, ScanPort) row)
+COLUMNS = {
+    'ip':        ('IP',        lambda h, p: h.ip),
+    'hostname':  ('Hostname',  lambda h, p: h.hostname),
+    'port':      ('Port',      lambda h, p: p.port),
+    'protocol':  ('Protocol',  lambda h, p: p.protocol),
+    'state':     ('State',     lambda h, p: p.state),
+    'service':   ('Service',   lambda h, p: p.service),
+    'version':   ('Version',   lambda h, p: p.version_string),
+    'product':   ('Product',   lambda h, p: p.product),
+    'extrainfo': ('Extra',     lambda h, p: p.extrainfo),
+}
+DEFAULT_COLUMNS = ['ip', 'port', 'protocol', 'state', 'service', 'version']
+
+FORMATS = {
+    'json':   ('application/json',            'json'),
+    'csv':    ('text/csv',                    'csv'),
+    'ndjson': ('application/x-ndjson',        'ndjson'),
+    'txt':    ('text/plain; charset=utf-8',   'txt'),
+    'text':   ('text/plain; charset=utf-8',   'txt'),
+}
+
+
+def port_rows(scan, states, all_hosts=False):
+    """(ScanHost, ScanPort) pairs in host/port order, fetched in batches.
+
+    With ``all_hosts`` a host without (matching) ports comes back once, as
+    (host, None), instead of being left out.
+    """
+    if all_hosts:
+        on = (ScanPort.host_id == ScanHost.id)
+        if states:
+            on = and_(on, ScanPort.state.in_(states))
+        query = (
+            db.session.query(ScanHost, ScanPort)
+            .outerjoin(ScanPort, on)
+            .filter(ScanHost.scan_id == scan.id)
+        )
+    else:
+        query = (
+            db.session.query(ScanHost, ScanPort)
+            .join(ScanPort, ScanPort.host_id == ScanHost.id)
+            .filter(ScanPort.scan_id == scan.id)
+        )
+        if states:
+            query = query.filter(ScanPort.state.in_(states))
+    query = query.order_by(ScanHost.id, ScanPort.protocol, ScanPort.port)
+    return query.yield_per(current_app.config.get('EXPORT_BATCH_ROWS', 1000))
+
+
+def csv_stream(scan, states, columns):
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+
+    def take():
+        data = buf.getvalue()
+        buf.seek(0)
+        buf.truncate(0)
+        return data
+
+    writer.writerow([COLUMNS[c][0] for c in columns])
+    yield take()
+    for i, (h, p) in enumerate(port_rows(scan, states), 1):
+        row = [COLUMNS[c][1](h, p) for c in columns]
+        if 'ip' in columns and not h.ip:
+            row[columns.index('ip')] = scan.target
+        writer.writerow(row)
+        if i % 500 == 0:
+            yield take()
+    yield take()
+
+
+def ndjson_stream(scan, states, columns):
+    lines = []
+    for h, p in port_rows(scan, states):
+        record = {c: COLUMNS[c][1](h, p) for c in columns}
+        if 'ip' in record and not record['ip']:
+            record['ip'] = scan.target
+        record['scan_id'] = scan.id
+        lines.append(json.dumps(record))
+        if len(lines) >= 500:
+            yield "\n".join(lines) + "\n"
+            lines = []
+    if lines:
+        yield "\n".join(lines) + "\n"
+
+
+def host_records(scan, states):
+    """One dict per host, built from consecutive rows of port_rows; hosts
+    without ports get an empty list, as in results.host_dicts."""
+    current, record = None, None
+    for h, p in port_rows(scan, states, all_hosts=True):
+        if h.id != current:
+            if record:
+                yield record
+            current = h.id
+            record = {
+                'ip': h.ip, 'mac': h.mac, 'hostname': h.hostname, 'status': h.status,
+                'os': {'name': h.os_name, 'accuracy': h.os_accuracy},
+                'ports': []
+            }
+        if p is None:
+            continue
+        record['ports'].append({
+            'port': p.port, 'protocol': p.protocol, 'state': p.state,
+            'service': p.service, 'version': p.version_string
+        })
+    if record:
+        yield record
+
+
+def json_stream(scan, states):
+    """The raw archive, decompressed piecewise; rows when no archive was kept."""
+    if scan.raw_ref and not states:
+        yield from get_store().iter_chunks(scan.raw_ref)
+        return
+    if scan.results_raw and not states:
+        z = zlib.decompressobj()
+        raw = scan.results_raw
+        for i in range(0, len(raw), 64 * 1024):
+            chunk = z.decompress(raw[i:i + 64 * 1024])
+            if chunk:
+                yield chunk
+        yield z.flush()
+        return
+    if scan.results_json and not states:
+        yield scan.results_json
+        return
+    yield '{"args": ' + json.dumps(scan.nmap_args) + ', "host": ['
+    for i, record in enumerate(host_records(scan, states)):
+        yield (',' if i else '') + json.dumps(record)
+    yield ']}'
+
+
+def text_stream(scan, states):
+    for record in host_records(scan, states):
+        yield json.dumps(record, indent=2) + "\n"
+
+
+def gzip_stream(chunks):
+    z = zlib.compressobj(6, zlib.DEFLATED, 31)   # wbits 31 = gzip container
+    for chunk in chunks:
+        if isinstance(chunk, str):
+            chunk = chunk.encode('utf-8')
+        out = z.compress(chunk)
+        if out:
+            yield out
+    yield z.flush()
+
+
 @export_bp.route('/<int:scan_id>/<fmt>')
 @login_required
 def export_result(scan_id, fmt):
+    """Stream a scan as json / csv / ndjson / txt.
+
+    Query options: ``state=open,filtered`` (csv/ndjson default to open, json
+    and txt to every state), ``columns=ip,port,...`` for csv/ndjson, and
+    ``gzip=1`` to download a .gz file.
+    """
     scan = ScanResult.query.get_or_404(scan_id)
-    if scan.status != "Completed" or not scan.results_json:
+    if scan.status != "Completed":
+        abort(404)
+    fmt = fmt.lower()
+    if fmt not in FORMATS:
         abort(404)
 
-    data = json.loads(scan.results_json)
-    fmt  = fmt.lower()
+    ensure_normalized(scan)
 
-    if fmt == 'json':
-        return (
-            scan.results_json, 200,
-            {
-                "Content-Type": "application/json",
-                "Content-Disposition": f"attachment; filename=scan_{scan_id}.json"
-            }
-        )
+    states = [s for s in request.args.get('state', '').split(',') if s]
+    if not states and fmt in ('csv', 'ndjson'):
+        states = ['open']
+    columns = [c for c in request.args.get('columns', '').split(',') if c in COLUMNS]
+    columns = columns or DEFAULT_COLUMNS
 
     if fmt == 'csv':
-        output = io.StringIO()
-        writer = csv.writer(output)
-        writer.writerow(["IP","Port","Protocol","State","Service","Version"])
-        hosts = data.get('host') or []
-        if not isinstance(hosts, list):
-            hosts = [hosts]
-
-        for h in hosts:
-            ip = scan.target
-            addrs = h.get('address')
-            if isinstance(addrs, list):
-                for a in addrs:
-                    if a.get('@addrtype') in ('ipv4','ipv6'):
-                        ip = a.get('@addr')
-            elif isinstance(addrs, dict):
-                if addrs.get('@addrtype') in ('ipv4','ipv6'):
-                    ip = addrs.get('@addr')
-
-            ports_list = h.get('ports',{}).get('port') or []
-            if isinstance(ports_list, dict):
-                ports_list = [ports_list]
-
-            for p in ports_list:
-                if p.get('state',{}).get('@state')=='open':
-                    svc = p.get('service',{})
-                    version = " ".join(filter(None,[svc.get('@product'), svc.get('@version')]))
-                    writer.writerow([
-                        ip,
-                        p.get('@portid'),
-                        p.get('@protocol'),
-                        'open',
-                        svc.get('@name'),
-                        version
-                    ])
-        csv_data = output.getvalue()
-        output.close()
-        return (
-            csv_data, 200,
-            {
-                "Content-Type": "text/csv",
-                "Content-Disposition": f"attachment; filename=scan_{scan_id}.csv"
-            }
-        )
+        body = csv_stream(scan, states, columns)
+    elif fmt == 'ndjson':
+        body = ndjson_stream(scan, states, columns)
+    elif fmt == 'json':
+        body = json_stream(scan, states)
+    else:
+        body = text_stream(scan, states)
 
-    if fmt in ('txt','text'):
-        txt = json.dumps(data, indent=2)
-        return (
-            txt, 200,
-            {
-                "Content-Type": "text/plain; charset=utf-8",
-                "Content-Disposition": f"attachment; filename=scan_{scan_id}.txt"
-            }
-        )
+    content_type, ext = FORMATS[fmt]
+    filename = f"scan_{scan_id}.{ext}"
+    if request.args.get('gzip') in ('1', 'true', 'yes'):
+        body = gzip_stream(body)
+        content_type = 'application/gzip'
+        filename += '.gz'
 
-    abort(404)
\ No newline at end of file
+    return Response(
+        stream_with_context(body),
+        200,
+        {
+            "Content-Type": content_type,
+            "Content-Disposition": f"attachment; filename={filename}"
+        }
+    )
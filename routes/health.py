@@ -1,7 +1,28 @@
-from flask import Blueprint
+from flask import Blueprint, jsonify
+from flask_login import login_required
+
+from governor import governor
+from ratelimit import limiter
+from jobqueue import queue_depth
+from models import ScanJob
 
 health_bp = Blueprint('health', __name__, url_prefix='/health')
 
 @health_bp.route('', methods=['GET'])
 def health_check():
-    return "OK", 200
\ No newline at end of file
+    return "OK", 200
+
+@health_bp.route('/scanner', methods=['GET'])
+@login_required
+def scanner_status():
+    """Queue depth, nmap slot usage for this process (and node, if shared)
+    and the per-subnet rate budgets."""
+    return jsonify(
+        queue={
+            'queued': queue_depth(),
+            'leased': ScanJob.query.filter_by(status='leased').count(),
+        },
+        slots=governor.status(),
+        node_slots=governor.node_slots(),
+        rate_limits=limiter.status()
+    )
@@ -1,38 +1,73 @@
 # routes/history.py
 
-import json
 import re
+import base64
 from datetime import datetime, timedelta
 
 from flask import (
     Blueprint, request, render_template,
-    redirect, url_for, current_app
+    redirect, url_for, current_app, jsonify
 )
+from sqlalchemy import or_, and_
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import load_only
 
-from extensions import db, socketio
-from models import ScanResult
+from extensions import db
+from models import ScanResult, ScanRollup, network_bounds
+from jobqueue import request_scan
 
 history_bp = Blueprint('history', __name__, url_prefix='/history')
 
 
-@history_bp.route('', methods=['GET'])
-def history():
-    query = ScanResult.query.order_by(ScanResult.timestamp.desc())
+# columns the history list needs; the result blobs are never loaded here
+LIST_COLUMNS = (
+    ScanResult.id, ScanResult.target, ScanResult.mode, ScanResult.flags,
+    ScanResult.status, ScanResult.timestamp
+)
+
+
+def encode_cursor(scan):
+    raw = f"{scan.timestamp.isoformat()}|{scan.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        ts, _, scan_id = raw.partition('|')
+        return datetime.fromisoformat(ts), int(scan_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def filtered_query(args):
+    """Build the filtered, newest-first history query plus the filters used."""
+    query = ScanResult.query.options(load_only(*LIST_COLUMNS))
 
     # 1) Strictly sanitize the 'target' filter:
-    tflt = request.args.get('target', '').strip()
-    if tflt and not re.fullmatch(r'[\w\.\-\/]+', tflt):
+    tflt = args.get('target', '').strip()
+    if tflt and not re.fullmatch(r'[\w\.\-\/:]+', tflt):
         # contains illegal chars → drop filter entirely
         tflt = ''
     if tflt:
-        query = query.filter(ScanResult.target.ilike(f"%{tflt}%"))
-
-    mflt = request.args.get('mode', '')
+        lo, hi = network_bounds(tflt)
+        if lo is not None:
+            # an IP or CIDR: every scan whose target range overlaps it
+            query = query.filter(ScanResult.target_lo <= hi, ScanResult.target_hi >= lo)
+        else:
+            # anything else is a prefix; a range comparison keeps it indexable
+            query = query.filter(ScanResult.target >= tflt,
+                                 ScanResult.target < tflt + '\uffff')
+
+    mflt = args.get('mode', '')
     if mflt:
         query = query.filter(ScanResult.mode == mflt)
 
-    start = request.args.get('start_date', '')
+    sflt = args.get('status', '')
+    if sflt:
+        query = query.filter(ScanResult.status == sflt)
+
+    start = args.get('start_date', '')
     if start:
         try:
             dt = datetime.fromisoformat(start)
@@ -40,7 +75,7 @@ def history():
         except ValueError:
             pass
 
-    end = request.args.get('end_date', '')
+    end = args.get('end_date', '')
     if end:
         try:
             dt_end = datetime.fromisoformat(end) + timedelta(days=1)
@@ -48,49 +83,128 @@ def history():
         except ValueError:
             pass
 
-    scans = query.all()
+    filters = {'target': tflt, 'mode': mflt, 'status': sflt,
+               'start_date': start, 'end_date': end}
+    return query, filters
+
+
+def page(query, cursor, limit):
+    """Keyset page: rows strictly older than the cursor, plus the next cursor."""
+    position = decode_cursor(cursor) if cursor else None
+    if position:
+        ts, scan_id = position
+        query = query.filter(or_(
+            ScanResult.timestamp < ts,
+            and_(ScanResult.timestamp == ts, ScanResult.id < scan_id)
+        ))
+    rows = (
+        query.order_by(ScanResult.timestamp.desc(), ScanResult.id.desc())
+        .limit(limit + 1)
+        .all()
+    )
+    next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+def parse_day(text):
+    try:
+        return datetime.fromisoformat(text).date() if text else None
+    except ValueError:
+        return None
+
+
+def page_size(args, default):
+    try:
+        limit = int(args.get('limit', default))
+    except ValueError:
+        limit = default
+    return max(1, min(limit, current_app.config.get('HISTORY_MAX_PAGE_SIZE', 500)))
+
+
+@history_bp.route('', methods=['GET'])
+def history():
+    query, filters = filtered_query(request.args)
+    limit = page_size(request.args, current_app.config.get('HISTORY_PAGE_SIZE', 50))
+    scans, next_cursor = page(query, request.args.get('cursor', ''), limit)
     return render_template(
         'history.html',
         scans=scans,
-        target_q=tflt,
-        mode_q=mflt,
-        start_q=start,
-        end_q=end
+        next_cursor=next_cursor,
+        filters={k: v for k, v in filters.items() if v},
+        target_q=filters['target'],
+        mode_q=filters['mode'],
+        start_q=filters['start_date'],
+        end_q=filters['end_date']
+    )
+
+
+@history_bp.route('/api', methods=['GET'])
+def history_api():
+    """JSON history page; pass back ``next_cursor`` as ``cursor`` for the next one."""
+    query, filters = filtered_query(request.args)
+    limit = page_size(request.args, current_app.config.get('HISTORY_PAGE_SIZE', 50))
+    scans, next_cursor = page(query, request.args.get('cursor', ''), limit)
+    return jsonify(
+        items=[{
+            'id':        s.id,
+            'target':    s.target,
+            'mode':      s.mode,
+            'flags':     s.flags,
+            'status':    s.status,
+            'timestamp': s.timestamp.isoformat(),
+        } for s in scans],
+        next_cursor=next_cursor,
+        filters=filters
     )
 
 
+@history_bp.route('/api/rollups', methods=['GET'])
+def rollups_api():
+    """Daily summaries of scans the retention job has expired, newest day first."""
+    query = ScanRollup.query
+    target = request.args.get('target', '').strip()
+    if target:
+        query = query.filter(ScanRollup.target == target)
+    start, end = parse_day(request.args.get('start_date')), parse_day(request.args.get('end_date'))
+    if start:
+        query = query.filter(ScanRollup.day >= start)
+    if end:
+        query = query.filter(ScanRollup.day <= end)
+    limit = page_size(request.args, current_app.config.get('HISTORY_PAGE_SIZE', 50))
+    rows = query.order_by(ScanRollup.day.desc(), ScanRollup.target).limit(limit).all()
+    return jsonify(items=[{
+        'target':          r.target,
+        'day':             r.day.isoformat(),
+        'scans':           r.scans,
+        'completed':       r.completed,
+        'hosts_up_max':    r.hosts_up_max,
+        'open_ports_max':  r.open_ports_max,
+        'open_ports_last': r.open_ports_last,
+        'changed_assets':  r.changed_assets,
+        'ports_added':     r.ports_added,
+        'ports_removed':   r.ports_removed,
+        'ports_changed':   r.ports_changed,
+        'first_scan_id':   r.first_scan_id,
+        'last_scan_id':    r.last_scan_id,
+    } for r in rows])
+
+
 @history_bp.route('/rescan/<int:scan_id>', methods=['POST'])
 def rescan(scan_id):
     """Kick off a new scan using the same parameters as an existing one."""
     old = ScanResult.query.get_or_404(scan_id)
 
-    new = ScanResult(
-        target=old.target,
-        ports=old.ports,
-        flags=old.flags,
-        mode=old.mode,
-        status="Running"
-    )
+    # Queue it like /scan; an identical scan already in flight is shared
     try:
-        db.session.add(new)
-        db.session.commit()
+        new, _ = request_scan(
+            old.target, old.ports, old.flags, old.mode,
+            current_app.config.get('DEFAULT_THREADS', 100),
+            discovery=old.host_discovery, engine=old.engine
+        )
     except SQLAlchemyError:
         db.session.rollback()
         return redirect(url_for('history.history'))
 
-    # Start background task exactly like /scan
-    from scanner import run_scan
-    socketio.start_background_task(
-        run_scan,
-        current_app._get_current_object(),
-        new.id,
-        new.target,
-        new.ports,
-        new.flags,
-        new.mode,
-        current_app.config.get('DEFAULT_THREADS', 100)
-    )
-
     # Redirect to the new report page, carrying the old scan as base
     return redirect(
         url_for('view.view_scan', scan_id=new.id, base=old.id)
@@ -0,0 +1,117 @@
+# routes/profiles.py
+#
+# CRUD for named scan profiles (models.ScanProfile) and a dry-run of the cost
+# model: GET /profiles/<name>/estimate?target=... reports what a scan with
+# that profile would cost and whether the capacity budget would take it.
+# Validation lives in profiles.py; a profile that doesn't pass never gets saved.
+
+import ipaddress
+
+from flask import Blueprint, request, jsonify
+from flask_login import login_required
+from sqlalchemy.exc import IntegrityError, SQLAlchemyError
+
+from extensions import db
+from models import ScanProfile
+from jobqueue import PRIORITY_INTERACTIVE
+from profiles import (
+    ProfileError, OverBudget, apply_profile_fields, profile_dict, compile_profile,
+    get_profile, estimate, admit
+)
+
+profiles_bp = Blueprint('profiles', __name__, url_prefix='/profiles')
+
+
+@profiles_bp.route('', methods=['GET'])
+@login_required
+def list_profiles():
+    rows = ScanProfile.query.order_by(ScanProfile.name).all()
+    return jsonify([profile_dict(p) for p in rows])
+
+
+@profiles_bp.route('', methods=['POST'])
+@login_required
+def create_profile():
+    data = request.get_json() or {}
+    profile = ScanProfile()
+    try:
+        apply_profile_fields(profile, data)
+        if get_profile(profile.name) is not None:
+            return jsonify(error=f"Profile {profile.name} already exists"), 409
+        db.session.add(profile)
+        db.session.commit()
+    except ProfileError as e:
+        db.session.rollback()
+        return jsonify(error=str(e)), 400
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify(error=f"Profile {profile.name} already exists"), 409
+    return jsonify(profile_dict(profile)), 201
+
+
+@profiles_bp.route('/<name>', methods=['GET'])
+@login_required
+def get_one(name):
+    profile = get_profile(name)
+    if profile is None:
+        return jsonify(error='Not found'), 404
+    return jsonify(profile_dict(profile))
+
+
+@profiles_bp.route('/<name>', methods=['PUT'])
+@login_required
+def update_profile(name):
+    profile = get_profile(name)
+    if profile is None:
+        return jsonify(error='Not found'), 404
+    try:
+        apply_profile_fields(profile, request.get_json() or {})
+        db.session.commit()
+    except ProfileError as e:
+        db.session.rollback()
+        return jsonify(error=str(e)), 400
+    except IntegrityError:
+        db.session.rollback()
+        return jsonify(error="A profile with that name already exists"), 409
+    return jsonify(profile_dict(profile))
+
+
+@profiles_bp.route('/<name>', methods=['DELETE'])
+@login_required
+def delete_profile(name):
+    profile = get_profile(name)
+    if profile is None:
+        return jsonify(error='Not found'), 404
+    try:
+        db.session.delete(profile)
+        db.session.commit()
+    except SQLAlchemyError:
+        db.session.rollback()
+        return jsonify(error="Database error"), 500
+    return jsonify(success=True)
+
+
+@profiles_bp.route('/<name>/estimate', methods=['GET'])
+@login_required
+def estimate_profile(name):
+    profile = get_profile(name)
+    if profile is None:
+        return jsonify(error='Not found'), 404
+    target = (request.args.get('target') or '').strip()
+    try:
+        for part in target.split() or ['']:
+            ipaddress.ip_network(part, strict=False)
+    except ValueError:
+        return jsonify(error="target: an address or network is required"), 400
+
+    argv = compile_profile(profile)
+    est = estimate(target, profile.ports, argv, profile.engine, profile.mode,
+                   profile.concurrency, profile.discovery)
+    try:
+        priority = admit(est, PRIORITY_INTERACTIVE)
+        admitted, reason = True, None
+        queued_behind = priority != PRIORITY_INTERACTIVE
+    except OverBudget as e:
+        admitted, reason, queued_behind = False, str(e), False
+    return jsonify(profile=profile.name, target=target, estimate=est,
+                   admitted=admitted, queued_behind=queued_behind, reason=reason)
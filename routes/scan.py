@@ -1,12 +1,16 @@
-import re
+import shlex
 import ipaddress
 
 from flask import Blueprint, request, jsonify, current_app
 from sqlalchemy.exc import SQLAlchemyError
 
-from extensions import db, socketio
-from models import ScanResult
-from scanner import run_scan
+from extensions import db
+from jobqueue import request_scan, PRIORITY_INTERACTIVE
+from portspec import PortSpec, PortSpecError
+from scanner import ENGINES
+from profiles import (
+    get_profile, compile_profile, validate_flags, ProfileError, OverBudget
+)
 
 scan_bp = Blueprint('scan', __name__, url_prefix='/scan')
 
@@ -15,10 +19,15 @@ def start_scan():
     data    = request.get_json() or {}
     target  = data.get('target', '').strip()
     ports   = data.get('ports', '').strip()
-    mode    = data.get('mode', 'Basic')
+    mode    = data.get('mode')
     threads = data.get('threads')
     preset  = data.get('preset', '')
     custom  = data.get('custom_flags', '').strip()
+    force   = bool(data.get('force'))   # skip the freshness window
+    # firewalled nets: scan every address instead of only those that answer pings
+    discovery = False if data.get('skip_discovery') else None
+    engine  = data.get('engine') or None
+    name    = (data.get('profile') or '').strip() or None
 
     # 1) Validate target is a proper IPv4, IPv6 or CIDR network
     if not target:
@@ -31,24 +40,57 @@ def start_scan():
     except ValueError:
         return jsonify(error="Invalid IPv4/IPv6 address or network"), 400
 
-    # 2) Validate ports string:  e.g. "80", "1-100,443"
-    if ports and not re.fullmatch(r'\d+(?:-\d+)?(?:,\d+(?:-\d+)?)*', ports):
-        return jsonify(error="Invalid port specification"), 400
+    # ... a named profile supplies whatever the request leaves out
+    profile = None
+    if name:
+        profile = get_profile(name)
+        if profile is None:
+            return jsonify(error=f"Unknown profile: {name}"), 400
+        ports   = ports or profile.ports or ''
+        mode    = mode or profile.mode
+        threads = threads or profile.concurrency
+        engine  = engine or profile.engine
+        if discovery is None and profile.discovery is False:
+            discovery = False
+    mode = mode or 'Basic'
 
-    # 3) Determine flags:  use custom if 'custom' preset selected
-    flags = custom if preset == 'custom' else (preset or "")
+    # 2) Validate ports string:  e.g. "80", "1-100,443", "T:22,U:53", "top:100"
+    if ports:
+        try:
+            PortSpec.parse(ports)
+        except PortSpecError as e:
+            return jsonify(error=f"Invalid port specification: {e}"), 400
 
-    # 4) Create DB record
-    scan = ScanResult(
-        target=target,
-        ports=ports,
-        flags=flags,
-        mode="Threaded" if mode == "Threaded" else "Basic",
-        status="Running"
-    )
+    # ... and the engine
+    if engine is not None and engine not in ENGINES:
+        return jsonify(error=f"Unknown engine: {engine}"), 400
+
+    # 3) Determine flags:  use custom if 'custom' preset selected, after the
+    #    profile's; every option must pass the allowlist
+    extra = custom if preset == 'custom' else (preset or "")
+    try:
+        argv = (compile_profile(profile) if profile else []) + validate_flags(extra)
+    except ProfileError as e:
+        return jsonify(error=f"Invalid flags: {e}"), 400
+    flags = shlex.join(argv)
+
+    # 4) Queue it for a worker, or share an identical queued/running scan
+    #    (or, within SCAN_FRESHNESS_SECONDS, a just-completed one); a new
+    #    scan has to fit the capacity budget first
+    fresh = 0 if force else current_app.config.get('SCAN_FRESHNESS_SECONDS', 0)
     try:
-        db.session.add(scan)
-        db.session.commit()
+        scan, outcome = request_scan(target, ports, flags, mode, threads,
+                                     PRIORITY_INTERACTIVE, fresh_seconds=fresh,
+                                     discovery=discovery, engine=engine, profile=name,
+                                     batch_hosts=profile.batch_hosts if profile else None,
+                                     admit_budget=True)
+    except OverBudget as e:
+        db.session.rollback()
+        resp = jsonify(error=str(e), estimate=e.estimate)
+        if e.retry_after:
+            resp.headers['Retry-After'] = str(e.retry_after)
+            return resp, 429
+        return resp, 422
     except SQLAlchemyError:
         db.session.rollback()
         return jsonify(error="Database error"), 500
@@ -59,21 +101,66 @@ def start_scan():
     parts = ["nmap", "-Pn"]
     if ports:
         parts += ["-p", ports]
-    if flags:
-        parts += flags.split()
+    parts += argv
     parts.append(target)
-    cmd_str = " ".join(parts)
-
-    # 6) Launch the actual scan in a background thread
-    socketio.start_background_task(
-        run_scan,
-        current_app._get_current_object(),
-        scan_id,
-        target,
-        ports,
-        flags,
-        scan.mode,
-        threads
-    )
+    cmd_str = shlex.join(parts)
+
+    estimate = None
+    if scan.estimated_seconds is not None:
+        estimate = {'probes': scan.estimated_probes, 'seconds': scan.estimated_seconds}
+    return jsonify(scan_id=scan_id, status=outcome, cmd=cmd_str, estimate=estimate), 200
+
+@scan_bp.route('/<int:scan_id>/log', methods=['GET'])
+def scan_log(scan_id):
+    """Recent nmap output for a scan, for clients that connect mid-scan."""
+    from emitter import recent_lines
+    from models import ScanResult
 
-    return jsonify(scan_id=scan_id, status="started", cmd=cmd_str), 200
\ No newline at end of file
+    lines = recent_lines(scan_id)
+    if lines is None:
+        scan  = ScanResult.query.get_or_404(scan_id)
+        lines = scan.log_tail.split("\n") if scan.log_tail else []
+    return jsonify(scan_id=scan_id, lines=lines), 200
+
+
+@scan_bp.route('/<int:scan_id>/cancel', methods=['POST'])
+def cancel(scan_id):
+    """Cancel a queued or running scan; partial results are kept for resume."""
+    from models import ScanResult, ScanJob
+    from scanner import cancel_scan
+
+    scan = ScanResult.query.get_or_404(scan_id)
+    if scan.status == 'Queued':
+        ScanJob.query.filter_by(scan_id=scan_id, status='queued').update(
+            {'status': 'cancelled'}, synchronize_session=False
+        )
+        scan.status = 'Cancelled'
+    elif scan.status == 'Running':
+        # the owning worker sees this on its next heartbeat poll
+        scan.status = 'Cancelling'
+    else:
+        return jsonify(error=f"Scan is {scan.status}"), 409
+    db.session.commit()
+    cancel_scan(scan_id)
+    return jsonify(scan_id=scan_id, status=scan.status), 200
+
+
+@scan_bp.route('/<int:scan_id>/resume', methods=['POST'])
+def resume(scan_id):
+    """Re-queue a cancelled, failed or orphaned scan; only unfinished chunks re-run."""
+    from models import ScanResult, ScanJob
+    from jobqueue import enqueue, has_live_job
+
+    scan = ScanResult.query.get_or_404(scan_id)
+    orphaned = scan.status in ('Queued', 'Running', 'Cancelling') and not has_live_job(scan_id)
+    if scan.status not in ('Cancelled', 'Failed') and not orphaned:
+        return jsonify(error=f"Scan is {scan.status}"), 409
+
+    last = (
+        ScanJob.query.filter_by(scan_id=scan_id)
+        .order_by(ScanJob.id.desc()).first()
+    )
+    scan.status = 'Queued'
+    enqueue(scan, last.threads if last else None, PRIORITY_INTERACTIVE)
+    db.session.commit()
+    return jsonify(scan_id=scan_id, status="queued"), 200
@@ -1,113 +1,113 @@
-from flask import jsonify, request, render_template, current_app
-from extensions import scheduler
-from scanner import run_scan
-from models import ScanResult
 import uuid
+import shlex
 from datetime import datetime
 
+from flask import Blueprint, jsonify, request, render_template, current_app
+from sqlalchemy.exc import SQLAlchemyError
 
-from flask import Blueprint
-schedule_bp = Blueprint('schedule', __name__)
-
-# ensure a module‐level list lives across requests
-scheduled_scans = []
-scan_id_counter = 1
-
-def schedule_scan_job(scan):
-    # Remove existing job
-    try:
-        scheduler.remove_job(scan['job_id'])
-    except Exception:
-        pass
-    if scan.get('active'):
-        # For demo: only support one-off jobs
-        scheduler.add_job(
-            func=_scheduled_scan,
-            trigger='date',
-            run_date=scan['run_at'],
-            args=[current_app._get_current_object(), scan['target'], scan['ports'], scan['flags'], scan['mode'], scan['threads']],
-            id=scan['job_id'],
-            replace_existing=True,
-        )
+from extensions import db
+from models import Schedule
+from jobqueue import request_scan, PRIORITY_INTERACTIVE
+from profiles import validate_flags
+from schedules import build_trigger, sync_job, remove_job, schedule_dict
 
+schedule_bp = Blueprint('schedule', __name__)
 
+EDITABLE = ('target', 'ports', 'flags', 'mode', 'threads', 'run_at',
+            'days_of_week', 'interval_minutes', 'cron', 'jitter_seconds', 'active')
+
+
+def parse_run_at(value):
+    """Accept both 'YYYY-MM-DDTHH:MM' and 'YYYY-MM-DD HH:MM:SS'."""
+    value = (value or '').strip().replace('T', ' ')
+    if len(value) == 16:
+        value += ':00'
+    return datetime.fromisoformat(value)
+
+
+def optional_int(value):
+    if value in (None, ''):
+        return None
+    return int(value)
+
+
+def apply_fields(schedule, data):
+    """Copy validated request fields onto the row; raises ValueError on bad input."""
+    for field in EDITABLE:
+        if field not in data:
+            continue
+        value = data[field]
+        if field == 'run_at':
+            value = parse_run_at(value)
+        elif field == 'days_of_week':
+            days = value if isinstance(value, list) else str(value or '').split(',')
+            days = sorted({str(int(d)) for d in days if str(d).strip() != ''})
+            if any(not 0 <= int(d) <= 6 for d in days):
+                raise ValueError("days_of_week must be 0 (Mon) .. 6 (Sun)")
+            value = ",".join(days) or None
+        elif field in ('threads', 'interval_minutes', 'jitter_seconds'):
+            value = optional_int(value)
+            if value is not None and value < (1 if field != 'jitter_seconds' else 0):
+                raise ValueError(f"{field} out of range")
+        elif field == 'mode':
+            value = "Threaded" if value == "Threaded" else "Basic"
+        elif field == 'active':
+            value = bool(value)
+        elif field == 'flags':
+            # same allowlist as /scan; ProfileError is a ValueError
+            value = shlex.join(validate_flags(value)) or None
+        elif isinstance(value, str):
+            value = value.strip() or None
+        setattr(schedule, field, value)
+    if not schedule.target:
+        raise ValueError("Target required")
+    build_trigger(schedule)   # rejects a bad crontab before anything is saved
+
+
+def save(schedule):
+    db.session.add(schedule)
+    db.session.commit()
+    sync_job(schedule)
 
 
 @schedule_bp.route('/<job_id>/update', methods=['POST'])
 def update_schedule(job_id):
-    data = request.get_json() or {}
-    for scan in scheduled_scans:
-        if scan['job_id'] == job_id:
-            scan.update(data)
-            # Fix: parse run_at if present and convert to correct format
-            if 'run_at' in scan:
-                try:
-                    # Accept both 'YYYY-MM-DDTHH:MM' and 'YYYY-MM-DD HH:MM:SS'
-                    run_at = scan['run_at']
-                    if 'T' in run_at:
-                        run_at = run_at.replace('T', ' ')
-                    if len(run_at) == 16:
-                        run_at += ':00'
-                    scan['run_at'] = run_at
-                except Exception:
-                    return jsonify(error='Invalid run_at format'), 400
-            schedule_scan_job(scan)
-            return jsonify(success=True)
-    return jsonify(error='Not found'), 404
+    schedule = Schedule.query.filter_by(job_id=job_id).first()
+    if schedule is None:
+        return jsonify(error='Not found'), 404
+    try:
+        apply_fields(schedule, request.get_json() or {})
+    except ValueError as e:
+        db.session.rollback()
+        return jsonify(error=str(e) or 'Invalid schedule'), 400
+    save(schedule)
+    return jsonify(success=True)
+
 
 @schedule_bp.route('/<job_id>/cancel', methods=['POST'])
 def cancel_schedule(job_id):
-    for scan in scheduled_scans:
-        if scan['job_id'] == job_id:
-            scan['active'] = False
-            try:
-                scheduler.remove_job(scan['job_id'])
-            except Exception:
-                pass
-            return jsonify(success=True)
-    return jsonify(error='Not found'), 404
-
+    schedule = Schedule.query.filter_by(job_id=job_id).first()
+    if schedule is None:
+        return jsonify(error='Not found'), 404
+    schedule.active = False
+    db.session.commit()
+    remove_job(schedule)
+    return jsonify(success=True)
 
 
-import threading
-from flask import current_app, jsonify
-from scanner import run_scan
-
 @schedule_bp.route('/<job_id>/run', methods=['POST'])
 def schedule_run_now(job_id):
-    job = next((j for j in scheduled_scans if j['job_id'] == job_id), None)
-    if not job:
+    schedule = Schedule.query.filter_by(job_id=job_id).first()
+    if schedule is None:
         return jsonify({'success': False, 'error': 'Job not found'}), 404
 
-    app = current_app._get_current_object()
-    target  = job['target']
-    ports   = job.get('ports', '')
-    flags   = job.get('flags', '')
-    mode    = job.get('mode', 'Basic')
-    threads = job.get('threads', app.config['DEFAULT_THREADS'])
-
-    def background_runner():
-        from extensions import db
-        from models import ScanResult
-        with app.app_context():
-            # 1) create and persist the new ScanResult
-            scan = ScanResult(
-                target=target,
-                ports=ports,
-                flags=flags,
-                mode=mode,
-                status='Running'
-            )
-            db.session.add(scan)
-            db.session.commit()  # ensure scan.id is populated
-            scan_id = scan.id
-            # 2) hand off to your normal run_scan()
-            run_scan(app, scan_id, target, ports, flags, mode, threads)
-
-    t = threading.Thread(target=background_runner, daemon=True)
-    t.start()
-
-    return jsonify({'success': True, 'message': 'Rescan started'}), 200
+    threads = schedule.threads or current_app.config['DEFAULT_THREADS']
+    # someone clicked "Run Now", so this goes ahead of scheduled work
+    scan, _ = request_scan(schedule.target, schedule.ports or '', schedule.flags or '',
+                           schedule.mode, threads, PRIORITY_INTERACTIVE)
+
+    return jsonify({'success': True, 'message': 'Rescan started', 'scan_id': scan.id}), 200
+
 
 @schedule_bp.route('/manage', methods=['GET'])
 def manage_schedules():
@@ -117,77 +117,23 @@ def manage_schedules():
 @schedule_bp.route('/submit', methods=['POST'])
 def schedule_submit():
     data = request.get_json() or {}
-    target = data.get('target','').strip()
-    ports  = data.get('ports','').strip()
-    flags  = data.get('flags','').strip()
-    mode   = data.get('mode','Basic')
-    threads= int(data.get('threads') or current_app.config['DEFAULT_THREADS'])
-    run_at = data.get('run_at')  # ISO datetime string
-
-    if not target or not run_at:
+    if not (data.get('target') or '').strip() or not data.get('run_at'):
         return jsonify(error="Target and run time required"), 400
 
-    # Fix: ensure run_at is a valid datetime string with seconds
-    from datetime import datetime
+    data.setdefault('threads', current_app.config['DEFAULT_THREADS'])
+    schedule = Schedule(job_id=f"scan-{uuid.uuid4().hex}", active=True)
+    try:
+        apply_fields(schedule, data)
+    except ValueError as e:
+        return jsonify(error=str(e) or "Invalid run time format"), 400
     try:
-        # If seconds are missing, add ':00'
-        if len(run_at) == 16:
-            run_at += ':00'
-        run_at_dt = datetime.fromisoformat(run_at)
-    except Exception:
-        return jsonify(error="Invalid run time format"), 400
-
-    from flask import current_app
-    app = current_app._get_current_object()
-    job_id = f"scan-{uuid.uuid4().hex}"
-    # append to the module‐level list, not reassign it
-    global scheduled_scans, scan_id_counter
-    scan_entry = {
-        'id': scan_id_counter,
-        'job_id': job_id,
-        'target': target,
-        'ports': ports,
-        'flags': flags,
-        'mode': mode,
-        'threads': threads,
-        'run_at': run_at_dt.isoformat(sep=' '),
-        'days_of_week': [],
-        'active': True,
-        'next_run_time': run_at_dt.isoformat(sep=' ')
-    }
-    scheduled_scans.append(scan_entry)
-    scan_id_counter += 1
-    scheduler.add_job(
-        func=_scheduled_scan,
-        trigger='date',
-        run_date=run_at_dt,
-        args=[app, target, ports, flags, mode, threads],
-        id=job_id,
-        replace_existing=False,
-    )
-    return jsonify(job_id=job_id, status="scheduled")
+        save(schedule)
+    except SQLAlchemyError:
+        db.session.rollback()
+        return jsonify(error="Could not save schedule"), 500
+    return jsonify(job_id=schedule.job_id, status="scheduled")
+
 
 @schedule_bp.route('/api', methods=['GET'])
 def schedule_api():
-    return jsonify(scheduled_scans)
-
-def _scheduled_scan(app, target, ports, flags, mode, threads):
-    # mirror start_scan logic
-    from extensions import db, socketio
-    with app.app_context():
-        scan = ScanResult(
-            target=target,
-            ports=ports,
-            flags=flags,
-            mode="Threaded" if mode=="Threaded" else "Basic",
-            status="Running"
-        )
-        db.session.add(scan)
-        db.session.commit()
-        scan_id = scan.id
-
-        socketio.start_background_task(
-            run_scan,
-            app,
-            scan_id, target, ports, flags, scan.mode, threads
-        )
+    return jsonify([schedule_dict(s) for s in Schedule.query.order_by(Schedule.id)])
@@ -1,115 +1,119 @@
 import json
-import difflib
-from flask import Blueprint, request, render_template, current_app, jsonify, abort
+import zlib
+
+from flask import Blueprint, request, render_template, current_app, jsonify, make_response
 from flask_login import login_required
-from extensions import db, socketio
-from models import ScanResult, ChangeLog
-from scanner import run_scan
+from extensions import db
+from models import ScanResult, ScanHost, ScanPort, ChangeLog
+from results import ensure_normalized, build_summaries, summary_cache
+from jobqueue import request_scan
+from changes import PENDING
 
 view_bp = Blueprint('view', __name__, url_prefix='/view')
 
 
+def report_page(scan, ip, port, service, page, per_page):
+    """One page of precomputed host summaries, filtered by IP prefix / open port / service."""
+    query = scan.hosts
+    if ip:
+        query = query.filter(ScanHost.ip >= ip, ScanHost.ip < ip + '\uffff')
+    if port is not None or service:
+        match = ScanPort.query.filter(
+            ScanPort.host_id == ScanHost.id, ScanPort.state == 'open'
+        )
+        if port is not None:
+            match = match.filter(ScanPort.port == port)
+        if service:
+            match = match.filter(ScanPort.service == service)
+        query = query.filter(match.exists())
+
+    total = query.count()
+    hosts = query.order_by(ScanHost.id).offset((page - 1) * per_page).limit(per_page).all()
+
+    if any(h.summary_json is None for h in hosts):
+        build_summaries(scan)   # scans finished before summaries existed
+        db.session.commit()
+
+    summary = []
+    for h in hosts:
+        entry = json.loads(h.summary_json)
+        if port is not None or service:
+            entry['open_ports'] = [
+                p for p in entry['open_ports']
+                if (port is None or p['port'] == str(port))
+                and (not service or p['service'] == service)
+            ]
+        summary.append(entry)
+    return summary, total
+
+
 @view_bp.route('/<int:scan_id>')
 @login_required
 def view_scan(scan_id):
     scan = ScanResult.query.get(scan_id)
-    if not scan or scan.status != "Completed" or not scan.results_json:
+    if not scan or scan.status != "Completed":
         return render_template('scan_not_found.html', scan_id=scan_id), 404
 
-    # parse XML→dict
-    data = json.loads(scan.results_json)
-    cmd  = data.get('@args')
-
-    # normalize hosts
-    hosts = data.get('host') or []
-    if not isinstance(hosts, list):
-        hosts = [hosts]
-
-    summary = []
-    for h in hosts:
-        # addresses
-        addrs = h.get('address') or []
-        if isinstance(addrs, dict):
-            addrs = [addrs]
-        ip = mac = None
-        for a in addrs:
-            if a.get('@addrtype') in ('ipv4','ipv6'):
-                ip = a.get('@addr')
-            if a.get('@addrtype') == 'mac':
-                mac = a.get('@addr')
-
-        # hostname
-        hn = h.get('hostnames') or {}
-        hn_entry = hn.get('hostname')
-        if isinstance(hn_entry, dict):
-            hostname = hn_entry.get('@name')
-        elif isinstance(hn_entry, list) and hn_entry:
-            hostname = hn_entry[0].get('@name')
-        else:
-            hostname = None
-
-        # os
-        osmatch = h.get('os',{}).get('osmatch')
-        if osmatch:
-            first = osmatch[0] if isinstance(osmatch,list) else osmatch
-            os_name = first.get('@name')
-            os_acc  = first.get('@accuracy')
-        else:
-            os_name = os_acc = None
-
-        # ports + scripts
-        ports_raw = h.get('ports',{}).get('port') or []
-        if isinstance(ports_raw, dict):
-            ports_raw = [ports_raw]
-        open_ports = []
-        for p in ports_raw:
-            if p.get('state',{}).get('@state') == 'open':
-                svc = p.get('service') or {}
-                version = " ".join(filter(None,[svc.get('@product'),svc.get('@version')]))
-                scr = p.get('script') or []
-                if isinstance(scr,dict):
-                    scr = [scr]
-                port_scripts = [{'id':s.get('@id'),'output':s.get('@output','')} for s in scr]
-                open_ports.append({
-                    'port':     p.get('@portid'),
-                    'protocol': p.get('@protocol'),
-                    'service':  svc.get('@name'),
-                    'version':  version,
-                    'scripts':  port_scripts
-                })
-
-        # host‐level scripts
-        scr = h.get('script') or []
-        if isinstance(scr, dict):
-            scr = [scr]
-        host_scripts=[]
-        ssl_cert=None; http_title=None
-        for s in scr:
-            sid = s.get('@id'); out = s.get('@output','')
-            host_scripts.append({'id':sid,'output':out})
-            if sid=='ssl-cert' and not ssl_cert:
-                ssl_cert=out.split('\n',1)[0]
-            if sid=='http-title' and not http_title:
-                http_title=out.strip()
-
-        summary.append({
-            'ip':           ip,
-            'mac':          mac,
-            'hostname':     hostname,
-            'os':           {'name':os_name,'accuracy':os_acc},
-            'open_ports':   open_ports,
-            'host_scripts': host_scripts,
-            'ssl':          ssl_cert,
-            'http_title':   http_title
-        })
+    ensure_normalized(scan)
 
     # find latest ChangeLog for _this_ scan
     changelog = ChangeLog.query.filter_by(scan_id=scan.id).order_by(ChangeLog.timestamp.desc()).first()
 
-    return render_template('view.html',
-                           scan=scan, cmd=cmd,
-                           summary=summary,
-                           changelog=changelog)
+    # completed scans never change, so the page only depends on its query
+    # string and on the change log - a later one, or the pending row being
+    # filled in once the diff lands; browsers revalidate with the ETag
+    modified = scan.finished_at or scan.timestamp
+    diff_tag = f"{changelog.id}.{zlib.crc32((changelog.diff or '').encode()):08x}" if changelog else "0"
+    etag = f"scan-{scan.id}-{int(modified.timestamp())}-{diff_tag}"
+    if request.if_none_match.contains_weak(etag):
+        resp = make_response('', 304)
+        resp.set_etag(etag, weak=True)
+        return resp
+
+    ip      = request.args.get('ip', '').strip()
+    service = request.args.get('service', '').strip()
+    port    = request.args.get('port', type=int)
+    page    = max(request.args.get('page', 1, type=int), 1)
+    per_page = current_app.config.get('VIEW_PAGE_SIZE', 100)
+
+    key = (scan.id, ip, port, service, page)
+    cached = summary_cache.get(key)
+    if cached is None:
+        summary, total = report_page(scan, ip, port, service, page, per_page)
+        summary_cache.put(key, (summary, total), len(json.dumps(summary)))
+    else:
+        summary, total = cached
+
+    filters = {k: v for k, v in (('ip', ip), ('port', port), ('service', service)) if v}
+    resp = make_response(render_template(
+        'view.html',
+        scan=scan, cmd=scan.nmap_args,
+        summary=summary,
+        changelog=changelog,
+        total_hosts=total,
+        page=page,
+        pages=max((total + per_page - 1) // per_page, 1),
+        filters=filters
+    ))
+    resp.set_etag(etag, weak=True)
+    resp.last_modified = modified
+    resp.cache_control.private  = True
+    resp.cache_control.no_cache = True
+    return resp
+
+
+@view_bp.route('/<int:scan_id>/changes')
+@login_required
+def scan_changes(scan_id):
+    """Every change log recorded for a scan, newest first."""
+    scan = ScanResult.query.get_or_404(scan_id)
+    changes = (
+        ChangeLog.query
+        .filter_by(scan_id=scan.id)
+        .order_by(ChangeLog.timestamp.desc())
+        .all()
+    )
+    return render_template('changes.html', scan=scan, changes=changes)
 
 
 @view_bp.route('/rescan/<int:scan_id>', methods=['POST'])
@@ -118,37 +122,19 @@ def rescan(scan_id):
     """Kick off a brand-new scan with the same flags, record in ChangeLog"""
     old = ScanResult.query.get_or_404(scan_id)
 
-    # create new scan row
-    new = ScanResult(
-        target=old.target,
-        ports=old.ports,
-        flags=old.flags,
-        mode=old.mode,
-        status='Running'
-    )
-    db.session.add(new)
-    db.session.commit()
-
-    # start the background job
+    # queue a new scan, or join an identical one that is already in flight
     threads = current_app.config.get('DEFAULT_THREADS', 100)
-    socketio.start_background_task(
-        run_scan,
-        current_app._get_current_object(),
-        new.id,
-        new.target,
-        new.ports,
-        new.flags,
-        new.mode,
-        threads
-    )
+    new, outcome = request_scan(old.target, old.ports, old.flags, old.mode, threads,
+                                discovery=old.host_discovery, engine=old.engine)
 
     # store the linkage in ChangeLog immediately (diff will be filled in later)
-    cl = ChangeLog(
-      scan_id=new.id,
-      previous_scan_id=old.id,
-      diff='(pending...)'
-    )
-    db.session.add(cl)
-    db.session.commit()
-
-    return jsonify(scan_id=new.id)
\ No newline at end of file
+    if not ChangeLog.query.filter_by(scan_id=new.id).first():
+        cl = ChangeLog(
+          scan_id=new.id,
+          previous_scan_id=old.id,
+          diff=PENDING
+        )
+        db.session.add(cl)
+        db.session.commit()
+
+    return jsonify(scan_id=new.id, status=outcome)
\ No newline at end of file
@@ -2,310 +2,1243 @@ import os
 import uuid
 import time
 import shlex
-import json
+import socket
+import asyncio
+import functools
 import ipaddress
 import math
-import xmltodict
+import itertools
+import threading
 import subprocess
+import bisect
+import collections
 import concurrent.futures
+import xml.etree.ElementTree as ET
+from datetime import datetime
 
-from extensions import db, socketio
-from models import ScanResult, ChangeLog
+from sqlalchemy import and_, or_
 
+from extensions import db
+from emitter import ScanEmitter
+from governor import governor
+from ratelimit import limiter, TimeoutMonitor, CONGESTION_RE
+from models import ScanResult, ScanHost, ScanPort, ScanScript, ScanChunk
+from nmapxml import HostStream
+from results import store_host, build_summaries, host_ip, as_list, RawArchive
+from changes import record_changes
+from portspec import PortSpec, PortSpecError, parse_or_none
+from blobstore import get_store
+from dbwriter import get_writer
+from profiles import split_flags, is_verbose, option_value
 
-def run_scan(app, scan_id, target, ports, flags, mode, concurrency=None):
-    """Background task that executes an nmap scan and updates the DB + emits events."""
-    with app.app_context():
-        scan_record = ScanResult.query.get(scan_id)
-        if not scan_record:
+try:
+    import resource
+except ImportError:   # not POSIX: leave the open-files limit alone
+    resource = None
+
+# descriptors kept free for the DB, log files and nmap pipes
+FD_HEADROOM = 256
+
+# nmap options that probe services/OS on ports already known to be open;
+# a two-stage scan leaves them out of the port sweep
+DETECTION_FLAGS = {
+    '-sV', '-sC', '-A', '-O', '--version-all', '--version-light', '--version-trace',
+    '--osscan-guess', '--osscan-limit', '--traceroute', '--script-trace',
+}
+DETECTION_ARGS = {
+    '--script', '--script-args', '--script-args-file', '--script-timeout',
+    '--version-intensity', '--max-os-tries',
+}
+
+
+# scan_id -> {'cancel': Event, 'procs': set of Popen} for scans in this process
+_running = {}
+_running_lock = threading.Lock()
+
+
+def cancel_scan(scan_id):
+    """Stop a scan running in this process: no new children, terminate live ones.
+
+    Returns False if the scan isn't running here (another worker may own it;
+    it will notice the 'Cancelling' status on its next heartbeat).
+    """
+    with _running_lock:
+        run = _running.get(scan_id)
+        if run is None:
+            return False
+        run['cancel'].set()
+        procs = list(run['procs'])
+    for proc in procs:
+        try:
+            proc.terminate()
+        except OSError:
+            pass
+    return True
+
+
+def address_intervals(specs):
+    """Merged, sorted (lo, hi) integer ranges covered by space-separated targets."""
+    spans = []
+    for spec in specs:
+        for t in spec.split():
+            try:
+                net = ipaddress.ip_network(t, strict=False)
+            except ValueError:
+                continue
+            spans.append((int(net.network_address), int(net.broadcast_address)))
+    spans.sort()
+    merged = []
+    for lo, hi in spans:
+        if merged and lo <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], hi))
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+def in_intervals(intervals, addr):
+    value = int(addr)
+    i = bisect.bisect_right(intervals, (value, float('inf'))) - 1
+    return i >= 0 and intervals[i][0] <= value <= intervals[i][1]
+
+
+def add_chunk(scan_id, kind, spec, status='running'):
+    """Insert a ScanChunk checkpoint and return its id; the caller commits."""
+    chunk = ScanChunk(scan_id=scan_id, kind=kind, spec=spec, status=status)
+    db.session.add(chunk)
+    db.session.flush()
+    return chunk.id
+
+
+def finish_chunk(chunk_id, status):
+    ScanChunk.query.filter_by(id=chunk_id).update(
+        {'status': status, 'finished_at': datetime.utcnow()}, synchronize_session=False
+    )
+
+
+def discard_partial(scan_id, chunk):
+    """Delete rows an unfinished chunk may have written, so a re-run doesn't double them."""
+    if chunk.kind == 'ports':
+        spec = parse_or_none(chunk.spec)
+        if spec is None:
             return
+        ranges = [
+            and_(ScanPort.protocol == proto, ScanPort.port.between(lo, hi))
+            for proto, spans in spec.intervals.items() for lo, hi in spans
+        ]
+        port_ids = [
+            pid for (pid,) in db.session.query(ScanPort.id).filter(
+                ScanPort.scan_id == scan_id, or_(*ranges)
+            )
+        ]
+        for i in range(0, len(port_ids), 500):
+            ids = port_ids[i:i + 500]
+            ScanScript.query.filter(ScanScript.port_id.in_(ids)).delete(synchronize_session=False)
+            ScanPort.query.filter(ScanPort.id.in_(ids)).delete(synchronize_session=False)
+        return
+    if chunk.kind == 'detect':
+        # keep the sweep's port rows, drop the scripts detection may have added
+        ip, _, spec = chunk.spec.partition(' ')
+        host = ScanHost.query.filter_by(scan_id=scan_id, ip=ip).first()
+        spec = parse_or_none(spec)
+        if host is not None and spec is not None:
+            port_ids = [p.id for p in host.ports if spec.contains(p.protocol, p.port)]
+            ScanScript.query.filter(
+                ScanScript.host_id == host.id,
+                or_(ScanScript.port_id.is_(None), ScanScript.port_id.in_(port_ids))
+            ).delete(synchronize_session=False)
+        return
+    intervals = address_intervals([chunk.spec]) if chunk.kind == 'hosts' else None
+    for host in ScanHost.query.filter_by(scan_id=scan_id):
+        if intervals is None or (host.ip and in_intervals(intervals, ipaddress.ip_address(host.ip))):
+            db.session.delete(host)
 
-        # default concurrency
-        if not isinstance(concurrency, int) or concurrency < 1:
-            concurrency = app.config.get('DEFAULT_THREADS', 100)
 
-        start_time = time.time()
-        error_flag = False
-        results_data = None
+def batch_targets(batch):
+    """Render a batch of addresses as the fewest CIDR blocks nmap needs."""
+    targets = []
+    for net in ipaddress.collapse_addresses(batch):
+        if net.prefixlen == net.max_prefixlen:
+            targets.append(str(net.network_address))
+        else:
+            targets.append(str(net))
+    return targets
 
-        def execute_nmap(target_spec, port_spec, extra_flags):
-            """Run nmap, stream progress via socketio, parse XML to dict."""
-            cmd = ["nmap", "-Pn"]
-            if port_spec:
-                cmd += ["-p", str(port_spec)]
-            if extra_flags:
-                try:
-                    cmd += shlex.split(extra_flags)
-                except ValueError:
-                    cmd.append(extra_flags)
 
-            xml_file = f"/tmp/nmap_{scan_id}_{uuid.uuid4().hex}.xml"
-            cmd += ["-oX", xml_file]
-            if "-v" not in extra_flags and "-d" not in extra_flags:
-                cmd.append("-v")
-            cmd.append(target_spec)
+class LiveHosts:
+    """Addresses a discovery sweep has found up, handed on while it still runs.
+
+    The sweep put()s hosts as nmap reports them and close()s when it is done.
+    take() blocks until a host is ready (or the sweep finished), then lingers
+    briefly so a fast sweep still fills a batch instead of a host at a time.
+    """
+
+    def __init__(self, linger=0.5):
+        self.linger  = linger
+        self.found   = 0
+        self._items  = collections.deque()
+        self._closed = False
+        self._cond   = threading.Condition()
+
+    def put(self, addr):
+        with self._cond:
+            self._items.append(addr)
+            self.found += 1
+            self._cond.notify_all()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def take(self, n):
+        """Up to n addresses; empty only once the sweep is over and drained."""
+        deadline = None
+        with self._cond:
+            while len(self._items) < n and not self._closed:
+                if not self._items:
+                    self._cond.wait()
+                    continue
+                if deadline is None:
+                    deadline = time.time() + self.linger
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return [self._items.popleft() for _ in range(min(n, len(self._items)))]
+
+
+class HostBatcher:
+    """Hands out host batches drawn lazily from an address iterator.
+
+    nmap parallelizes hosts internally, so a batch of N hosts in one process
+    is far cheaper than N processes. Batch size follows the observed per-host
+    scan time so each nmap child runs for roughly ``target_seconds``, and is
+    capped so every worker still gets a share of the remaining hosts.
+
+    ``hosts`` may also be a LiveHosts, in which case batches are whatever the
+    discovery sweep has found so far, up to the current size.
+    """
+
+    def __init__(self, hosts, workers, total=None, initial=8,
+                 min_size=1, max_size=1024, target_seconds=60):
+        self._take          = getattr(hosts, 'take', None)
+        self._hosts         = None if self._take else iter(hosts)
+        self.workers        = max(workers, 1)
+        self.total          = total
+        self.min_size       = max(min_size, 1)
+        self.max_size       = max(max_size, self.min_size)
+        self.target_seconds = target_seconds
+        self.size           = max(self.min_size, min(initial, self.max_size))
+        self.per_host       = None
+        self.dispatched     = 0
 
+    def next_batch(self):
+        """Return the next list of addresses (empty once the iterator is spent)."""
+        size = self.size
+        if self.total:
+            remaining = max(self.total - self.dispatched, 0)
+            size = min(size, math.ceil(remaining / self.workers))
+        size  = max(self.min_size, min(size, self.max_size))
+        if self._take:
+            batch = self._take(size)
+        else:
+            batch = list(itertools.islice(self._hosts, size))
+        self.dispatched += len(batch)
+        return batch
+
+    def record(self, count, elapsed):
+        """Feed back how long a finished batch of ``count`` hosts took."""
+        if count < 1:
+            return
+        sample = elapsed / count
+        if self.per_host is None:
+            self.per_host = sample
+        else:
+            self.per_host = 0.7 * self.per_host + 0.3 * sample
+        if self.per_host > 0:
+            wanted = int(self.target_seconds / self.per_host)
+        else:
+            wanted = self.max_size
+        # move at most 2x per step so one outlier batch can't swing the size
+        wanted = min(max(wanted, self.size // 2), self.size * 2)
+        self.size = max(self.min_size, min(wanted, self.max_size))
+
+
+def split_detection_flags(flags):
+    """(sweep flags, detection flags) as strings; detection is empty when the
+    scan asks for no service/OS/script probes."""
+    try:
+        tokens = shlex.split(flags or '')
+    except ValueError:
+        return flags or '', ''
+    sweep, detect = [], []
+    it = iter(tokens)
+    for tok in it:
+        name, eq, _ = tok.partition('=')
+        if tok in DETECTION_FLAGS:
+            detect.append(tok)
+        elif name in DETECTION_ARGS:
+            detect.append(tok)
+            if not eq:
+                detect.append(next(it, ''))
+        else:
+            sweep.append(tok)
+    return shlex.join(sweep), shlex.join(detect)
+
+
+def open_port_spec(h):
+    """PortSpec of the ports a host dict reports open."""
+    spans = {}
+    for p in as_list((h.get('ports') or {}).get('port')):
+        if (p.get('state') or {}).get('@state') == 'open':
             try:
-                proc = subprocess.Popen(
-                    cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
-                )
-            except FileNotFoundError:
-                socketio.emit('scan_error', {
-                    'error': 'Nmap command not found. Install nmap and try again.',
-                    'scan_id': scan_id
-                })
-                return None
+                port = int(p.get('@portid'))
+            except (TypeError, ValueError):
+                continue
+            spans.setdefault(p.get('@protocol') or 'tcp', []).append((port, port))
+    return PortSpec(spans)
 
+
+def pending_detections(scan_id, done_specs):
+    """(ip, PortSpec) of open ports a resumed two-stage scan hasn't probed yet."""
+    done = {}
+    for spec in done_specs:
+        ip, _, ports = spec.partition(' ')
+        done[ip] = done.get(ip, PortSpec()).union(parse_or_none(ports) or PortSpec())
+    spans = {}
+    rows = (
+        db.session.query(ScanHost.ip, ScanPort.protocol, ScanPort.port)
+        .join(ScanPort, ScanPort.host_id == ScanHost.id)
+        .filter(ScanHost.scan_id == scan_id, ScanPort.state == 'open')
+    )
+    for ip, protocol, port in rows:
+        spans.setdefault(ip, {}).setdefault(protocol, []).append((port, port))
+    for ip, intervals in spans.items():
+        todo = PortSpec(intervals).subtract(done.get(ip, PortSpec()))
+        if todo:
+            yield ip, todo
+
+
+def count_ports(port_spec):
+    """Number of ports in a spec; nmap's default is its top 1000."""
+    spec = parse_or_none(port_spec)
+    return spec.count() if spec else 1000
+
+
+class ProgressAggregator:
+    """Folds per-child nmap progress into one monotonic figure for the scan.
+
+    Work is measured in host x port probes. Each sub-job registers its weight
+    when it starts; its "% done" lines move it between 0 and its weight, so
+    the overall percentage is completed work over total work regardless of
+    how the scan was split. Throughput and ETA come from work done so far.
+    """
+
+    def __init__(self, total_work=None, total_hosts=None):
+        self.total_work  = total_work
+        self.total_hosts = total_hosts
+        self.started     = time.time()
+        self._lock       = threading.Lock()
+        self._jobs       = {}    # key -> [weight, hosts, fraction]
+        self._done_work  = 0.0   # finished sub-jobs are folded in here
+        self._done_hosts = 0.0
+        self._peak       = 0.0
+
+    def start(self, key, weight, hosts=1):
+        with self._lock:
+            self._jobs[key] = [max(weight, 1), hosts, 0.0]
+
+    def update(self, key, percent):
+        with self._lock:
+            job = self._jobs.get(key)
+            if job:
+                # nmap restarts its percentage for each phase; never go back
+                job[2] = max(job[2], min(percent, 100.0) / 100.0)
+
+    def credit(self, work, hosts):
+        """Count work already finished by an earlier (resumed) run."""
+        with self._lock:
+            self._done_work  += work
+            self._done_hosts += hosts
+
+    def finish(self, key):
+        with self._lock:
+            job = self._jobs.pop(key, None)
+            if job:
+                self._done_work  += job[0]
+                self._done_hosts += job[1]
+
+    def snapshot(self):
+        with self._lock:
+            done  = self._done_work  + sum(w * f for w, _, f in self._jobs.values())
+            hosts = self._done_hosts + sum(h * f for _, h, f in self._jobs.values())
+            total = max(self.total_work or 0,
+                        self._done_work + sum(w for w, _, _ in self._jobs.values()), 1)
+            self._peak = max(self._peak, min(done / total, 1.0))
+            elapsed = max(time.time() - self.started, 1e-6)
+            rate    = done / elapsed
+            eta     = (total - done) / rate if rate > 0 else None
+            return {
+                'percent':       int(self._peak * 100),
+                'eta_seconds':   round(eta, 1) if eta is not None else None,
+                'elapsed':       round(elapsed, 1),
+                'hosts_done':    round(hosts, 1),
+                'hosts_total':   self.total_hosts,
+                'hosts_per_sec': round(hosts / elapsed, 3),
+                'ports_per_sec': round(rate, 1),
+            }
+
+
+class ScanContext:
+    """The running scan as an engine sees it: where finished hosts, output
+    lines and progress go, and whether the scan has been cancelled."""
+
+    def __init__(self, scan_id, cancelled, emitter, on_host, procs, stats, config):
+        self.scan_id   = scan_id
+        self.cancelled = cancelled
+        self.emitter   = emitter
+        self.on_host   = on_host
+        self.procs     = procs
+        self.stats     = stats
+        self.config    = config
+
+    def track(self, proc):
+        """Register a child process so cancel_scan can terminate it."""
+        with _running_lock:
+            self.procs.add(proc)
+
+    def untrack(self, proc):
+        with _running_lock:
+            self.procs.discard(proc)
+
+
+class ScanEngine:
+    """Runs one sub-job of a scan.
+
+    run() scans ``targets`` (a target string or a list of them) on ``ports``
+    (nmap -p syntax, or None for the engine's default set), hands every
+    finished host to ctx.on_host as an xmltodict-style dict - the shape
+    store_host takes - and returns True on success.
+    """
+
+    name = None
+
+    def run(self, ctx, child_id, targets, ports, flags, slot):
+        raise NotImplementedError
+
+
+class NmapEngine(ScanEngine):
+    """One nmap child process per sub-job; supports every nmap flag."""
+
+    name = 'nmap'
+
+    def run(self, ctx, child_id, targets, ports, flags, slot):
+        """Run nmap, stream progress via the emitter, persist hosts as nmap writes them."""
+        emitter = ctx.emitter
+        cmd = ["nmap", "-Pn"]
+        if ports:
+            cmd += ["-p", str(ports)]
+        argv = split_flags(flags)
+        if slot.max_rate:
+            argv = cap_max_rate(argv, slot.max_rate)
+        cmd += argv
+
+        xml_file = f"/tmp/nmap_{ctx.scan_id}_{child_id}.xml"
+        cmd += ["-oX", xml_file]
+        if not is_verbose(argv):
+            cmd.append("-v")
+        if isinstance(targets, (list, tuple)):
+            cmd += targets
+        else:
+            cmd.append(targets)
+
+        try:
+            proc = subprocess.Popen(
+                cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
+            )
+        except FileNotFoundError:
+            emitter.error('Nmap command not found. Install nmap and try again.')
+            return False
+        ctx.track(proc)
+
+        # nmap flushes the XML file after every host, so tail it between
+        # stdout lines and hand each closed <host> to on_host
+        stream = HostStream()
+        xml_in = None
+
+        def drain():
+            nonlocal xml_in
+            if xml_in is None:
+                try:
+                    xml_in = open(xml_file, 'rb')
+                except OSError:
+                    return
+            data = xml_in.read()
+            if data:
+                for h in stream.feed(data):
+                    ctx.on_host(h)
+
+        try:
             for line in proc.stdout:
                 text = line.strip()
                 if not text:
                     continue
-                # progress events
-                if "Discovered open port" in text:
-                    socketio.emit('scan_update', {'message': text, 'scan_id': scan_id})
-                elif "% done" in text:
+                # progress events (coalesced by the emitter)
+                if "% done" in text:
                     try:
                         percent = float(text.split("%")[0].split()[-1])
-                        socketio.emit('scan_progress', {
-                            'percent': int(percent), 'scan_id': scan_id
-                        })
+                        emitter.progress(child_id, percent)
                     except Exception:
                         pass
-                    socketio.emit('scan_update', {'message': text, 'scan_id': scan_id})
-                else:
-                    socketio.emit('scan_update', {'message': text, 'scan_id': scan_id})
+                emitter.line(text)
+                if slot.lease is not None and CONGESTION_RE.search(text):
+                    for key, limit in slot.lease.congestion():
+                        emitter.line(f"Rate limit: {key} backed off to {limit:.0f} probes/s")
+                drain()
 
             proc.wait()
-            if proc.returncode != 0:
-                socketio.emit('scan_error', {
-                    'error': f"nmap exited with code {proc.returncode}", 'scan_id': scan_id
-                })
-                return None
+            drain()
+            if proc.returncode == 0:
+                if xml_in is None:
+                    raise OSError(f"{xml_file} was never written")
+                stream.close()
+        except ET.ParseError as e:
+            emitter.error(f"Failed to parse XML: {e}")
+            return False
+        except OSError as e:
+            emitter.error(f"Failed to read XML output: {e}")
+            return False
+        finally:
+            ctx.untrack(proc)
+            if xml_in is not None:
+                xml_in.close()
+            try: os.remove(xml_file)
+            except OSError: pass
+
+        if ctx.cancelled.is_set():
+            return False
+
+        ctx.stats['args'] = ctx.stats['args'] or stream.args
+        ctx.stats['runstats'] = stream.runstats
+        if proc.returncode != 0:
+            emitter.error(f"nmap exited with code {proc.returncode}")
+            return False
+        return True
+
+
+def cap_max_rate(argv, rate):
+    """argv with --max-rate at most ``rate``: added, or lowered if higher."""
+    given = option_value(argv, "--max-rate")
+    try:
+        if given is not None and float(given) <= rate:
+            return argv
+    except ValueError:
+        pass
+    out, skip = [], False
+    for tok in argv:
+        if skip:
+            skip = False
+        elif tok == "--max-rate":
+            skip = True
+        elif not tok.startswith("--max-rate="):
+            out.append(tok)
+    return ["--max-rate", str(rate)] + out
+
+
+class _Pacer:
+    """Spaces out awaits to at most ``rate`` per second (0/None = no limit)."""
+
+    def __init__(self, rate):
+        self.next = 0.0
+        self.set_rate(rate)
+
+    def set_rate(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+
+    async def wait(self):
+        if not self.interval:
+            return
+        now = asyncio.get_running_loop().time()
+        at  = max(now, self.next)
+        self.next = at + self.interval
+        if at > now:
+            await asyncio.sleep(at - now)
+
+
+@functools.lru_cache(maxsize=4096)
+def service_name(port, protocol='tcp'):
+    try:
+        return socket.getservbyport(port, protocol)
+    except OSError:
+        return None
+
+
+def target_networks(targets):
+    """ip_network objects for a target string or list; hostnames are skipped."""
+    if not isinstance(targets, (list, tuple)):
+        targets = (targets or '').split()
+    nets = []
+    for t in targets:
+        try:
+            nets.append(ipaddress.ip_network(t, strict=False))
+        except ValueError:
+            continue
+    return nets
+
+
+def network_hosts(net):
+    """Scannable addresses of a network: a single address is its own host."""
+    if net.num_addresses == 1:
+        return iter([net.network_address])
+    return net.hosts()
+
+
+def connect_host(ip, version, states):
+    """Host dict (as nmap's XML would give) from {port: 'open'|'closed'|None}."""
+    answered = [p for p, st in states.items() if st]
+    if not answered:
+        return None
+    open_ports = sorted(p for p in answered if states[p] == 'open')
+    closed = len(answered) - len(open_ports)
+    h = {
+        'status':  {'@state': 'up', '@reason': 'syn-ack' if open_ports else 'conn-refused'},
+        'address': {'@addr': ip, '@addrtype': f'ipv{version}'},
+        'ports':   {'port': [{
+            '@protocol': 'tcp',
+            '@portid':   str(p),
+            'state':     {'@state': 'open', '@reason': 'syn-ack'},
+            'service':   {'@name': service_name(p), '@method': 'table'},
+        } for p in open_ports]},
+    }
+    if closed:
+        h['ports']['extraports'] = {'@state': 'closed', '@count': str(closed)}
+    return h
+
+
+class ConnectEngine(ScanEngine):
+    """TCP connect() sweeps on asyncio, with no process per sub-job.
+
+    A port is open when the handshake completes and closed when refused;
+    hosts that answer nothing are left out. Up to SCAN_CONNECT_CONCURRENCY
+    sockets are in flight at once, SCAN_CONNECT_HOSTS hosts are worked on
+    together, and each host gets at most SCAN_CONNECT_HOST_RATE connects per
+    second (the slot's max_rate caps the whole child, and is lowered when
+    timeouts rise - see ratelimit.py). TCP only, and nmap flags don't apply -
+    use the nmap engine for service or OS detection.
+    """
+
+    name = 'connect'
+
+    def run(self, ctx, child_id, targets, ports, flags, slot):
+        spec = parse_or_none(ports) if ports else None
+        if spec is None:
+            spec = default_tcp_ports()
+        tcp = PortSpec({'tcp': spec.intervals.get('tcp', [])})
+        if tcp.count() < spec.count():
+            ctx.emitter.line("connect engine: only TCP ports are scanned")
+        if (flags or '').strip():
+            ctx.emitter.line(f"connect engine: nmap flags ignored ({flags})")
+        nets = target_networks(targets)
+        if not nets or not tcp:
+            return True
+        ctx.stats['args'] = ctx.stats['args'] or f"connect -p {tcp} {' '.join(map(str, nets))}"
+
+        cfg = ctx.config
+        concurrency = raise_fd_limit(cfg.get('SCAN_CONNECT_CONCURRENCY', 10000))
+        asyncio.run(self._sweep(
+            ctx, child_id, nets, tcp, slot,
+            concurrency=concurrency,
+            hosts=cfg.get('SCAN_CONNECT_HOSTS', 256),
+            timeout=cfg.get('SCAN_CONNECT_TIMEOUT', 1.5),
+            retries=cfg.get('SCAN_CONNECT_RETRIES', 1),
+            host_rate=cfg.get('SCAN_CONNECT_HOST_RATE', 0),
+        ))
+        return not ctx.cancelled.is_set()
+
+    async def _sweep(self, ctx, child_id, nets, spec, slot, concurrency, hosts,
+                     timeout, retries, host_rate):
+        sockets  = asyncio.Semaphore(max(concurrency, 1))
+        window   = asyncio.Semaphore(max(hosts, 1))
+        overall  = _Pacer(slot.max_rate)
+        nports   = spec.count()
+        total    = sum(n.num_addresses for n in nets) * nports
+        progress = {'done': 0, 'percent': -1}
+        monitor  = TimeoutMonitor(ctx.config.get('SCAN_RATE_TIMEOUT_RISE', 0.1))
+
+        def attempted(timed_out):
+            # more timeouts than this child started with: slow down
+            if monitor.record(timed_out) and slot.lease is not None:
+                for key, limit in slot.lease.congestion():
+                    ctx.emitter.line(f"Rate limit: {key} backed off to {limit:.0f} probes/s")
+                overall.set_rate(slot.lease.apply(slot))
+
+        async def probe(ip, port):
+            # a timeout may just be a busy loop or a lost SYN, so try again
+            for _ in range(retries + 1):
+                try:
+                    _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+                except ConnectionRefusedError:
+                    attempted(False)
+                    return 'closed'
+                except asyncio.TimeoutError:
+                    attempted(True)
+                    continue
+                except OSError:
+                    return None
+                attempted(False)
+                writer.transport.abort()
+                return 'open'
+            return None
+
+        def probed(count=1):
+            progress['done'] += count
+            percent = int(100 * progress['done'] / total)
+            if percent != progress['percent']:
+                progress['percent'] = percent
+                ctx.emitter.progress(child_id, percent)
+
+        async def scan_host(addr):
+            ip     = str(addr)
+            pace   = _Pacer(host_rate)
+            states = {}
+
+            async def one(port):
+                try:
+                    states[port] = await probe(ip, port)
+                finally:
+                    sockets.release()
+                    probed()
 
             try:
-                with open(xml_file) as xf:
-                    xml_content = xf.read()
-            except Exception as e:
-                socketio.emit('scan_error', {
-                    'error': f"Failed to read XML output: {e}", 'scan_id': scan_id
-                })
-                return None
+                tasks = []
+                for lo, hi in spec.intervals['tcp']:
+                    for port in range(lo, hi + 1):
+                        if ctx.cancelled.is_set():
+                            break
+                        await pace.wait()
+                        await overall.wait()
+                        await sockets.acquire()
+                        tasks.append(asyncio.ensure_future(one(port)))
+                await asyncio.gather(*tasks)
             finally:
-                try: os.remove(xml_file)
-                except OSError: pass
+                window.release()
+            h = connect_host(ip, addr.version, states)
+            if h is not None and not ctx.cancelled.is_set():
+                await asyncio.to_thread(ctx.on_host, h)   # DB write off the loop
+                open_count = len(h['ports']['port'])
+                ctx.emitter.line(f"Host {ip}: {open_count} open port(s)")
 
-            try:
-                return xmltodict.parse(xml_content)
-            except Exception as e:
-                socketio.emit('scan_error', {
-                    'error': f"Failed to parse XML: {e}", 'scan_id': scan_id
-                })
-                return None
+        running = set()
+        for net in nets:
+            for addr in network_hosts(net):
+                await window.acquire()
+                if ctx.cancelled.is_set():
+                    window.release()
+                    break
+                task = asyncio.ensure_future(scan_host(addr))
+                running.add(task)
+                task.add_done_callback(running.discard)
+        if running:
+            await asyncio.gather(*running)
+
+
+def default_tcp_ports():
+    """nmap's default TCP set (top 1000), or the top 100 without nmap-services."""
+    for n in (1000, 100):
+        try:
+            return PortSpec.parse(f"top:{n}")
+        except PortSpecError:
+            continue
+    return PortSpec()
+
+
+def raise_fd_limit(wanted):
+    """Lift the soft open-files limit towards ``wanted`` sockets; returns how
+    many can actually be open at once."""
+    if resource is None:
+        return wanted
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    need = wanted + FD_HEADROOM
+    if soft != resource.RLIM_INFINITY and soft < need:
+        limit = need if hard == resource.RLIM_INFINITY else min(need, hard)
+        try:
+            resource.setrlimit(resource.RLIMIT_NOFILE, (limit, hard))
+            soft = limit
+        except (ValueError, OSError):
+            pass
+    if soft == resource.RLIM_INFINITY:
+        return wanted
+    return max(min(wanted, soft - FD_HEADROOM), 16)
 
-        mode = (mode or "Basic").capitalize()
 
-        if mode == "Basic":
-            # one-shot scan
-            spec = ports.strip() or None
-            res = execute_nmap(target, spec, flags or "")
-            if res:
-                results_data = res.get('nmaprun', res)
+ENGINES = {e.name: e for e in (NmapEngine(), ConnectEngine())}
+
+
+def get_engine(name):
+    return ENGINES.get(name or 'nmap', ENGINES['nmap'])
+
+
+def run_scan(app, scan_id, target, ports, flags, mode, concurrency=None, priority=0):
+    """Background task that executes an nmap scan and updates the DB + emits events."""
+    with app.app_context():
+        scan_record = ScanResult.query.get(scan_id)
+        if not scan_record:
+            return
+        if scan_record.status in ("Cancelling", "Cancelled"):
+            scan_record.status = "Cancelled"
+            db.session.commit()
+            return
+        scan_record.status = "Running"
+
+        # resume: keep finished chunks, throw away what unfinished ones wrote
+        done_chunks = {'hosts': [], 'ports': [], 'full': [], 'detect': []}
+        for chunk in ScanChunk.query.filter_by(scan_id=scan_id):
+            if chunk.status == 'done':
+                done_chunks[chunk.kind].append(chunk.spec)
             else:
-                error_flag = True
+                discard_partial(scan_id, chunk)
+                db.session.delete(chunk)
+        resumed = any(done_chunks.values())
+        db.session.commit()
 
-        else:
-            # Threaded: either multiple hosts or per-port splitting
+        cancelled = threading.Event()
+        live = {'cancel': cancelled, 'procs': set()}
+        # cleaned up in the finally below however the scan ends
+        archive = detect_pool = emitter = writer = raw = None
+        with _running_lock:
+            _running[scan_id] = live
+
+        try:
+            # default concurrency
+            if not isinstance(concurrency, int) or concurrency < 1:
+                concurrency = app.config.get('DEFAULT_THREADS', 100)
+
+            # compile the spec (top:N lists, T:/U: prefixes) to plain nmap -p syntax
+            port_spec = parse_or_none(ports)
+            ports_arg = str(port_spec) if port_spec else (ports.strip() or None)
+
+            start_time = time.time()
+            error_flag = False
+            # children counts every nmap run (sweeps too); a lone child's own
+            # runstats go into the archive as they are
+            stats      = {'args': None, 'runstats': None, 'children': 0}
+            stats_lock = threading.Lock()
+            # a resumed run only sees part of the hosts, so it can't build the archive
+            if app.config.get('ARCHIVE_RAW_RESULTS', True) and not resumed:
+                archive = RawArchive(get_store(app).writer())
+            progress   = ProgressAggregator()
+            emitter    = ScanEmitter(app, scan_id, progress)
+            # every scan write goes through the process's single DB writer
+            writer       = get_writer(app)
+            write_errors = []
+
+            def written(future):
+                if future.exception() is not None:
+                    write_errors.append(future.exception())
+
+            def persist_host(h):
+                """Queue one finished host for the DB writer (sub-scans run in threads)."""
+                writer.submit(store_host, scan_id, h).add_done_callback(written)
+                if archive:
+                    archive.add_host(h)
+
+            engine = get_engine(scan_record.engine or app.config.get('SCAN_ENGINE', 'nmap'))
+            ctx = ScanContext(scan_id, cancelled, emitter, persist_host, live['procs'],
+                              stats, app.config)
+
+            # two-stage pipeline: sweep every target for open ports without the
+            # service/OS/script options, and as each host comes in run nmap with
+            # the full flags on just its open ports. Basic nmap scans stay one
+            # call; the connect engine can't detect anything itself, so it always
+            # hands detection to nmap this way.
+            mode = (mode or "Basic").capitalize()
+            sweep_flags, detect_flags = split_detection_flags(flags)
+            two_stage = bool(detect_flags) and app.config.get('SCAN_TWO_STAGE', True) and (
+                mode == "Threaded" or engine.name != 'nmap'
+            )
+            run_flags = sweep_flags if two_stage else (flags or "")
+            detect_ctx = ScanContext(scan_id, cancelled, emitter, persist_host, live['procs'],
+                                     stats, app.config)
+            detect_pool, detect_jobs = None, []
+
+            def detect_later(ip, spec):
+                def detect():
+                    try:
+                        return execute_child(ip, str(spec), flags or "", spec.count(), 0, 'detect')
+                    finally:
+                        if archive:
+                            archive.release(ip)
+                detect_jobs.append(detect_pool.submit(detect))
+
+            def sweep_host(h):
+                """Stage one: store the host, then queue detection on its open ports.
+                The archive holds the host until detection has merged into it."""
+                ip, spec = host_ip(h), open_port_spec(h)
+                detect = bool(ip and spec and not cancelled.is_set())
+                if detect and archive:
+                    archive.hold(ip)
+                persist_host(h)
+                if detect:
+                    detect_later(ip, spec)
+
+            if two_stage:
+                ctx.on_host = sweep_host
+                detect_pool = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=max(1, min(concurrency, app.config.get('SCAN_DETECT_WORKERS', 16)))
+                )
+                # a resumed scan picks up hosts swept last time but not yet probed
+                for ip, spec in pending_detections(scan_id, done_chunks['detect']):
+                    detect_later(ip, spec)
+
+            def checkpoint(chunk_id, kind=None, spec=None, status='running'):
+                """Create (chunk_id None) or update a ScanChunk row; returns its id.
+
+                The writer commits in order, so a chunk is only marked done once
+                the hosts it reported are in the database.
+                """
+                if chunk_id is None:
+                    return writer.call(add_chunk, scan_id, kind, spec, status)
+                writer.submit(finish_chunk, chunk_id, status).add_done_callback(written)
+                return chunk_id
+
+            def execute_child(target_spec, port_spec, extra_flags, weight=1, hosts=1, kind='full'):
+                """Wait for a governor slot, then run one engine sub-job in it.
+
+                ``weight`` (host x port probes) and ``hosts`` size this child's
+                share of the scan's overall progress. The child is checkpointed as a
+                ScanChunk of ``kind`` so a resumed scan can skip it once done.
+                """
+                if cancelled.is_set():
+                    return False
+                child_id = uuid.uuid4().hex
+                # rate budget of the target subnets first, then a process slot
+                with limiter.lease(target_spec, cancelled) as lease, \
+                        governor.slot(scan_id, priority) as slot:
+                    if cancelled.is_set():
+                        return False
+                    lease.apply(slot)
+                    if kind == 'ports':
+                        spec = port_spec
+                    elif kind == 'detect':
+                        spec = f"{target_spec} {port_spec}"
+                    elif isinstance(target_spec, (list, tuple)):
+                        spec = " ".join(target_spec)
+                    else:
+                        spec = target_spec
+                    chunk_id = checkpoint(None, kind, spec)
+                    with stats_lock:
+                        stats['children'] += 1
+                    progress.start(child_id, weight, hosts)
+                    ok = False
+                    try:
+                        if kind == 'detect':
+                            ok = ENGINES['nmap'].run(detect_ctx, child_id, target_spec,
+                                                     port_spec, extra_flags, slot)
+                        else:
+                            ok = engine.run(ctx, child_id, target_spec, port_spec, extra_flags, slot)
+                        return ok
+                    finally:
+                        progress.finish(child_id)
+                        emitter.poke()
+                        if cancelled.is_set():
+                            status = 'cancelled'
+                        else:
+                            status = 'done' if ok else 'failed'
+                        checkpoint(chunk_id, status=status)
+
+            def run_discovery(batch, live_hosts, up, slot):
+                """Ping-sweep one batch with nmap -sn, passing each up host on (and
+                into the ``up`` set); False if the sweep failed or was cancelled."""
+                cmd = ["nmap", "-sn", "-n"]
+                cmd += shlex.split(app.config.get('SCAN_DISCOVERY_PROBES', '') or '')
+                if slot.max_rate:
+                    cmd += ["--max-rate", str(slot.max_rate)]
+                cmd += ["-oX", "-"] + batch_targets(batch)
+                with stats_lock:
+                    stats['children'] += 1
+                try:
+                    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+                except FileNotFoundError:
+                    return False
+                with _running_lock:
+                    live['procs'].add(proc)
+
+                # -sn output is small, so read the XML straight from stdout
+                stream = HostStream()
+                try:
+                    for data in proc.stdout:
+                        for h in stream.feed(data):
+                            ip = host_ip(h)
+                            if ip and (h.get('status') or {}).get('@state', 'up') == 'up':
+                                addr = ipaddress.ip_address(ip)
+                                up.add(addr)
+                                live_hosts.put(addr)
+                    proc.wait()
+                    if proc.returncode != 0 or cancelled.is_set():
+                        return False
+                    stream.close()
+                except ET.ParseError:
+                    return False
+                finally:
+                    with _running_lock:
+                        live['procs'].discard(proc)
+                return True
+
+            def sweep(host_iter, live_hosts, batch_size):
+                """Discovery stage: feed up hosts to the port stage as they answer.
+
+                Addresses that stay silent are credited to progress as finished,
+                since no port scan will ever cover them. A batch whose sweep fails
+                is passed on whole rather than dropped.
+                """
+                swept = 0
+                try:
+                    while not cancelled.is_set():
+                        batch = list(itertools.islice(host_iter, batch_size))
+                        if not batch:
+                            break
+                        up = set()
+                        with limiter.lease(batch_targets(batch), cancelled) as lease, \
+                                governor.slot(scan_id, priority) as slot:
+                            lease.apply(slot)
+                            ok = run_discovery(batch, live_hosts, up, slot)
+                        if not ok:
+                            if cancelled.is_set():
+                                break
+                            emitter.line(f"Host discovery failed for {len(batch)} "
+                                         "addresses; scanning them all")
+                            for addr in batch:
+                                if addr not in up:
+                                    live_hosts.put(addr)
+                                    up.add(addr)
+                        swept += len(batch)
+                        dead = len(batch) - len(up)
+                        progress.credit(dead * nports, dead)
+                        emitter.poke()
+                finally:
+                    live_hosts.close()
+                emitter.line(f"Host discovery: {live_hosts.found} of {swept} addresses up")
+
+            def run_parallel(jobs, workers):
+                """Run (target, port_spec, weight, hosts) jobs on a pool; True if all succeeded."""
+                ok = True
+                with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                    futures = [
+                        executor.submit(execute_child, t, p, run_flags, w, h, 'ports')
+                        for t, p, w, h in jobs
+                    ]
+                    for fut in concurrent.futures.as_completed(futures):
+                        if not fut.result():
+                            ok = False
+                return ok
+
+            def run_batched(batcher, workers):
+                """Keep ``workers`` host batches in flight, resizing as batches finish."""
+                def timed_batch(batch):
+                    began = time.time()
+                    ok = execute_child(
+                        batch_targets(batch), ports_arg, run_flags,
+                        len(batch) * nports, len(batch), 'hosts'
+                    )
+                    return ok, time.time() - began
+
+                ok = True
+                with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                    pending = {}
+
+                    def submit_next():
+                        if cancelled.is_set():
+                            return False
+                        batch = batcher.next_batch()
+                        if batch:
+                            pending[executor.submit(timed_batch, batch)] = len(batch)
+                        return bool(batch)
+
+                    for _ in range(workers):
+                        if not submit_next():
+                            break
+                    while pending:
+                        done, _ = concurrent.futures.wait(
+                            pending, return_when=concurrent.futures.FIRST_COMPLETED
+                        )
+                        for fut in done:
+                            count = pending.pop(fut)
+                            success, elapsed = fut.result()
+                            ok = ok and success
+                            batcher.record(count, elapsed)
+                            submit_next()
+                return ok
+
+            total  = 1
+            nports = count_ports(ports)
             try:
                 if '/' in target or '-' in target:
                     net = ipaddress.ip_network(target, strict=False)
-                    hosts_list = [str(h) for h in net.hosts()]
                 else:
-                    hosts_list = [target]
-            except Exception:
-                hosts_list = [target]
-
-            # Many hosts -> parallel host scans
-            if len(hosts_list) > 1:
-                host_entries = []
-                with concurrent.futures.ThreadPoolExecutor(
-                    max_workers=min(concurrency, len(hosts_list))
-                ) as executor:
-                    futures = {
-                        executor.submit(execute_nmap, h, ports or None, flags or ""): h
-                        for h in hosts_list
-                    }
-                    for future in concurrent.futures.as_completed(futures):
-                        res = future.result()
-                        if res:
-                            host_data = res.get('nmaprun', {}).get('host')
-                            if host_data:
-                                host_entries.append(host_data)
-                        else:
-                            error_flag = True
-
-                combined = {'nmaprun': {
-                    'host': host_entries if len(host_entries)>1 else host_entries[0]
-                }}
-                total = len(hosts_list)
-                up = len(host_entries)
-                down = total - up
-                elapsed = time.time() - start_time
-                ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+                    net = None
+            except ValueError:
+                net = None
 
-                combined['nmaprun']['runstats'] = {
-                    'finished': {
-                        '@time': str(int(time.time())),
-                        '@timestr': ts,
-                        '@elapsed': f"{elapsed:.2f}",
-                        '@summary': f"Nmap done at {ts}; {total} IP address(es) ({up} host(s) up) scanned in {elapsed:.2f} seconds",
-                        '@exit': 'success'
-                    },
-                    'hosts': {'@up': str(up), '@down': str(down), '@total': str(total)}
-                }
-                results_data = combined
+            if mode == "Basic":
+                # one-shot scan; nmap takes every address of a network, network
+                # and broadcast included
+                if net is not None:
+                    total = net.num_addresses
+                progress.total_work, progress.total_hosts = nports, 1
+                if not done_chunks['full']:
+                    error_flag = not execute_child(target, ports_arg, run_flags, nports)
 
             else:
-                # single host, split ports
-                if ports.strip():
-                    # build full port list
-                    parts = ports.replace(' ','').split(',')
-                    port_nums = []
-                    for p in parts:
-                        if '-' in p:
-                            a,b = p.split('-',1)
-                            try:
-                                port_nums += list(range(int(a), int(b)+1))
-                            except: pass
-                        else:
-                            try: port_nums.append(int(p))
-                            except: pass
-                    port_nums = sorted(set(port_nums))
-
-                    if port_nums:
-                        num_threads = min(concurrency, len(port_nums))
-                        chunk = math.ceil(len(port_nums)/num_threads)
-                        partial = []
-                        with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
-                            futures = []
-                            for i in range(num_threads):
-                                subset = port_nums[i*chunk:(i+1)*chunk]
-                                if not subset: continue
-                                spec = ",".join(map(str, subset))
-                                futures.append(
-                                    executor.submit(execute_nmap, target, spec, flags or "")
-                                )
-                            for fut in concurrent.futures.as_completed(futures):
-                                res = fut.result()
-                                if res:
-                                    hd = res.get('nmaprun', {}).get('host')
-                                    if hd:
-                                        partial.append(hd)
-                                else:
-                                    error_flag = True
-
-                        if partial:
-                            base = partial[0]
-                            merged_ports = []
-                            for h in partial:
-                                ports_block = h.get('ports',{}).get('port')
-                                if ports_block:
-                                    merged_ports += (ports_block if isinstance(ports_block,list) else [ports_block])
-                            try:
-                                merged_ports.sort(key=lambda x: int(x.get('@portid',0)))
-                            except:
-                                pass
-                            ps = base.setdefault('ports',{})
-                            ps['port'] = merged_ports
-                            combined = {'nmaprun': {'host': base}}
-                            elapsed = time.time()-start_time
-                            ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-                            combined['nmaprun']['runstats'] = {
-                                'finished': {
-                                    '@time': str(int(time.time())),
-                                    '@timestr': ts,
-                                    '@elapsed': f"{elapsed:.2f}",
-                                    '@summary': f"Nmap done at {ts}; 1 IP address (1 host up) scanned in {elapsed:.2f} seconds",
-                                    '@exit': 'success'
-                                },
-                                'hosts': {'@up':'1','@down':'0','@total':'1'}
-                            }
-                            results_data = combined
-                        else:
-                            error_flag = True
-                    else:
-                        # no ports after parse, fallback
-                        res = execute_nmap(target, None, flags or "")
-                        if res:
-                            results_data = res.get('nmaprun', res)
-                        else:
-                            error_flag = True
+                # Threaded: either multiple hosts or per-port splitting
+                # Many hosts -> adaptive host batches, drawn lazily from the network
+                if net is not None and net.num_addresses > 1:
+                    total = net.num_addresses
+                    if net.version == 4 and net.prefixlen < 31:
+                        total -= 2  # hosts() skips network + broadcast
+                    elif net.version == 6 and net.prefixlen < 127:
+                        total -= 1  # ... and the subnet-router anycast address
+                    workers = min(concurrency, total)
+                    progress.total_work, progress.total_hosts = total * nports, total
+
+                    host_iter = net.hosts()
+                    done_spans = address_intervals(done_chunks['hosts'])
+                    if done_spans:
+                        host_iter = (h for h in host_iter if not in_intervals(done_spans, h))
+                        done_hosts = sum(hi - lo + 1 for lo, hi in done_spans)
+                        progress.credit(done_hosts * nports, done_hosts)
+
+                    # ping-sweep first and port-scan only what answers, unless
+                    # the scan asked to treat every address as up (-Pn)
+                    discover = scan_record.host_discovery
+                    if discover is None:
+                        discover = app.config.get('SCAN_HOST_DISCOVERY', True)
+                    if '-Pn' in split_flags(flags):
+                        discover = False
+                    sweeper = None
+                    if discover:
+                        live_hosts = LiveHosts()
+                        sweeper = threading.Thread(
+                            target=sweep, daemon=True,
+                            args=(host_iter, live_hosts,
+                                  app.config.get('SCAN_DISCOVERY_BATCH_HOSTS', 4096))
+                        )
+                        sweeper.start()
+                        host_iter = live_hosts
+
+                    # a profile's batch_hosts pins the batch size
+                    pinned  = scan_record.batch_hosts
+                    batcher = HostBatcher(
+                        host_iter, workers, total=None if discover else total,
+                        initial=pinned or app.config.get('SCAN_BATCH_INITIAL_HOSTS', 8),
+                        min_size=pinned or app.config.get('SCAN_BATCH_MIN_HOSTS', 1),
+                        max_size=pinned or app.config.get('SCAN_BATCH_MAX_HOSTS', 1024),
+                        target_seconds=app.config.get('SCAN_BATCH_SECONDS', 60)
+                    )
+                    error_flag = not run_batched(batcher, workers)
+                    if sweeper is not None:
+                        sweeper.join()
+
                 else:
-                    # no ports specified => single call
-                    res = execute_nmap(target, None, flags or "")
-                    if res:
-                        results_data = res.get('nmaprun', res)
-                    else:
-                        error_flag = True
+                    # single host: split the port set into cost-balanced chunks
+                    done = PortSpec()
+                    for spec in done_chunks['ports']:
+                        done = done.union(parse_or_none(spec) or PortSpec())
+                    todo = port_spec.subtract(done) if port_spec else PortSpec()
+                    if done:
+                        progress.credit(done.count(), done.count() / port_spec.count())
 
-        # finalize DB record
-        if error_flag or not results_data:
-            scan_record.status = "Failed"
-            scan_record.results_json = None
-        else:
-            scan_record.status = "Completed"
-            try:
-                scan_record.results_json = json.dumps(results_data)
-            except TypeError:
-                scan_record.results_json = json.dumps(results_data, default=str)
+                    if todo:
+                        # every chunk reports the same host; archive it once
+                        if archive:
+                            archive.hold_all()
+                        chunks = todo.chunks(concurrency)
+                        progress.total_work = todo.count() + done.count()
+                        progress.total_hosts = 1
+                        jobs = [
+                            (target, str(c), c.count(), c.count() / progress.total_work)
+                            for c in chunks
+                        ]
+                        error_flag = not run_parallel(jobs, len(jobs))
+                    elif not done and not done_chunks['full']:
+                        # no ports specified (or none parsed) => single call
+                        progress.total_work, progress.total_hosts = nports, 1
+                        error_flag = not execute_child(target, None, run_flags, nports)
 
-        db.session.commit()
-        socketio.emit('scan_complete', {'scan_id': scan_id})
-
-        # record service changes if any
-        if scan_record.status == "Completed":
-            record_changes(scan_record)
-
-
-def record_changes(scan):
-    """Compare to previous completed scan on same target and log added/removed ports."""
-    prev = (
-        ScanResult.query
-        .filter(ScanResult.target == scan.target,
-                ScanResult.id < scan.id,
-                ScanResult.status == 'Completed')
-        .order_by(ScanResult.id.desc())
-        .first()
-    )
-    if not prev:
-        return
+            # stage two finishes the hosts the sweep queued
+            if detect_pool is not None:
+                detect_pool.shutdown(wait=True)
+                if not all(job.result() for job in detect_jobs):
+                    error_flag = True
+
+            # every host the children reported must be in before the totals
+            with _running_lock:
+                _running.pop(scan_id, None)
+            writer.flush()
+            if write_errors:
+                emitter.error(f"{len(write_errors)} database writes failed: {write_errors[0]}")
+                error_flag = True
+
+            # finalize DB record; hosts were already written as they finished, so
+            # a failed scan still keeps whatever completed before the error
+            if cancelled.is_set():
+                status = "Cancelled"
+            else:
+                status = "Failed" if error_flag else "Completed"
+            final = progress.snapshot()
+            raw   = None
+            if archive and status == "Completed":
+                elapsed = time.time() - start_time
+                ts = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+                runstats = stats['runstats'] if stats['children'] == 1 else None
+                up = ScanHost.query.filter_by(scan_id=scan_id).count()
+                raw = archive.finish(**{
+                    '@args': stats['args'],
+                    'runstats': runstats or {
+                        'finished': {
+                            '@time': str(int(time.time())),
+                            '@timestr': ts,
+                            '@elapsed': f"{elapsed:.2f}",
+                            '@summary': f"Nmap done at {ts}; {total} IP address(es) ({up} host(s) up) scanned in {elapsed:.2f} seconds",
+                            '@exit': 'success'
+                        },
+                        'hosts': {'@up': str(up), '@down': str(max(total - up, 0)), '@total': str(total)}
+                    }
+                })
+            elif archive:
+                archive.discard()
+
+            def finalize():
+                scan = db.session.get(ScanResult, scan_id)
+                scan.status          = status
+                scan.nmap_args       = scan.nmap_args or stats['args']
+                scan.finished_at     = datetime.utcnow()
+                scan.elapsed_seconds = final['elapsed']
+                scan.hosts_per_sec   = final['hosts_per_sec']
+                scan.ports_per_sec   = final['ports_per_sec']
+                if raw:
+                    scan.raw_ref, scan.raw_size = raw
+                if status == "Completed":
+                    build_summaries(scan)
+
+            writer.call(finalize)
+            emitter.complete()
 
-    def extract_services(json_root):
-        hosts = json_root.get('host') or []
-        if not isinstance(hosts, list):
-            hosts = [hosts]
-        services = set()
-        for h in hosts:
-            ports = h.get('ports', {}).get('port') or []
-            if isinstance(ports, dict):
-                ports = [ports]
-            for p in ports:
-                if p.get('state', {}).get('@state') == 'open':
-                    svc = p.get('service', {})
-                    services.add((p.get('@portid'), svc.get('@name')))
-        return services
-
-    old_json = json.loads(prev.results_json)
-    new_json = json.loads(scan.results_json)
-    old_set = extract_services(old_json.get('nmaprun', old_json))
-    new_set = extract_services(new_json.get('nmaprun', new_json))
-
-    added   = list(new_set - old_set)
-    removed = list(old_set - new_set)
-
-    if added or removed:
-        change = ChangeLog(
-            scan_id=scan.id,
-            changes={'added': added, 'removed': removed}
-        )
-        db.session.add(change)
-        db.session.commit()
\ No newline at end of file
+            # diff against the asset baseline
+            if status == "Completed":
+                writer.call(lambda: record_changes(db.session.get(ScanResult, scan_id)))
+        except BaseException:
+            # stop the children that are still running before cleaning up
+            cancel_scan(scan_id)
+            raise
+        finally:
+            with _running_lock:
+                _running.pop(scan_id, None)
+            if detect_pool is not None:
+                detect_pool.shutdown(wait=False, cancel_futures=True)
+            if archive and raw is None:
+                archive.discard()
+            if emitter is not None:
+                emitter.close()
+            if writer is not None:
+                writer.flush()
@@ -0,0 +1,217 @@
+# schedules.py
+#
+# Persistent scan schedules. Schedule rows are the source of truth; each active
+# one has an APScheduler job (id = Schedule.job_id) in a SQLAlchemy jobstore
+# that lives in the app database, so schedules survive restarts and every web
+# process sees the same jobs.
+#
+#   * triggers: crontab string, weekdays at run_at's time of day (0 = Mon ..
+#     6 = Sun, as in the UI), a fixed interval, or a single run at run_at
+#   * several web processes may each fire the same job; fire_schedule takes a
+#     lock with a conditional UPDATE of last_fired so only one enqueues
+#   * APScheduler's jitter spreads fire times randomly, and the queued job
+#     gets a deterministic run_after offset within SCHEDULE_STAGGER_SECONDS,
+#     so a few hundred nightly schedules don't all start nmap at 00:00
+#   * the retention job (RETENTION_CRON) lives in the same jobstore
+
+import zlib
+from datetime import datetime, timedelta
+
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.triggers.interval import IntervalTrigger
+from sqlalchemy import or_
+from sqlalchemy.exc import SQLAlchemyError
+
+from extensions import db, scheduler
+from models import Schedule
+
+RETENTION_JOB_ID = 'retention'
+
+DAY_NAMES = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+# the app the scheduled jobs run in; jobs are stored by reference, not pickled
+_app = None
+
+
+def init_scheduler(app):
+    """Attach the DB jobstore, start the scheduler and make sure every active
+    schedule has its job (e.g. after an upgrade from in-memory schedules)."""
+    global _app
+    _app = app
+    with app.app_context():
+        scheduler.add_jobstore(SQLAlchemyJobStore(engine=db.engine), 'default')
+        scheduler.configure(job_defaults={
+            'coalesce': True,
+            'max_instances': 1,
+            'misfire_grace_time': app.config.get('SCHEDULE_MISFIRE_GRACE_SECONDS', 300),
+        })
+        scheduler.start()
+        try:
+            for schedule in Schedule.query.filter_by(active=True):
+                if scheduler.get_job(schedule.job_id) is None:
+                    sync_job(schedule)
+        except SQLAlchemyError:
+            db.session.rollback()   # schema not created yet
+        sync_retention_job(app.config)
+
+
+def build_trigger(schedule):
+    cfg = _app.config if _app else {}
+    jitter = schedule.jitter_seconds
+    if jitter is None:
+        jitter = cfg.get('SCHEDULE_JITTER_SECONDS', 0)
+    jitter = jitter or None
+
+    if schedule.cron:
+        fields = schedule.cron.split()
+        if len(fields) != 5:
+            raise ValueError("cron needs 5 fields: minute hour day month day_of_week")
+        minute, hour, day, month, dow = fields
+        return CronTrigger(minute=minute, hour=hour, day=day, month=month,
+                           day_of_week=dow, jitter=jitter)
+    if schedule.weekdays:
+        days = ",".join(DAY_NAMES[int(d)] for d in schedule.weekdays)
+        return CronTrigger(
+            day_of_week=days,
+            hour=schedule.run_at.hour,
+            minute=schedule.run_at.minute,
+            second=schedule.run_at.second,
+            start_date=schedule.run_at.replace(hour=0, minute=0, second=0),
+            jitter=jitter
+        )
+    if schedule.interval_minutes:
+        return IntervalTrigger(
+            minutes=schedule.interval_minutes, start_date=schedule.run_at, jitter=jitter
+        )
+    return DateTrigger(run_date=schedule.run_at)
+
+
+def sync_job(schedule):
+    """Create, replace or remove the APScheduler job to match the row."""
+    if not schedule.active:
+        remove_job(schedule)
+        return
+    scheduler.add_job(
+        func='schedules:fire_schedule',
+        trigger=build_trigger(schedule),
+        args=[schedule.id],
+        id=schedule.job_id,
+        name=f"scan {schedule.target}",
+        replace_existing=True,
+    )
+
+
+def remove_job(schedule):
+    try:
+        scheduler.remove_job(schedule.job_id)
+    except Exception:
+        pass
+
+
+def sync_retention_job(cfg):
+    """The nightly retention run (retention.py), when RETENTION_FULL_DAYS is set."""
+    if not cfg.get('RETENTION_FULL_DAYS') or not cfg.get('RETENTION_CRON'):
+        try:
+            scheduler.remove_job(RETENTION_JOB_ID)
+        except Exception:
+            pass
+        return
+    minute, hour, day, month, dow = cfg['RETENTION_CRON'].split()
+    scheduler.add_job(
+        func='schedules:fire_retention',
+        trigger=CronTrigger(minute=minute, hour=hour, day=day, month=month, day_of_week=dow),
+        id=RETENTION_JOB_ID,
+        name="retention",
+        replace_existing=True,
+    )
+
+
+def next_run_time(schedule):
+    job = scheduler.get_job(schedule.job_id) if schedule.active else None
+    return job.next_run_time if job else None
+
+
+def lock_window(schedule):
+    """How long a firing blocks the next; covers jitter across processes."""
+    cfg = _app.config
+    window = cfg.get('SCHEDULE_LOCK_SECONDS', 60) + (
+        schedule.jitter_seconds if schedule.jitter_seconds is not None
+        else cfg.get('SCHEDULE_JITTER_SECONDS', 0)
+    )
+    if schedule.interval_minutes and not schedule.cron and not schedule.weekdays:
+        window = min(window, schedule.interval_minutes * 30)
+    return window
+
+
+def stagger(schedule):
+    """Stable per-schedule delay in [0, SCHEDULE_STAGGER_SECONDS)."""
+    spread = _app.config.get('SCHEDULE_STAGGER_SECONDS', 0)
+    if not spread:
+        return None
+    offset = zlib.crc32(schedule.job_id.encode()) % spread
+    return datetime.utcnow() + timedelta(seconds=offset)
+
+
+def fire_schedule(schedule_id):
+    """APScheduler entry point: enqueue one scan for the schedule, exactly once."""
+    from jobqueue import request_scan, PRIORITY_SCHEDULED
+
+    with _app.app_context():
+        schedule = Schedule.query.get(schedule_id)
+        if schedule is None or not schedule.active:
+            return
+        now = datetime.utcnow()
+        won = (
+            Schedule.query
+            .filter(Schedule.id == schedule_id,
+                    or_(Schedule.last_fired.is_(None),
+                        Schedule.last_fired < now - timedelta(seconds=lock_window(schedule))))
+            .update({'last_fired': now}, synchronize_session=False)
+        )
+        db.session.commit()
+        if not won:
+            return   # another process fired this occurrence
+
+        scan, _ = request_scan(
+            schedule.target, schedule.ports or '', schedule.flags or '', schedule.mode,
+            schedule.threads, PRIORITY_SCHEDULED, run_after=stagger(schedule),
+            fresh_seconds=_app.config.get('SCAN_FRESHNESS_SECONDS', 0)
+        )
+        schedule.last_scan_id = scan.id
+        if not schedule.recurring:
+            schedule.active = False
+        db.session.commit()
+
+
+def fire_retention():
+    """APScheduler entry point for the off-peak retention run."""
+    from retention import run_retention
+
+    with _app.app_context():
+        stats = run_retention()
+        _app.logger.info("retention: %s", stats)
+
+
+def schedule_dict(schedule):
+    """The JSON shape /schedule/api has always returned, plus the new fields."""
+    nxt = next_run_time(schedule)
+    return {
+        'id':               schedule.id,
+        'job_id':           schedule.job_id,
+        'target':           schedule.target,
+        'ports':            schedule.ports or '',
+        'flags':            schedule.flags or '',
+        'mode':             schedule.mode,
+        'threads':          schedule.threads,
+        'run_at':           schedule.run_at.isoformat(sep=' '),
+        'days_of_week':     schedule.weekdays,
+        'interval_minutes': schedule.interval_minutes,
+        'cron':             schedule.cron,
+        'jitter_seconds':   schedule.jitter_seconds,
+        'active':           schedule.active,
+        'last_fired':       schedule.last_fired.isoformat(sep=' ') if schedule.last_fired else None,
+        'last_scan_id':     schedule.last_scan_id,
+        'next_run_time':    nxt.strftime('%Y-%m-%d %H:%M:%S') if nxt else None,
+    }
@@ -44,18 +44,21 @@ function isValidIPorCIDR(str) {
   return ipv4.test(str.trim()) || ipv6.test(str.trim());
 }
 
+// Mirrors portspec.PortSpec.parse: "22,80-90", "T:22,U:53", "top:100", "1-" / "-1024"
 function isValidPorts(str) {
   if (!str) return true;
-  if (!/^[\d,\-\s]+$/.test(str)) return false;
-  return str.split(/\s*,\s*/).every(part => {
+  const inRange = p => Number.isInteger(p) && p>=1 && p<=65535;
+  return str.replace(/\s+/g, '').split(',').every(part => {
+    part = part.replace(/^[TUStus]:/, '');
+    if (/^top:\d+$/i.test(part)) return parseInt(part.slice(4),10) >= 1;
+    if (!/^\d*-?\d*$/.test(part) || part === '') return false;
     if (part.includes('-')) {
-      const [a,b] = part.split('-',2).map(x=>parseInt(x,10));
-      return Number.isInteger(a) && Number.isInteger(b)
-          && a>0 && b>=a && b<=65535;
-    } else {
-      const p = parseInt(part,10);
-      return Number.isInteger(p) && p>=1 && p<=65535;
+      const [a,b] = part.split('-',2);
+      const lo = a === '' ? 1 : parseInt(a,10);
+      const hi = b === '' ? 65535 : parseInt(b,10);
+      return inRange(lo) && inRange(hi) && hi>=lo;
     }
+    return inRange(parseInt(part,10));
   });
 }
 // Schedule Scan
@@ -64,6 +67,7 @@ document.getElementById('schedule-form').addEventListener('submit', async e => {
   let form = e.target, data = new FormData(form);
   let obj = {};
   data.forEach((v,k)=>obj[k]=v);
+  obj.days_of_week = data.getAll('days_of_week');
   let res = await fetch('/schedule/submit', {
     method:'POST',
     headers:{'Content-Type':'application/json'},
@@ -97,6 +101,23 @@ const outputEl         = document.getElementById("output");
 // Determine default threads from the page
 const defaultThreads = parseInt(threadsInput.value, 10) || 100;
 
+// The scan this page is following; events are delivered per-scan room
+let currentScanId = null;
+// status line for the followed scan, kept above the replayed backlog
+let scanNotice = "";
+
+function followScan(scanId) {
+  if (currentScanId !== null) socket.emit("leave", { scan_id: currentScanId });
+  currentScanId = scanId;
+  socket.emit("join", { scan_id: scanId });
+}
+
+function appendLines(lines) {
+  if (!lines || !lines.length) return;
+  outputEl.textContent += lines.join("\n") + "\n";
+  outputEl.scrollTop = outputEl.scrollHeight;
+}
+
 // Build and update the live Nmap command string
 function updateCmd() {
   const target = targetInput.value.trim() || "<target>";
@@ -152,8 +173,11 @@ scanBtn.addEventListener("click", () => {
   const threads = parseInt(threadsInput.value, 10) || defaultThreads;
   const preset = presetSelect.value;
   const custom_flags = customFlagsInput.value.trim();
+  const skip_discovery = document.getElementById("skipDiscovery").checked;
+  const engine = document.getElementById("engineSelect").value;
   // Disable UI while scan is running
   scanBtn.disabled = true;
+  scanNotice = "";
   outputEl.textContent = "";
   if (progressBar) {
     progressBar.value = 0;
@@ -162,7 +186,7 @@ scanBtn.addEventListener("click", () => {
   fetch("/scan", {
     method: "POST",
     headers: {"Content-Type": "application/json"},
-    body: JSON.stringify({ target, ports, mode, threads, preset, custom_flags })
+    body: JSON.stringify({ target, ports, mode, threads, preset, custom_flags, skip_discovery, engine })
   })
   .then(res => res.json())
   .then(data => {
@@ -170,7 +194,20 @@ scanBtn.addEventListener("click", () => {
       alert("Failed to start scan: " + data.error);
       scanBtn.disabled = false;
       if (progressBar) progressBar.style.display = "none";
+      return;
+    }
+    if (data.status === "fresh") {
+      // an identical scan finished moments ago; show it instead of rescanning
+      outputEl.innerHTML = `-- Recent identical scan: <a href="/view/${data.scan_id}">#${data.scan_id}</a> --\n`;
+      scanBtn.disabled = false;
+      if (progressBar) progressBar.style.display = "none";
+      return;
+    }
+    if (data.status === "attached") {
+      scanNotice = `-- Joined identical scan #${data.scan_id} already in progress --\n`;
+      outputEl.textContent = scanNotice;
     }
+    followScan(data.scan_id);
   })
   .catch(() => {
     alert("Failed to start scan.");
@@ -180,25 +217,38 @@ scanBtn.addEventListener("click", () => {
 });
 
 // WebSocket events for real-time updates
+socket.on("scan_backlog", data => {
+  if (data.scan_id !== currentScanId) return;
+  outputEl.textContent = scanNotice;
+  appendLines(data.messages);
+});
+
 socket.on("scan_update", data => {
-  outputEl.textContent += data.message + "\n";
-  outputEl.scrollTop = outputEl.scrollHeight;
+  if (data.scan_id !== currentScanId) return;
+  appendLines(data.messages || [data.message]);
 });
 
 socket.on("scan_progress", data => {
+  if (data.scan_id !== currentScanId) return;
   if (data.percent !== undefined && progressBar) {
     progressBar.style.display = "block";
     progressBar.value = data.percent;
+    if (data.eta_seconds != null) {
+      progressBar.title = `${data.percent}% - ETA ${Math.round(data.eta_seconds)}s`
+        + ` (${data.hosts_per_sec} hosts/s, ${data.ports_per_sec} ports/s)`;
+    }
   }
 });
 
 socket.on("scan_error", data => {
+  if (data.scan_id !== currentScanId) return;
   outputEl.textContent += "ERROR: " + (data.error || "Scan error") + "\n";
   scanBtn.disabled = false;
   if (progressBar) progressBar.style.display = "none";
 });
 
-socket.on("scan_complete", () => {
+socket.on("scan_complete", data => {
+  if (data.scan_id !== currentScanId) return;
   outputEl.textContent += "-- Scan completed --\n";
   scanBtn.disabled = false;
   if (progressBar) {
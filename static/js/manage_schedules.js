@@ -26,6 +26,7 @@ document.addEventListener('DOMContentLoaded', async () => {
       <td>
         ${['Mon','Tue','Wed','Thu','Fri','Sat','Sun'].map((d,i)=>`<label><input type="checkbox" data-field="days_of_week" value="${i}" ${s.days_of_week?.includes(i.toString())?'checked':''}>${d}</label>`).join(' ')}
       </td>
+      <td><input class="form-control" type="number" min="1" value="${s.interval_minutes || ''}" data-field="interval_minutes"></td>
       <td><input type="checkbox" data-field="active" ${s.active ? 'checked' : ''}></td>
       <td>${s.next_run_time||''}</td>
       <td>
@@ -1,4 +1,8 @@
+from flask import request
+from flask_socketio import join_room, leave_room, emit
+
 from extensions import socketio
+from emitter import scan_room, recent_lines
 
 @socketio.on('connect')
 def on_connect():
@@ -6,4 +10,28 @@ def on_connect():
 
 @socketio.on('disconnect')
 def on_disconnect():
-    print("WebSocket client disconnected.")
\ No newline at end of file
+    print("WebSocket client disconnected.")
+
+@socketio.on('join')
+def on_join(data):
+    """Subscribe to one scan's events and replay its recent log lines."""
+    try:
+        scan_id = int((data or {}).get('scan_id'))
+    except (TypeError, ValueError):
+        return
+    join_room(scan_room(scan_id))
+
+    lines = recent_lines(scan_id)
+    if lines is None:
+        from models import ScanResult
+        scan  = ScanResult.query.get(scan_id)
+        lines = scan.log_tail.split("\n") if scan and scan.log_tail else []
+    emit('scan_backlog', {'scan_id': scan_id, 'messages': lines}, to=request.sid)
+
+@socketio.on('leave')
+def on_leave(data):
+    try:
+        scan_id = int((data or {}).get('scan_id'))
+    except (TypeError, ValueError):
+        return
+    leave_room(scan_room(scan_id))
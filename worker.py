@@ -0,0 +1,159 @@
+# worker.py
+#
+# Scanner worker entry point. Each worker process leases ScanJobs from the
+# shared database and runs them, so scans survive web restarts and can be
+# spread over several processes or nodes:
+#
+#     python worker.py --processes 4
+#
+# Point every node at the same DATABASE_URL, and set SOCKETIO_MESSAGE_QUEUE so
+# progress events emitted here reach browsers connected to the web tier.
+
+import os
+import time
+import socket
+import argparse
+import threading
+import traceback
+import multiprocessing
+
+from extensions import db
+
+
+class Worker:
+    """Lease -> run_scan -> finish loop with a heartbeat thread per job."""
+
+    def __init__(self, app, name=None):
+        self.app   = app
+        self.name  = name or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+        self.lease_seconds = app.config.get('SCAN_JOB_LEASE_SECONDS', 60)
+        self.poll_seconds  = app.config.get('SCAN_JOB_POLL_SECONDS', 2)
+        self.max_attempts  = app.config.get('SCAN_JOB_MAX_ATTEMPTS', 3)
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_forever(self):
+        while not self._stop.is_set():
+            try:
+                ran = self.run_once()
+            except Exception:
+                traceback.print_exc()
+                ran = False
+            if not ran:
+                self._stop.wait(self.poll_seconds)
+
+    def run_once(self):
+        """Lease and run a single job; returns False if the queue was empty."""
+        from jobqueue import lease, finish, fail_exhausted
+        from models import ScanResult
+
+        with self.app.app_context():
+            fail_exhausted(self.max_attempts)
+            job = lease(self.name, self.lease_seconds)
+            if job is None:
+                return False
+            job_id, scan_id, threads, priority = job.id, job.scan_id, job.threads, job.priority
+
+            scan = ScanResult.query.get(scan_id)
+            if scan is None:
+                finish(job_id, self.name, 'failed', 'scan row missing')
+                return True
+            # a retried job resumes from the scan's finished chunks
+            params = (scan.target, scan.ports or '', scan.flags or '', scan.mode)
+
+        beat_stop = threading.Event()
+        beat = threading.Thread(
+            target=self._heartbeat, args=(job_id, scan_id, beat_stop), daemon=True
+        )
+        beat.start()
+        try:
+            from scanner import run_scan
+            run_scan(self.app, scan_id, *params, threads, priority)
+            status, error = 'done', None
+            with self.app.app_context():
+                if ScanResult.query.get(scan_id).status == 'Cancelled':
+                    status = 'cancelled'
+        except Exception as e:
+            traceback.print_exc()
+            status, error = 'failed', str(e)
+            with self.app.app_context():
+                scan = ScanResult.query.get(scan_id)
+                if scan and scan.status in ('Queued', 'Running'):
+                    scan.status = 'Failed'
+                    db.session.commit()
+        finally:
+            beat_stop.set()
+            beat.join()
+
+        with self.app.app_context():
+            finish(job_id, self.name, status, error)
+        return True
+
+    def _heartbeat(self, job_id, scan_id, stop):
+        """Renew the lease and watch for a cancel request while the scan runs."""
+        from jobqueue import heartbeat
+        from models import ScanResult
+        from scanner import cancel_scan
+
+        interval  = max(self.lease_seconds / 3, 1)
+        poll      = min(self.app.config.get('SCAN_CANCEL_POLL_SECONDS', 2), interval)
+        last_beat = time.time()
+        while not stop.wait(poll):
+            try:
+                with self.app.app_context():
+                    scan = ScanResult.query.get(scan_id)
+                    if scan is not None and scan.status == 'Cancelling':
+                        cancel_scan(scan_id)
+                    if time.time() - last_beat >= interval:
+                        heartbeat(job_id, self.name, self.lease_seconds)
+                        last_beat = time.time()
+            except Exception:
+                traceback.print_exc()
+
+
+def start_embedded_workers(app, count):
+    """Local stand-in: run ``count`` queue workers as threads of this process."""
+    workers = []
+    for i in range(count):
+        w = Worker(app, name=f"{socket.gethostname()}:{os.getpid()}:embedded-{i}")
+        threading.Thread(target=w.run_forever, daemon=True).start()
+        workers.append(w)
+    return workers
+
+
+def _worker_process(index):
+    from app import create_app
+    app = create_app(start_services=False)
+    name = f"{socket.gethostname()}:{os.getpid()}:worker-{index}"
+    Worker(app, name=name).run_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run scanner worker processes.")
+    parser.add_argument('-n', '--processes', type=int, default=1,
+                        help="number of worker processes on this node")
+    args = parser.parse_args(argv)
+
+    if args.processes <= 1:
+        _worker_process(0)
+        return
+
+    procs = []
+    for i in range(args.processes):
+        p = multiprocessing.Process(target=_worker_process, args=(i,), daemon=False)
+        p.start()
+        procs.append(p)
+    try:
+        while any(p.is_alive() for p in procs):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        for p in procs:
+            p.terminate()
+    for p in procs:
+        p.join()
+
+
+if __name__ == '__main__':
+    main()